@@ -7,10 +7,12 @@ import time
 import os
 import psutil
 import redis
-from prometheus_client import start_http_server, Gauge, Counter, Histogram
+from prometheus_client import start_http_server, Gauge, Histogram, REGISTRY
+from prometheus_client.core import CounterMetricFamily
 from dotenv import load_dotenv
 from src.core.config import Config
 from src.core.logger import setup_logger, get_logger
+from src.services.task_queue import STAGES, create_task_queue
 
 # 加载环境变量
 load_dotenv()
@@ -19,13 +21,42 @@ load_dotenv()
 setup_logger()
 logger = get_logger("monitor")
 
+class TaskTransitionCollector:
+    """状态转换计数的Prometheus采集器
+    
+    计数由TaskService在Redis中累计，这里只导出最近一次读取的快照。
+    prometheus_client 的 Counter 只能 inc()，不能设置为外部累计值，因此用自定义采集器导出为 counter 类型。
+    """
+    
+    def __init__(self):
+        """初始化快照"""
+        self.transitions = {}
+    
+    def update(self, transitions: dict):
+        """更新快照 {(旧状态, 新状态): 累计次数}"""
+        self.transitions = dict(transitions)
+    
+    def collect(self):
+        """导出 giggle_task_transitions_total"""
+        family = CounterMetricFamily('giggle_task_transitions', 'Cumulative task status transitions',
+                                     labels=['from_status', 'to_status'])
+        for (from_status, to_status), count in self.transitions.items():
+            family.add_metric([from_status, to_status], count)
+        yield family
+
 # Prometheus指标
-TASK_COUNTER = Counter('giggle_tasks_total', 'Total number of tasks', ['status'])
+TASK_STATUS = Gauge('giggle_tasks', 'Current number of tasks by status', ['status'])
+TASK_TRANSITIONS = TaskTransitionCollector()
+REGISTRY.register(TASK_TRANSITIONS)
 TASK_DURATION = Histogram('giggle_task_duration_seconds', 'Task duration in seconds')
 MEMORY_USAGE = Gauge('giggle_memory_bytes', 'Memory usage in bytes')
 CPU_USAGE = Gauge('giggle_cpu_percent', 'CPU usage percentage')
 REDIS_CONNECTIONS = Gauge('giggle_redis_connections', 'Redis active connections')
-QUEUE_SIZE = Gauge('giggle_queue_size', 'Number of tasks in queue')
+QUEUE_SIZE = Gauge('giggle_queue_size', 'Number of tasks in queue', ['stage'])
+QUEUE_IN_FLIGHT = Gauge('giggle_queue_in_flight', 'Number of leased tasks being processed by workers', ['stage'])
+QUEUE_CONSUMER_PENDING = Gauge('giggle_queue_consumer_pending', 'Tasks delivered to a worker but not yet acked',
+                               ['stage', 'consumer'])
+TRANSLATION_MEMORY_HIT_RATE = Gauge('giggle_translation_memory_hit_rate', 'Translation memory hit rate')
 
 class MonitorService:
     """监控服务"""
@@ -33,6 +64,10 @@ class MonitorService:
     def __init__(self):
         """初始化监控服务"""
         self.redis_client = redis.from_url(Config.REDIS_URL)
+        self.task_queues = {
+            stage: create_task_queue(self.redis_client, stage=stage if index else None)
+            for index, stage in enumerate(STAGES)
+        }
         self.running = True
         
     def start_metrics_server(self):
@@ -65,9 +100,22 @@ class MonitorService:
             connections = info.get('connected_clients', 0)
             REDIS_CONNECTIONS.set(connections)
             
-            # 队列大小
-            queue_size = self.redis_client.llen('task_queue')
-            QUEUE_SIZE.set(queue_size)
+            # 各阶段的队列大小、处理中的任务数（Streams后端即消费者组滞后和待处理条目数）
+            queue_size = 0
+            for stage, queue in self.task_queues.items():
+                queue_stats = queue.stats()
+                queue_size += queue_stats['queued']
+                QUEUE_SIZE.labels(stage=stage).set(queue_stats['queued'])
+                QUEUE_IN_FLIGHT.labels(stage=stage).set(queue_stats['in_flight'])
+                for consumer, pending in queue_stats['consumers'].items():
+                    QUEUE_CONSUMER_PENDING.labels(stage=stage, consumer=consumer).set(pending)
+            
+            # 翻译记忆命中率
+            tm_stats = self.redis_client.hgetall('tm:stats')
+            hits = int(tm_stats.get(b'hits', 0))
+            misses = int(tm_stats.get(b'misses', 0))
+            if hits + misses:
+                TRANSLATION_MEMORY_HIT_RATE.set(hits / (hits + misses))
             
             logger.debug(f"Redis metrics - Connections: {connections}, Queue size: {queue_size}")
             
@@ -75,22 +123,22 @@ class MonitorService:
             logger.error(f"Error collecting Redis metrics: {str(e)}")
     
     def collect_task_metrics(self):
-        """收集任务指标"""
+        """收集任务指标（读取TaskService增量维护的计数，不扫描任务）"""
         try:
-            # 获取所有任务
-            task_keys = self.redis_client.keys('task:*')
-            
-            # 统计任务状态
-            status_counts = {}
-            for key in task_keys:
-                task_data = self.redis_client.hgetall(key)
-                if task_data:
-                    status = task_data.get(b'status', b'unknown').decode('utf-8')
-                    status_counts[status] = status_counts.get(status, 0) + 1
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.hgetall('tasks:status_counts')
+            pipe.hgetall('tasks:transitions')
+            status_counts, transitions = pipe.execute()
             
             # 更新Prometheus指标
             for status, count in status_counts.items():
-                TASK_COUNTER.labels(status=status).inc(count)
+                TASK_STATUS.labels(status=status.decode('utf-8')).set(int(count))
+            
+            snapshot = {}
+            for transition, count in transitions.items():
+                from_status, _, to_status = transition.decode('utf-8').partition('->')
+                snapshot[(from_status, to_status)] = int(count)
+            TASK_TRANSITIONS.update(snapshot)
             
             logger.debug(f"Task metrics - Status counts: {status_counts}")
             
@@ -8,14 +8,25 @@ import json
 import base64
 import gzip
 import glob
+from src.services import package_format
 
 def read_gcp_file(file_path):
     """读取.gcp文件内容"""
     print(f"=== 读取文件: {os.path.basename(file_path)} ===")
     
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
+        with open(file_path, 'rb') as f:
+            raw = f.read()
+        
+        # v2 二进制格式
+        if package_format.detect_format(raw) == 'v2':
+            print("文件头: giggle-compact-v2")
+            data = package_format.decode_v2(raw)
+            print("✅ 成功解析v2包:")
+            print(json.dumps(data, indent=2, ensure_ascii=False))
+            return data
+        
+        lines = raw.decode('utf-8').splitlines(keepends=True)
         
         if len(lines) >= 2:
             header = lines[0].strip()
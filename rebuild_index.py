@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+根据output目录中的 .gcp 文件重建打包文件索引，并重建Redis中的任务列表索引
+"""
+
+import sys
+from dotenv import load_dotenv
+from src.core.config import Config
+from src.core.logger import setup_logger, get_logger
+from src.services.packaging_service import PackagingService
+from src.services.task_service import TaskService
+
+# 加载环境变量
+load_dotenv()
+
+# 设置日志
+setup_logger()
+logger = get_logger("rebuild_index")
+
+def main():
+    """主函数"""
+    try:
+        packaging_service = PackagingService()
+        count = packaging_service.rebuild_index()
+        print(f"索引重建完成: {count} 个打包文件 -> {Config.PACKAGE_INDEX_PATH}")
+        
+        task_count = TaskService().rebuild_task_index()
+        print(f"任务索引重建完成: {task_count} 个任务")
+    except Exception as e:
+        logger.error(f"Failed to rebuild package index: {str(e)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
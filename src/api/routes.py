@@ -42,6 +42,11 @@ def create_task():
             if not Config.is_language_supported(lang):
                 raise BadRequest(f"Unsupported language: {lang}")
         
+        # 验证Whisper模型（可选，默认使用 WHISPER_MODEL）
+        whisper_model = data.get('whisper_model')
+        if whisper_model and whisper_model not in Config.WHISPER_MODELS:
+            raise BadRequest(f"Unsupported Whisper model: {whisper_model}")
+        
         # 创建任务
         task_id = str(uuid.uuid4())
         task_data = {
@@ -51,6 +56,8 @@ def create_task():
             'target_languages': target_languages,
             'status': 'pending'
         }
+        if whisper_model:
+            task_data['whisper_model'] = whisper_model
         
         # 保存任务
         if not task_service.create_task(task_data):
@@ -144,6 +151,36 @@ def cancel_task(task_id):
         logger.error(f"Error cancelling task {task_id}: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@api_bp.route('/tasks/<task_id>/retry', methods=['POST'])
+def retry_task(task_id):
+    """重试失败或已取消的任务（已完成的阶段从检查点恢复）"""
+    try:
+        task = task_service.get_task(task_id)
+        if not task:
+            raise NotFound(f"Task not found: {task_id}")
+        
+        if task['status'] not in ('failed', 'cancelled'):
+            raise BadRequest(f"Task cannot be retried in status: {task['status']}")
+        
+        if not task_service.retry_task(task_id):
+            return jsonify({'error': 'Failed to retry task'}), 500
+        
+        return jsonify({
+            'task_id': task_id,
+            'status': 'pending',
+            'message': 'Task queued for retry'
+        })
+        
+    except NotFound as e:
+        logger.error(f"Task not found: {task_id}")
+        return jsonify({'error': str(e)}), 404
+    except BadRequest as e:
+        logger.error(f"Bad request: {str(e)}")
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error retrying task {task_id}: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 @api_bp.route('/tasks', methods=['GET'])
 def list_tasks():
     """列出所有任务"""
@@ -151,15 +188,17 @@ def list_tasks():
         page = int(request.args.get('page', 1))
         per_page = int(request.args.get('per_page', 10))
         status = request.args.get('status')
+        cursor = request.args.get('cursor')
         
-        tasks = task_service.list_tasks(page=page, per_page=per_page, status=status)
+        tasks = task_service.list_tasks(page=page, per_page=per_page, status=status, cursor=cursor)
         
         return jsonify({
             'tasks': tasks['items'],
             'total': tasks['total'],
             'page': page,
             'per_page': per_page,
-            'pages': tasks['pages']
+            'pages': tasks['pages'],
+            'next_cursor': tasks.get('next_cursor')
         })
         
     except Exception as e:
@@ -219,83 +258,15 @@ def query_package_content():
         if not language:
             raise BadRequest("language is required")
         
-        # 扫描所有打包文件
-        output_dir = Config.OUTPUT_FOLDER
-        if not os.path.exists(output_dir):
-            raise NotFound("No output directory found")
-        
-        # 查找所有.gcp文件
-        gcp_files = [f for f in os.listdir(output_dir) if f.endswith('.gcp')]
-        if not gcp_files:
+        if packaging_service.ensure_index() == 0:
             raise NotFound("No package files found")
         
-        # 遍历所有文件查找匹配的内容
-        for filename in gcp_files:
-            filepath = os.path.join(output_dir, filename)
-            
-            try:
-                package_data = packaging_service.read_package(filepath)
-                if not package_data:
-                    continue
-                
-                content = package_data.get('content', {})
-                task_id = package_data.get('metadata', {}).get('task_id', 'unknown')
-                
-                # 查询逻辑
-                found_result = None
-                
-                if language == 'original':
-                    # 查询原始文本
-                    original = content.get('original', {})
-                    if original and (not source or original.get('source') == source):
-                        found_result = {
-                            'task_id': task_id,
-                            'language': language,
-                            'text_id': text_id,
-                            'found': True,
-                            'text': original.get('text', ''),
-                            'source': original.get('source', 'TEXT'),
-                            'filename': filename
-                        }
-                
-                elif language == 'audio':
-                    # 查询音频转录
-                    audio = content.get('audio', {})
-                    if audio and (not source or audio.get('source') == source):
-                        found_result = {
-                            'task_id': task_id,
-                            'language': language,
-                            'text_id': text_id,
-                            'found': True,
-                            'text': audio.get('text', ''),
-                            'source': audio.get('source', 'AUDIO'),
-                            'confidence': audio.get('confidence', 0),
-                            'filename': filename
-                        }
-                
-                else:
-                    # 查询翻译
-                    translations = content.get('translations', {})
-                    if language in translations:
-                        translation = translations[language]
-                        if not source or translation.get('source') == source:
-                            found_result = {
-                                'task_id': task_id,
-                                'language': language,
-                                'text_id': text_id,
-                                'found': True,
-                                'text': translation.get('text', ''),
-                                'source': translation.get('source', 'TEXT'),
-                                'filename': filename
-                            }
-                
-                # 如果找到匹配的内容，立即返回
-                if found_result:
-                    return jsonify(found_result)
-                    
-            except Exception as e:
-                logger.warning(f"Error reading package {filename}: {str(e)}")
-                continue
+        # 通过索引查找第一个匹配的内容
+        results = packaging_service.query_index(language, text_id=text_id, source=source, limit=1)
+        if results:
+            found_result = results[0]
+            found_result['found'] = True
+            return jsonify(found_result)
         
         # 如果没有找到匹配的内容
         return jsonify({
@@ -318,79 +289,18 @@ def query_all_packages():
     try:
         # 获取查询参数
         language = request.args.get('language')
+        text_id = request.args.get('text_id')  # None表示任意文本编号
         source = request.args.get('source')  # TEXT, AUDIO, 或 None表示任意来源
         
         # 验证必需参数
         if not language:
             raise BadRequest("language is required")
         
-        # 扫描所有打包文件
-        output_dir = Config.OUTPUT_FOLDER
-        if not os.path.exists(output_dir):
-            raise NotFound("No output directory found")
-        
-        # 查找所有.gcp文件
-        gcp_files = [f for f in os.listdir(output_dir) if f.endswith('.gcp')]
-        if not gcp_files:
+        if packaging_service.ensure_index() == 0:
             raise NotFound("No package files found")
         
-        results = []
-        
-        # 遍历所有文件查找匹配的内容
-        for filename in gcp_files:
-            filepath = os.path.join(output_dir, filename)
-            
-            try:
-                package_data = packaging_service.read_package(filepath)
-                if not package_data:
-                    continue
-                
-                content = package_data.get('content', {})
-                task_id = package_data.get('metadata', {}).get('task_id', 'unknown')
-                
-                # 查询逻辑
-                if language == 'original':
-                    # 查询原始文本
-                    original = content.get('original', {})
-                    if original and (not source or original.get('source') == source):
-                        results.append({
-                            'task_id': task_id,
-                            'language': language,
-                            'text': original.get('text', ''),
-                            'source': original.get('source', 'TEXT'),
-                            'filename': filename
-                        })
-                
-                elif language == 'audio':
-                    # 查询音频转录
-                    audio = content.get('audio', {})
-                    if audio and (not source or audio.get('source') == source):
-                        results.append({
-                            'task_id': task_id,
-                            'language': language,
-                            'text': audio.get('text', ''),
-                            'source': audio.get('source', 'AUDIO'),
-                            'confidence': audio.get('confidence', 0),
-                            'filename': filename
-                        })
-                
-                else:
-                    # 查询翻译
-                    translations = content.get('translations', {})
-                    if language in translations:
-                        translation = translations[language]
-                        if not source or translation.get('source') == source:
-                            results.append({
-                                'task_id': task_id,
-                                'language': language,
-                                'text': translation.get('text', ''),
-                                'source': translation.get('source', 'TEXT'),
-                                'filename': filename
-                            })
-                    
-            except Exception as e:
-                logger.warning(f"Error reading package {filename}: {str(e)}")
-                continue
+        # 通过索引查找所有匹配的内容
+        results = packaging_service.query_index(language, text_id=text_id, source=source)
         
         return jsonify({
             'language': language,
@@ -456,4 +366,14 @@ def get_all_texts(task_id):
         return jsonify({'error': str(e)}), 404
     except Exception as e:
         logger.error(f"Error getting texts {task_id}: {str(e)}")
-        return jsonify({'error': 'Internal server error'}), 500 
\ No newline at end of file
+        return jsonify({'error': 'Internal server error'}), 500
+
+@api_bp.route('/packages/cache/stats', methods=['GET'])
+def get_package_cache_stats():
+    """获取打包文件缓存统计"""
+    try:
+        return jsonify(packaging_service.get_cache_stats())
+        
+    except Exception as e:
+        logger.error(f"Error getting package cache stats: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
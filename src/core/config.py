@@ -21,23 +21,95 @@ class Config:
     # OpenAI配置
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
     OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')
+    OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', 60))  # 单次请求超时（秒）
+    
+    # 翻译配置
+    TRANSLATION_MAX_TOKENS = int(os.getenv('TRANSLATION_MAX_TOKENS', 4000))
+    TRANSLATION_BATCH_SIZE = int(os.getenv('TRANSLATION_BATCH_SIZE', 4))  # 每次请求的最大页数
+    TRANSLATION_BATCH_MAX_CHARS = int(os.getenv('TRANSLATION_BATCH_MAX_CHARS', 2000))
+    TRANSLATION_MAX_CONCURRENCY = int(os.getenv('TRANSLATION_MAX_CONCURRENCY', 8))  # 每个Worker的并发请求上限
+    # 每个批次一次请求翻译成所有目标语言（回复为以语言代码为键的JSON），原文只发送一次；
+    # 输出token上限 TRANSLATION_MAX_TOKENS 需能容纳所有语言的译文，超出时被截断的批次退回逐语言翻译
+    TRANSLATION_MULTI_LANGUAGE = os.getenv('TRANSLATION_MULTI_LANGUAGE', 'false').lower() == 'true'
+    
+    # LLM限流配置（所有Worker共享的令牌桶，0表示不限制）
+    LLM_RPM = int(os.getenv('LLM_RPM', 3500))  # 每分钟请求数
+    LLM_TPM = int(os.getenv('LLM_TPM', 90000))  # 每分钟token数
+    LLM_COOLDOWN_SECONDS = float(os.getenv('LLM_COOLDOWN_SECONDS', 5))  # 收到429且无Retry-After时暂停发放的秒数
+    LLM_BACKOFF_INTERVAL = float(os.getenv('LLM_BACKOFF_INTERVAL', 1))  # 两次并发减半的最小间隔（秒）
+    # AIMD并发的起始值，成功时逐步增加到 TRANSLATION_MAX_CONCURRENCY（翻译线程池大小）
+    LLM_INITIAL_CONCURRENCY = int(os.getenv('LLM_INITIAL_CONCURRENCY', max(1, TRANSLATION_MAX_CONCURRENCY // 2)))
+    # 超时、限流和服务端错误的重试（指数退避 + 抖动）
+    LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 2))
+    LLM_RETRY_BASE_DELAY = float(os.getenv('LLM_RETRY_BASE_DELAY', 1))  # 首次重试前的最长等待（秒），之后每次翻倍
+    LLM_RETRY_MAX_DELAY = float(os.getenv('LLM_RETRY_MAX_DELAY', 20))
+    # 对冲请求：超过近期耗时的 LLM_HEDGE_PERCENTILE 分位仍未返回时再发一个相同请求，取先返回的结果
+    LLM_HEDGE_ENABLED = os.getenv('LLM_HEDGE_ENABLED', 'false').lower() == 'true'
+    LLM_HEDGE_PERCENTILE = float(os.getenv('LLM_HEDGE_PERCENTILE', 0.95))
+    LLM_HEDGE_MIN_SAMPLES = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', 20))  # 样本不足时不对冲
+    # 熔断：连续失败 LLM_BREAKER_THRESHOLD 次后 LLM_BREAKER_COOLDOWN 秒内直接失败（0表示不熔断）
+    LLM_BREAKER_THRESHOLD = int(os.getenv('LLM_BREAKER_THRESHOLD', 5))
+    LLM_BREAKER_COOLDOWN = float(os.getenv('LLM_BREAKER_COOLDOWN', 30))
+    
+    # 翻译记忆配置
+    TRANSLATION_MEMORY_ENABLED = os.getenv('TRANSLATION_MEMORY_ENABLED', 'true').lower() == 'true'
+    TRANSLATION_MEMORY_TTL = int(os.getenv('TRANSLATION_MEMORY_TTL', 2592000))  # 30天
+    TRANSLATION_MEMORY_MAX_ENTRIES = int(os.getenv('TRANSLATION_MEMORY_MAX_ENTRIES', 100000))
+    TRANSLATION_MEMORY_PATH = os.getenv('TRANSLATION_MEMORY_PATH', './data/cache/translation_memory.db')
+    TRANSLATION_FUZZY_ENABLED = os.getenv('TRANSLATION_FUZZY_ENABLED', 'true').lower() == 'true'
+    TRANSLATION_FUZZY_THRESHOLD = float(os.getenv('TRANSLATION_FUZZY_THRESHOLD', 0.7))
+    
+    # 文本验证配置（逐页相似度低于阈值的页会被标记）
+    VALIDATION_PAGE_THRESHOLD = float(os.getenv('VALIDATION_PAGE_THRESHOLD', 0.8))
     
     # Whisper配置
     WHISPER_MODEL = os.getenv('WHISPER_MODEL', 'base')
     WHISPER_DEVICE = os.getenv('WHISPER_DEVICE', 'cpu')
+    # 允许按任务选择的模型（逗号分隔），加载后常驻进程
+    WHISPER_MODELS = [name.strip() for name in os.getenv('WHISPER_MODELS', WHISPER_MODEL).split(',') if name.strip()]
+    # Worker启动时预加载 WHISPER_MODELS 中的模型
+    WHISPER_PRELOAD = os.getenv('WHISPER_PRELOAD', 'false').lower() == 'true'
+    # 长音频分块并行转录（仅CPU设备），音频短于 WHISPER_CHUNK_MIN_SECONDS 时整段转录
+    WHISPER_CHUNK_SECONDS = float(os.getenv('WHISPER_CHUNK_SECONDS', 120))
+    WHISPER_CHUNK_OVERLAP = float(os.getenv('WHISPER_CHUNK_OVERLAP', 2))
+    WHISPER_CHUNK_MIN_SECONDS = float(os.getenv('WHISPER_CHUNK_MIN_SECONDS', 300))
+    # 每个Worker进程用于分块转录的进程数，默认1（不分块）；所有Worker合计约 Worker数 × WHISPER_MAX_WORKERS 个Whisper进程，不应超过CPU核数
+    WHISPER_MAX_WORKERS = int(os.getenv('WHISPER_MAX_WORKERS', 1))
     
     # 文件存储配置
     UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', './data/uploads')
     OUTPUT_FOLDER = os.getenv('OUTPUT_FOLDER', './data/output')
     MAX_CONTENT_LENGTH = int(os.getenv('MAX_CONTENT_LENGTH', 16777216))  # 16MB
+    PACKAGE_FORMAT = os.getenv('PACKAGE_FORMAT', 'v2')  # v1: Base64(gzip(JSON)), v2: 二进制分段格式
+    PACKAGE_INDEX_PATH = os.getenv('PACKAGE_INDEX_PATH', os.path.join(OUTPUT_FOLDER, 'package_index.db'))
+    PACKAGE_CACHE_MAX_ENTRIES = int(os.getenv('PACKAGE_CACHE_MAX_ENTRIES', 256))
+    PACKAGE_CACHE_MAX_BYTES = int(os.getenv('PACKAGE_CACHE_MAX_BYTES', 67108864))  # 64MB
     
     # 日志配置
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
     LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
     
     # 任务配置
-    MAX_WORKERS = int(os.getenv('MAX_WORKERS', 4))
-    TASK_TIMEOUT = int(os.getenv('TASK_TIMEOUT', 300))  # 5分钟
+    MAX_WORKERS = int(os.getenv('MAX_WORKERS', 4))  # 预fork模式下的Worker子进程数
+    WORKER_PREFORK = os.getenv('WORKER_PREFORK', 'false').lower() == 'true'  # 加载模型后fork MAX_WORKERS个子进程
+    WORKER_REPORT_INTERVAL = int(os.getenv('WORKER_REPORT_INTERVAL', 60))  # 预fork模式下汇报各子进程吞吐量的间隔（秒）
+    # Worker负责的流水线阶段（逗号分隔，stt/translate/package），下一阶段不由本Worker负责时交给该阶段的队列
+    WORKER_STAGES = [name.strip() for name in os.getenv('WORKER_STAGES', 'stt,translate,package').split(',') if name.strip()]
+    CHECKPOINT_TTL = int(os.getenv('CHECKPOINT_TTL', 604800))  # 阶段检查点在Redis中的保留时间（秒），任务完成后删除
+    TASK_TIMEOUT = int(os.getenv('TASK_TIMEOUT', 300))  # 5分钟，任务处理时限，同时是队列租约时长（处理期间由心跳续约）
+    # 处理时限在各阶段间的分配比例，前面阶段未用完的时间顺延给后面的阶段
+    STAGE_BUDGETS = {
+        stage: float(share)
+        for stage, _, share in (
+            item.strip().partition(':') for item in
+            os.getenv('STAGE_BUDGETS', 'stt:0.6,translate:0.3,package:0.1').split(',') if item.strip()
+        )
+    }
+    TASK_MAX_ATTEMPTS = int(os.getenv('TASK_MAX_ATTEMPTS', 3))  # 租约过期后重新入队的最大次数
+    QUEUE_REAP_INTERVAL = int(os.getenv('QUEUE_REAP_INTERVAL', 30))  # 回收过期租约的间隔（秒）
+    CANCEL_CHECK_INTERVAL = float(os.getenv('CANCEL_CHECK_INTERVAL', 1.0))  # 处理中检查任务是否被取消的间隔（秒）
+    TASK_QUEUE_BACKEND = os.getenv('TASK_QUEUE_BACKEND', 'list')  # list: Redis列表, stream: Redis Streams消费者组
+    QUEUE_STREAM_BATCH = int(os.getenv('QUEUE_STREAM_BATCH', 1))  # Streams后端每次XREADGROUP读取的任务数
     
     # 监控配置
     PROMETHEUS_PORT = int(os.getenv('PROMETHEUS_PORT', 9090))
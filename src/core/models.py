@@ -0,0 +1,106 @@
+"""
+任务与结果数据模型
+"""
+
+import json
+from dataclasses import dataclass, field, fields
+from typing import Dict, Any, List, Optional, Type, TypeVar
+import msgpack
+
+RecordType = TypeVar('RecordType', bound='Record')
+
+def _pack_default(value: Any) -> Any:
+    """msgpack 不支持的类型（如 numpy 标量和数组）转换为Python内置类型"""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError(f"Cannot serialize object of type {type(value).__name__}")
+
+def packb(value: Any) -> bytes:
+    """用 msgpack 编码任意值"""
+    return msgpack.packb(value, use_bin_type=True, default=_pack_default)
+
+def unpackb(blob: bytes) -> Any:
+    """解码 packb 编码的值"""
+    return msgpack.unpackb(blob, raw=False)
+
+class Record:
+    """数据记录基类：与字典互转，并用 msgpack 编码为单个二进制值
+    
+    未声明的字段保存在 extra 中，编码时原样保留。
+    """
+    
+    @classmethod
+    def field_names(cls) -> List[str]:
+        """声明的字段名（不含 extra）"""
+        return [f.name for f in fields(cls) if f.name != 'extra']
+    
+    @classmethod
+    def from_dict(cls: Type[RecordType], data: Dict[str, Any]) -> RecordType:
+        """由字典构建记录"""
+        names = set(cls.field_names())
+        known = {key: value for key, value in data.items() if key in names}
+        extra = {key: value for key, value in data.items() if key not in names and key != 'extra'}
+        return cls(**known, extra=extra)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典（extra 中的字段展开到顶层）"""
+        data = dict(self.extra)
+        for name in self.field_names():
+            data[name] = getattr(self, name)
+        return data
+    
+    def pack(self) -> bytes:
+        """编码为 msgpack 二进制"""
+        return packb(self.to_dict())
+    
+    @classmethod
+    def unpack(cls: Type[RecordType], blob: bytes) -> RecordType:
+        """由 msgpack 二进制解码"""
+        return cls.from_dict(unpackb(blob))
+    
+    @classmethod
+    def from_legacy_hash(cls: Type[RecordType], raw: Dict[Any, Any]) -> RecordType:
+        """由旧版逐字段存储的Redis哈希构建记录（值均为字符串，列表和字典为JSON）"""
+        data = {}
+        for key, value in raw.items():
+            key = key.decode('utf-8') if isinstance(key, bytes) else key
+            value = value.decode('utf-8') if isinstance(value, bytes) else value
+            if value[:1] in ('[', '{'):
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            data[key] = value
+        
+        for f in fields(cls):
+            if f.name in data and type(f.default) is int:
+                data[f.name] = int(float(data[f.name] or 0))
+        return cls.from_dict(data)
+
+@dataclass
+class TaskRecord(Record):
+    """任务记录"""
+    task_id: str
+    audio_file: str = ''
+    text_file: str = ''
+    target_languages: List[str] = field(default_factory=list)
+    status: str = 'pending'
+    progress: int = 0
+    created_at: str = ''
+    updated_at: str = ''
+    error: Optional[str] = None
+    whisper_model: Optional[str] = None
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+@dataclass
+class TaskResult(Record):
+    """任务结果记录"""
+    task_id: str
+    status: str = 'completed'
+    translations: Dict[str, str] = field(default_factory=dict)
+    translation_segments: Dict[str, Dict[str, str]] = field(default_factory=dict)
+    audio_transcription: Optional[Dict[str, Any]] = None
+    text_validation: Optional[Dict[str, Any]] = None
+    packaged_file: str = ''
+    created_at: str = ''
+    extra: Dict[str, Any] = field(default_factory=dict)
@@ -0,0 +1,84 @@
+"""
+音频分块与转录结果拼接模块
+"""
+
+from collections import Counter
+from typing import Dict, Any, List
+import numpy as np
+
+SAMPLE_RATE = 16000  # whisper.load_audio 输出的采样率
+
+def plan_chunks(audio: np.ndarray, chunk_seconds: float, overlap_seconds: float,
+                search_seconds: float = 10.0, frame_seconds: float = 0.03,
+                sample_rate: int = SAMPLE_RATE) -> List[Dict[str, int]]:
+    """按静音位置将音频切分为带重叠的块
+    
+    在每个目标切分点前后 search_seconds 内选择能量最低的帧作为切分点，
+    尽量避免切断句子。每个块的 [core_start, core_end) 为其负责的区间，
+    [start, end) 在两侧各多出 overlap_seconds 作为上下文。单位均为采样点。
+    """
+    total = len(audio)
+    chunk = int(chunk_seconds * sample_rate)
+    if chunk <= 0 or total <= chunk:
+        return [{'start': 0, 'end': total, 'core_start': 0, 'core_end': total}]
+    
+    frame = max(1, int(frame_seconds * sample_rate))
+    frame_count = total // frame
+    frames = audio[:frame_count * frame].reshape(frame_count, frame).astype(np.float32)
+    energy = np.sqrt(np.mean(frames * frames, axis=1))
+    search = int(search_seconds * sample_rate)
+    
+    boundaries = [0]
+    while total - boundaries[-1] > chunk:
+        previous = boundaries[-1]
+        target = previous + chunk
+        low = max(previous + chunk // 2, target - search) // frame
+        high = min(target + search, total - chunk // 4) // frame
+        if high > low:
+            split = (low + int(np.argmin(energy[low:high]))) * frame + frame // 2
+        else:
+            split = target
+        boundaries.append(split)
+    boundaries.append(total)
+    
+    overlap = int(overlap_seconds * sample_rate)
+    return [
+        {
+            'start': max(0, core_start - overlap),
+            'end': min(total, core_end + overlap),
+            'core_start': core_start,
+            'core_end': core_end
+        }
+        for core_start, core_end in zip(boundaries, boundaries[1:])
+    ]
+
+def stitch_results(chunks: List[Dict[str, int]], results: List[Dict[str, Any]],
+                   sample_rate: int = SAMPLE_RATE) -> Dict[str, Any]:
+    """将各块的转录结果拼接为整段结果（与 model.transcribe 的输出结构一致）
+    
+    时间戳加上块的起始偏移；重叠区域内的分段按中点归属到负责该区间的块，
+    因此每个分段只保留一次。
+    """
+    segments = []
+    languages = Counter()
+    last = len(chunks) - 1
+    
+    for index, (chunk, result) in enumerate(zip(chunks, results)):
+        offset = chunk['start'] / sample_rate
+        core_start = chunk['core_start'] / sample_rate
+        core_end = chunk['core_end'] / sample_rate
+        languages[result.get('language', 'unknown')] += core_end - core_start
+        
+        for segment in result.get('segments', []):
+            start = segment.get('start', 0.0) + offset
+            end = segment.get('end', 0.0) + offset
+            middle = (start + end) / 2
+            if middle < core_start or (middle >= core_end and index != last):
+                continue
+            segments.append(dict(segment, id=len(segments), start=start, end=end))
+    
+    return {
+        'text': ''.join(segment.get('text', '') for segment in segments).strip(),
+        'language': languages.most_common(1)[0][0] if languages else 'unknown',
+        'segments': segments
+    }
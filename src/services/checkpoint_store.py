@@ -0,0 +1,82 @@
+"""
+任务阶段检查点模块
+"""
+
+import os
+import hashlib
+from typing import Dict, Any, List, Optional
+from src.core.config import Config
+from src.core.logger import get_logger
+from src.core.models import packb, unpackb
+
+logger = get_logger("checkpoint_store")
+
+def input_hash(*parts: Any) -> str:
+    """计算阶段输入的哈希"""
+    return hashlib.sha256(packb(list(parts))).hexdigest()
+
+def file_digest(path: str) -> str:
+    """文件内容的SHA-256，文件不存在时以路径代替"""
+    if not path or not os.path.exists(path):
+        return f"missing:{path}"
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class CheckpointStore:
+    """任务阶段检查点
+    
+    每个任务一个哈希 checkpoint:<task_id>，字段为检查点名（stt、validate、translate:<语言> 等），
+    值为 {'hash': 输入哈希, 'output': 阶段输出}。读取时给出输入哈希则只返回输入一致的检查点，
+    输入（音频、源文本、模型）变化后旧检查点自动失效。Redis不可用时保存在进程内存中。
+    """
+    
+    KEY_PREFIX = 'checkpoint:'
+    
+    def __init__(self, redis_client=None):
+        """初始化检查点存储"""
+        self.redis_client = redis_client
+        self.ttl = Config.CHECKPOINT_TTL
+        self.memory_storage: Dict[str, Dict[str, bytes]] = {}
+    
+    def save(self, task_id: str, name: str, digest: str, output: Any):
+        """保存检查点"""
+        blob = packb({'hash': digest, 'output': output})
+        if self.redis_client is None:
+            self.memory_storage.setdefault(task_id, {})[name] = blob
+            return
+        
+        key = self.KEY_PREFIX + task_id
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.hset(key, name, blob)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+    
+    def load(self, task_id: str, name: str, digest: str = None) -> Optional[Dict[str, Any]]:
+        """读取检查点 {'hash', 'output'}；给出 digest 时输入哈希不一致返回 None"""
+        if self.redis_client is None:
+            blob = self.memory_storage.get(task_id, {}).get(name)
+        else:
+            blob = self.redis_client.hget(self.KEY_PREFIX + task_id, name)
+        if blob is None:
+            return None
+        
+        checkpoint = unpackb(blob)
+        if digest is not None and checkpoint['hash'] != digest:
+            return None
+        return checkpoint
+    
+    def names(self, task_id: str) -> List[str]:
+        """任务已有的检查点名"""
+        if self.redis_client is None:
+            return list(self.memory_storage.get(task_id, {}))
+        return [name.decode('utf-8') for name in self.redis_client.hkeys(self.KEY_PREFIX + task_id)]
+    
+    def clear(self, task_id: str):
+        """删除任务的全部检查点"""
+        if self.redis_client is None:
+            self.memory_storage.pop(task_id, None)
+        else:
+            self.redis_client.delete(self.KEY_PREFIX + task_id)
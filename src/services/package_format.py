@@ -0,0 +1,231 @@
+"""
+紧凑编码包格式模块
+
+giggle-compact-v1: 文件头 + Base64(gzip(JSON))，读取任何内容都需要完整解码。
+
+giggle-compact-v2: 二进制格式，每段文本单独压缩，通过段表定位::
+
+    文件头 (20字节)   magic(8) | version(u16) | flags(u16) | section_count(u32) | table_length(u32)
+    段表              每段: kind(u8) | offset(u64) | length(u32) | 三个长度(u16) | language | source | text_id
+    数据块            每块: codec(u8) | payload
+
+读取单段文本只需读取文件头和段表，再一次 seek + 一次小读取。
+"""
+
+import json
+import gzip
+import base64
+import struct
+import zlib
+from typing import Dict, Any, List, Tuple
+
+V1_HEADER = b'GIGGLE_PACKAGE_v1.0\n'
+
+V2_MAGIC = b'GIGGLEv2'
+V2_VERSION = 2
+V2_HEADER = struct.Struct('<8sHHII')
+V2_ENTRY = struct.Struct('<BQIHHH')
+
+# 段类型
+SECTION_METADATA = 0
+SECTION_TEXT = 1
+
+# 数据块编码
+CODEC_RAW = 0
+CODEC_ZLIB = 1
+
+# 元数据段的保留键
+METADATA_KEY = ('__metadata__', '', '')
+
+class PackageFormatError(ValueError):
+    """打包文件格式错误"""
+
+def detect_format(prefix: bytes) -> str:
+    """根据文件头判断格式，返回 'v1'、'v2' 或空字符串"""
+    if prefix.startswith(V2_MAGIC):
+        return 'v2'
+    if prefix.startswith(V1_HEADER):
+        return 'v1'
+    return ''
+
+def encode_v1(package_data: Dict[str, Any]) -> bytes:
+    """编码为 giggle-compact-v1"""
+    json_str = json.dumps(package_data, ensure_ascii=False, separators=(',', ':'))
+    compressed = gzip.compress(json_str.encode('utf-8'))
+    return V1_HEADER + base64.b64encode(compressed)
+
+def decode_v1(data: bytes) -> Dict[str, Any]:
+    """解码 giggle-compact-v1"""
+    if not data.startswith(V1_HEADER):
+        raise PackageFormatError("Invalid v1 package header")
+    compressed = base64.b64decode(data[len(V1_HEADER):])
+    return json.loads(gzip.decompress(compressed).decode('utf-8'))
+
+def encode_block(payload: bytes) -> bytes:
+    """编码数据块，压缩无收益时保存原文"""
+    compressed = zlib.compress(payload, 9)
+    if len(compressed) < len(payload):
+        return bytes([CODEC_ZLIB]) + compressed
+    return bytes([CODEC_RAW]) + payload
+
+def decode_block(block) -> bytes:
+    """解码数据块"""
+    codec = block[0]
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(block[1:])
+    if codec == CODEC_RAW:
+        return bytes(block[1:])
+    raise PackageFormatError(f"Unknown block codec: {codec}")
+
+def decode_text(block) -> str:
+    """解码文本数据块，未压缩的块直接从缓冲区解码为字符串"""
+    if block[0] == CODEC_RAW:
+        return str(block[1:], 'utf-8')
+    return decode_block(block).decode('utf-8')
+
+def iter_content_sections(content: Dict[str, Any]):
+    """遍历包内容，生成 (language, source, text_id, text, attributes)"""
+    entries = []
+    if 'original' in content:
+        entries.append(('original', content['original']))
+    if 'audio' in content:
+        entries.append(('audio', content['audio']))
+    for lang_code, translation in content.get('translations', {}).items():
+        entries.append((lang_code, translation))
+    
+    for language, entry in entries:
+        source = entry.get('source', 'AUDIO' if language == 'audio' else 'TEXT')
+        attributes = {
+            key: value for key, value in entry.items()
+            if key not in ('text', 'source', 'segments')
+        }
+        yield language, source, 'main', entry.get('text', ''), attributes
+        for text_id, text in entry.get('segments', {}).items():
+            yield language, source, str(text_id), text, None
+
+def encode_v2(package_data: Dict[str, Any]) -> Tuple[bytes, List[Dict[str, Any]]]:
+    """编码为 giggle-compact-v2，返回文件内容和段表"""
+    content = package_data.get('content', {})
+    attributes = {}
+    texts = []
+    for language, source, text_id, text, attrs in iter_content_sections(content):
+        if attrs:
+            attributes[language] = attrs
+        texts.append((language, source, text_id, text))
+    
+    meta = {
+        'metadata': package_data.get('metadata', {}),
+        'attributes': attributes
+    }
+    meta_json = json.dumps(meta, ensure_ascii=False, separators=(',', ':'))
+    
+    blocks = [(SECTION_METADATA,) + METADATA_KEY + (encode_block(meta_json.encode('utf-8')),)]
+    for language, source, text_id, text in texts:
+        blocks.append((SECTION_TEXT, language, source, text_id, encode_block(text.encode('utf-8'))))
+    
+    # 先计算段表长度，确定各数据块的偏移量
+    encoded_keys = []
+    table_length = 0
+    for kind, language, source, text_id, block in blocks:
+        keys = (language.encode('utf-8'), source.encode('utf-8'), text_id.encode('utf-8'))
+        encoded_keys.append(keys)
+        table_length += V2_ENTRY.size + sum(len(k) for k in keys)
+    
+    offset = V2_HEADER.size + table_length
+    table = bytearray()
+    sections = []
+    for (kind, language, source, text_id, block), keys in zip(blocks, encoded_keys):
+        table += V2_ENTRY.pack(kind, offset, len(block), *(len(k) for k in keys))
+        table += b''.join(keys)
+        sections.append({
+            'kind': kind,
+            'language': language,
+            'source': source,
+            'text_id': text_id,
+            'offset': offset,
+            'length': len(block)
+        })
+        offset += len(block)
+    
+    header = V2_HEADER.pack(V2_MAGIC, V2_VERSION, 0, len(blocks), table_length)
+    data = header + bytes(table) + b''.join(block for *_, block in blocks)
+    return data, sections
+
+def parse_v2_header(data) -> Tuple[int, int]:
+    """解析 v2 文件头，返回 (段数量, 段表长度)"""
+    if len(data) < V2_HEADER.size:
+        raise PackageFormatError("Truncated v2 package header")
+    magic, version, _flags, section_count, table_length = V2_HEADER.unpack_from(data, 0)
+    if magic != V2_MAGIC:
+        raise PackageFormatError("Invalid v2 package header")
+    if version != V2_VERSION:
+        raise PackageFormatError(f"Unsupported package version: {version}")
+    return section_count, table_length
+
+def parse_v2_table(table, section_count: int) -> List[Dict[str, Any]]:
+    """解析 v2 段表"""
+    sections = []
+    pos = 0
+    for _ in range(section_count):
+        kind, offset, length, lang_len, source_len, text_id_len = V2_ENTRY.unpack_from(table, pos)
+        pos += V2_ENTRY.size
+        language = bytes(table[pos:pos + lang_len]).decode('utf-8')
+        pos += lang_len
+        source = bytes(table[pos:pos + source_len]).decode('utf-8')
+        pos += source_len
+        text_id = bytes(table[pos:pos + text_id_len]).decode('utf-8')
+        pos += text_id_len
+        sections.append({
+            'kind': kind,
+            'language': language,
+            'source': source,
+            'text_id': text_id,
+            'offset': offset,
+            'length': length
+        })
+    return sections
+
+def decode_v2_metadata(block) -> Dict[str, Any]:
+    """解码 v2 元数据段"""
+    return json.loads(decode_block(block).decode('utf-8'))
+
+def build_package_data(meta: Dict[str, Any], texts: List[Tuple[Dict[str, Any], str]]) -> Dict[str, Any]:
+    """根据元数据段和文本段还原与 v1 相同的包数据结构"""
+    attributes = meta.get('attributes', {})
+    content = {'translations': {}}
+    
+    for section, text in texts:
+        language = section['language']
+        if language in ('original', 'audio'):
+            entry = content.setdefault(language, {'source': section['source']})
+        else:
+            entry = content['translations'].setdefault(language, {'source': section['source']})
+        
+        if section['text_id'] == 'main':
+            entry['text'] = text
+            entry.update(attributes.get(language, {}))
+        else:
+            entry.setdefault('segments', {})[section['text_id']] = text
+    
+    return {
+        'metadata': meta.get('metadata', {}),
+        'content': content
+    }
+
+def decode_v2(data) -> Dict[str, Any]:
+    """完整解码 giggle-compact-v2"""
+    section_count, table_length = parse_v2_header(data)
+    sections = parse_v2_table(
+        memoryview(data)[V2_HEADER.size:V2_HEADER.size + table_length], section_count
+    )
+    
+    meta = {}
+    texts = []
+    for section in sections:
+        block = memoryview(data)[section['offset']:section['offset'] + section['length']]
+        if section['kind'] == SECTION_METADATA:
+            meta = decode_v2_metadata(block)
+        else:
+            texts.append((section, decode_text(block)))
+    
+    return build_package_data(meta, texts)
@@ -0,0 +1,140 @@
+"""
+打包文件索引模块
+"""
+
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Any
+from src.core.config import Config
+from src.core.logger import get_logger
+
+logger = get_logger("package_index")
+
+class PackageIndex:
+    """打包文件索引
+
+    以 (language, text_id, source) 为键，记录文本所在的打包文件及其偏移量，
+    查询接口只需查索引，无需扫描并解码所有 .gcp 文件。
+    """
+
+    def __init__(self, db_path: str = None):
+        """初始化索引"""
+        self.db_path = db_path or Config.PACKAGE_INDEX_PATH
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._init_schema()
+
+    def _init_schema(self):
+        """创建索引表"""
+        with self._lock, self._conn:
+            # WAL模式允许API进程读取的同时Worker进程写入
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS packages (
+                    filename TEXT PRIMARY KEY,
+                    task_id TEXT,
+                    created_at TEXT,
+                    format TEXT
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    filename TEXT NOT NULL,
+                    task_id TEXT,
+                    language TEXT NOT NULL,
+                    text_id TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    offset INTEGER NOT NULL DEFAULT -1,
+                    length INTEGER NOT NULL DEFAULT -1,
+                    confidence REAL
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_entries_key ON entries (language, text_id, source)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_entries_filename ON entries (filename)"
+            )
+
+    def add_package(self, filename: str, task_id: str, created_at: str, package_format: str,
+                    entries: List[Dict[str, Any]]):
+        """添加（或替换）一个打包文件的索引条目"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entries WHERE filename = ?", (filename,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO packages (filename, task_id, created_at, format) VALUES (?, ?, ?, ?)",
+                (filename, task_id, created_at, package_format)
+            )
+            self._conn.executemany(
+                """
+                INSERT INTO entries (filename, task_id, language, text_id, source, offset, length, confidence)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (
+                        filename,
+                        task_id,
+                        entry['language'],
+                        entry.get('text_id', 'main'),
+                        entry.get('source', 'TEXT'),
+                        entry.get('offset', -1),
+                        entry.get('length', -1),
+                        entry.get('confidence')
+                    )
+                    for entry in entries
+                ]
+            )
+
+    def remove_package(self, filename: str):
+        """移除一个打包文件的索引条目"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entries WHERE filename = ?", (filename,))
+            self._conn.execute("DELETE FROM packages WHERE filename = ?", (filename,))
+
+    def lookup(self, language: str, text_id: str = None, source: str = None,
+               limit: int = None) -> List[Dict[str, Any]]:
+        """按 (language, text_id, source) 查询索引，最新的打包文件在前"""
+        sql = "SELECT * FROM entries WHERE language = ?"
+        params = [language]
+
+        if text_id is not None:
+            sql += " AND text_id = ?"
+            params.append(text_id)
+
+        if source:
+            sql += " AND source = ?"
+            params.append(source)
+
+        sql += " ORDER BY id DESC"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+
+        return [dict(row) for row in rows]
+
+    def package_count(self) -> int:
+        """已索引的打包文件数量"""
+        with self._lock:
+            row = self._conn.execute("SELECT COUNT(*) FROM packages").fetchone()
+        return row[0]
+
+    def clear(self):
+        """清空索引"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.execute("DELETE FROM packages")
+
+    def close(self):
+        """关闭索引连接"""
+        with self._lock:
+            self._conn.close()
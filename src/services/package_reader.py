@@ -0,0 +1,212 @@
+"""
+打包文件内存映射读取模块
+"""
+
+import os
+import mmap
+import json
+import gzip
+import base64
+from typing import Dict, Any, List, Optional
+from src.services import package_format
+from src.services.package_format import PackageFormatError
+
+SPECIAL_LANGUAGES = ('original', 'audio')
+
+class Package:
+    """延迟解码的打包文件
+    
+    通过 mmap 映射文件，只解码被访问的段：v2 包读取元数据或单个语言时
+    不会触及其他段的数据；v1 包没有段表，首次访问时完整解码一次。
+    也可以由已解析的包数据构建（见 from_data），接口相同。
+    """
+    
+    def __init__(self, filepath: str):
+        """映射打包文件"""
+        self.filepath = filepath
+        self._file = open(filepath, 'rb')
+        try:
+            if os.fstat(self._file.fileno()).st_size == 0:
+                raise PackageFormatError("Empty package file")
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+        
+        self._view = None
+        self._sections = None
+        self._meta = None
+        self._data = None
+        
+        # 头部或段表无效时释放映射和文件句柄
+        try:
+            self._view = memoryview(self._mmap)
+            self.format = package_format.detect_format(
+                self._view[:len(package_format.V1_HEADER)].tobytes()
+            )
+            if not self.format:
+                raise PackageFormatError("Invalid package format")
+            
+            if self.format == 'v2':
+                # 头部和段表很小，解析拷贝，避免解析失败时残留的切片使映射无法关闭
+                start = package_format.V2_HEADER.size
+                section_count, table_length = package_format.parse_v2_header(self._mmap[:start])
+                self._sections = package_format.parse_v2_table(
+                    self._mmap[start:start + table_length], section_count
+                )
+        except Exception:
+            self.close()
+            raise
+    
+    @classmethod
+    def from_data(cls, package_data: Dict[str, Any], filepath: str = None) -> 'Package':
+        """由已解析的包数据构建（用于缓存命中），不占用文件映射"""
+        package = cls.__new__(cls)
+        package.filepath = filepath
+        package._file = None
+        package._mmap = None
+        package._view = None
+        package._sections = None
+        package._meta = None
+        package._data = package_data
+        package_type = package_data.get('metadata', {}).get('format', '')
+        package.format = 'v2' if package_type.endswith('v2') else 'v1'
+        return package
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def close(self):
+        """释放映射"""
+        if self._file is None:
+            return
+        try:
+            if self._view is not None:
+                self._view.release()
+            self._mmap.close()
+        except BufferError:
+            # 仍有切片被引用时交给GC回收
+            pass
+        finally:
+            self._file.close()
+    
+    def _block(self, section: Dict[str, Any]) -> memoryview:
+        """返回数据块的零拷贝切片"""
+        return self._view[section['offset']:section['offset'] + section['length']]
+    
+    def _decoded(self) -> Dict[str, Any]:
+        """完整解码无段表的包（仅解码一次）"""
+        if self._data is None:
+            encoded = self._view[len(package_format.V1_HEADER):]
+            # json.loads 直接接收 bytes，省去一次 decode 拷贝
+            self._data = json.loads(gzip.decompress(base64.b64decode(encoded)))
+        return self._data
+    
+    def _find_section(self, language: str, text_id: str = 'main') -> Optional[Dict[str, Any]]:
+        """在段表中查找文本段"""
+        for section in self._sections:
+            if (section['kind'] == package_format.SECTION_TEXT
+                    and section['language'] == language and section['text_id'] == text_id):
+                return section
+        return None
+    
+    def _v1_entry(self, language: str) -> Optional[Dict[str, Any]]:
+        """获取已完整解码的包中某语言的内容"""
+        content = self._decoded().get('content', {})
+        if language in SPECIAL_LANGUAGES:
+            return content.get(language)
+        return content.get('translations', {}).get(language)
+    
+    def _metadata_block(self) -> Dict[str, Any]:
+        """解码 v2 元数据段"""
+        if self._meta is None:
+            self._meta = {}
+            for section in self._sections:
+                if section['kind'] == package_format.SECTION_METADATA:
+                    self._meta = package_format.decode_v2_metadata(self._block(section))
+                    break
+        return self._meta
+    
+    def metadata(self) -> Dict[str, Any]:
+        """包元数据"""
+        if self._sections is None:
+            return self._decoded().get('metadata', {})
+        return self._metadata_block().get('metadata', {})
+    
+    def attributes(self, language: str) -> Dict[str, Any]:
+        """某语言除文本外的附加属性（如置信度）"""
+        if self._sections is None:
+            entry = self._v1_entry(language) or {}
+            return {k: v for k, v in entry.items() if k not in ('text', 'source', 'segments')}
+        return self._metadata_block().get('attributes', {}).get(language, {})
+    
+    def languages(self) -> List[str]:
+        """包中包含的语言（含 original 和 audio）"""
+        if self._sections is None:
+            content = self._decoded().get('content', {})
+            languages = [lang for lang in SPECIAL_LANGUAGES if lang in content]
+            return languages + list(content.get('translations', {}).keys())
+        
+        languages = []
+        for section in self._sections:
+            if section['kind'] == package_format.SECTION_TEXT and section['language'] not in languages:
+                languages.append(section['language'])
+        return languages
+    
+    def source(self, language: str, text_id: str = 'main') -> Optional[str]:
+        """某段文本的来源"""
+        if self._sections is None:
+            entry = self._v1_entry(language)
+            return entry.get('source') if entry else None
+        section = self._find_section(language, text_id)
+        return section['source'] if section else None
+    
+    def text(self, language: str, text_id: str = 'main') -> Optional[str]:
+        """读取单段文本，v2 包只解码该段"""
+        if self._sections is None:
+            entry = self._v1_entry(language)
+            if not entry:
+                return None
+            if text_id == 'main':
+                return entry.get('text', '')
+            return entry.get('segments', {}).get(text_id)
+        
+        section = self._find_section(language, text_id)
+        if not section:
+            return None
+        return package_format.decode_text(self._block(section))
+    
+    def texts(self) -> Dict[str, str]:
+        """读取所有语言的主文本"""
+        return {language: self.text(language) for language in self.languages()}
+    
+    def info(self) -> Dict[str, Any]:
+        """包信息，v2 包只解码元数据段"""
+        metadata = self.metadata()
+        languages = self.languages()
+        translations = [lang for lang in languages if lang not in SPECIAL_LANGUAGES]
+        
+        return {
+            'task_id': metadata.get('task_id'),
+            'created_at': metadata.get('created_at'),
+            'version': metadata.get('version'),
+            'format': metadata.get('format'),
+            'available_languages': translations,
+            'translation_count': len(translations),
+            'has_audio': 'audio' in languages,
+            'has_original': 'original' in languages
+        }
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """完整解码为包数据结构"""
+        if self._sections is None:
+            return self._decoded()
+        
+        texts = [
+            (section, package_format.decode_text(self._block(section)))
+            for section in self._sections if section['kind'] == package_format.SECTION_TEXT
+        ]
+        return package_format.build_package_data(self._metadata_block(), texts)
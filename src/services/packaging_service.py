@@ -2,14 +2,18 @@
 紧凑编码打包服务
 """
 
-import json
-import gzip
-import base64
 import os
+import sys
+import copy
+import threading
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List
 from src.core.config import Config
 from src.core.logger import get_logger
+from src.services.package_index import PackageIndex
+from src.services import package_format
+from src.services.package_reader import Package
+from src.utils.lru_cache import LRUCache
 
 logger = get_logger("packaging_service")
 
@@ -20,18 +24,29 @@ class PackagingService:
         """初始化打包服务"""
         self.output_dir = Config.OUTPUT_FOLDER
         os.makedirs(self.output_dir, exist_ok=True)
+        self.index = PackageIndex()
+        self._index_checked = False
+        self._index_lock = threading.Lock()
+        self.cache = LRUCache(Config.PACKAGE_CACHE_MAX_ENTRIES, Config.PACKAGE_CACHE_MAX_BYTES)
     
     def create_package(self, task_id: str, original_text: str, translations: Dict[str, str], 
-                      audio_transcription: Dict[str, Any]) -> str:
-        """创建紧凑编码包"""
+                      audio_transcription: Dict[str, Any],
+                      segments: Dict[str, Dict[str, str]] = None) -> str:
+        """创建紧凑编码包
+        
+        segments 可选，按语言（'original' 或语言代码）保存各页文本 {text_id: text}，
+        每页以其 text_id 写入包中，可通过 /query?text_id= 单独查询。
+        """
         try:
+            use_v2 = Config.PACKAGE_FORMAT != 'v1'
+            
             # 构建包数据结构
             package_data = {
                 'metadata': {
                     'task_id': task_id,
                     'created_at': datetime.now().isoformat(),
-                    'version': '1.0',
-                    'format': 'giggle-compact-v1'
+                    'version': '2.0' if use_v2 else '1.0',
+                    'format': 'giggle-compact-v2' if use_v2 else 'giggle-compact-v1'
                 },
                 'content': {
                     'original': {
@@ -55,8 +70,21 @@ class PackagingService:
                     'source': 'TEXT'  # 基于原始文本翻译
                 }
             
+            # 添加分页文本
+            for language, language_segments in (segments or {}).items():
+                if language == 'original':
+                    entry = package_data['content']['original']
+                else:
+                    entry = package_data['content']['translations'].get(language)
+                if entry is not None and language_segments:
+                    entry['segments'] = dict(language_segments)
+            
             # 创建紧凑编码
-            compact_data = self._create_compact_encoding(package_data)
+            sections = None
+            if use_v2:
+                compact_data, sections = package_format.encode_v2(package_data)
+            else:
+                compact_data = self._create_compact_encoding(package_data)
             
             # 保存文件
             filename = f"giggle_package_{task_id}.gcp"
@@ -65,6 +93,9 @@ class PackagingService:
             with open(filepath, 'wb') as f:
                 f.write(compact_data)
             
+            # 更新索引
+            self._index_package(filepath, package_data, sections)
+            
             logger.info(f"Package created: {filepath}")
             return filepath
             
@@ -75,121 +106,245 @@ class PackagingService:
     def _create_compact_encoding(self, data: Dict[str, Any]) -> bytes:
         """创建紧凑编码"""
         try:
-            # 1. 转换为JSON
-            json_str = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
-            
-            # 2. 压缩
-            compressed = gzip.compress(json_str.encode('utf-8'))
-            
-            # 3. Base64编码
-            encoded = base64.b64encode(compressed)
-            
-            # 4. 添加文件头
-            header = b'GIGGLE_PACKAGE_v1.0\n'
-            return header + encoded
+            # JSON -> gzip -> Base64，并添加文件头
+            return package_format.encode_v1(data)
             
         except Exception as e:
             logger.error(f"Error creating compact encoding: {str(e)}")
             raise
     
-    def read_package(self, filepath: str) -> Optional[Dict[str, Any]]:
-        """读取紧凑编码包"""
+    def _build_index_entries(self, package_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """生成包的索引条目（包括各页的分段文本）"""
+        content = package_data.get('content', {})
+        entries = []
+        
+        for language, source, text_id, _text, attributes in package_format.iter_content_sections(content):
+            entry = {
+                'language': language,
+                'text_id': text_id,
+                'source': source
+            }
+            if language == 'audio' and attributes:
+                entry['confidence'] = attributes.get('confidence', 0)
+            entries.append(entry)
+        
+        return entries
+    
+    def _index_package(self, filepath: str, package_data: Dict[str, Any],
+                       sections: List[Dict[str, Any]] = None):
+        """将包写入索引，v2 包同时记录各段的偏移量"""
         try:
-            with open(filepath, 'rb') as f:
-                data = f.read()
-            
-            # 检查文件头
-            if not data.startswith(b'GIGGLE_PACKAGE_v1.0\n'):
-                logger.error("Invalid package format")
-                return None
-            
-            # 移除文件头
-            encoded_data = data[len(b'GIGGLE_PACKAGE_v1.0\n'):]
-            
-            # 解码
-            compressed = base64.b64decode(encoded_data)
-            json_str = gzip.decompress(compressed).decode('utf-8')
+            metadata = package_data.get('metadata', {})
+            entries = self._build_index_entries(package_data)
             
-            # 解析JSON
-            package_data = json.loads(json_str)
+            if sections:
+                locations = {
+                    (s['language'], s['text_id'], s['source']): (s['offset'], s['length'])
+                    for s in sections if s['kind'] == package_format.SECTION_TEXT
+                }
+                for entry in entries:
+                    key = (entry['language'], entry['text_id'], entry['source'])
+                    if key in locations:
+                        entry['offset'], entry['length'] = locations[key]
+            
+            self.index.add_package(
+                filename=os.path.basename(filepath),
+                task_id=metadata.get('task_id', 'unknown'),
+                created_at=metadata.get('created_at'),
+                package_format=metadata.get('format'),
+                entries=entries
+            )
+        except Exception as e:
+            logger.error(f"Error indexing package {filepath}: {str(e)}")
+    
+    def rebuild_index(self) -> int:
+        """根据现有的 .gcp 文件重建索引"""
+        self.index.clear()
+        
+        gcp_files = [
+            os.path.join(self.output_dir, f)
+            for f in os.listdir(self.output_dir) if f.endswith('.gcp')
+        ]
+        # 按修改时间排序，保证索引顺序与创建顺序一致
+        gcp_files.sort(key=os.path.getmtime)
+        
+        count = 0
+        for filepath in gcp_files:
+            package_data = self.read_package(filepath)
+            if not package_data:
+                logger.warning(f"Skipping unreadable package: {filepath}")
+                continue
+            self._index_package(filepath, package_data, self._read_sections(filepath))
+            count += 1
+        
+        logger.info(f"Package index rebuilt: {count} packages")
+        return count
+    
+    def ensure_index(self) -> int:
+        """返回已索引的包数量；索引为空但输出目录中已有 .gcp 文件时（索引文件丢失、升级前创建的包）先重建
+        
+        每个进程只自动重建一次，避免包都无法读取时每次查询都重新扫描。
+        """
+        count = self.index.package_count()
+        if count or self._index_checked:
+            return count
+        
+        with self._index_lock:
+            if not self._index_checked:
+                self._index_checked = True
+                if any(f.endswith('.gcp') for f in os.listdir(self.output_dir)):
+                    logger.info("Package index is empty, rebuilding from existing packages")
+                    self.rebuild_index()
+        return self.index.package_count()
+    
+    def query_index(self, language: str, text_id: str = 'main', source: str = None,
+                    limit: int = None) -> List[Dict[str, Any]]:
+        """通过索引查询包内容，最新的包在前"""
+        results = []
+        
+        for entry in self.index.lookup(language, text_id=text_id, source=source):
+            filepath = os.path.join(self.output_dir, entry['filename'])
+            
+            found = None
+            if os.path.exists(filepath):
+                package = self._cached_package(filepath)
+                if package is not None:
+                    text = package.text(language, entry['text_id'])
+                    if text is not None:
+                        found = {'text': text, 'confidence': package.attributes(language).get('confidence', 0)}
+                elif entry['offset'] >= 0:
+                    # v2 包：根据索引中的偏移量直接读取
+                    text = self.read_section(filepath, entry['offset'], entry['length'])
+                    if text is not None:
+                        found = {'text': text, 'confidence': entry['confidence'] or 0}
+                else:
+                    found = self.query_package(filepath, language, entry['text_id'])
+            if not found:
+                # 文件已删除或损坏，清理失效的索引
+                logger.warning(f"Stale index entry removed: {entry['filename']}")
+                self.index.remove_package(entry['filename'])
+                continue
+            
+            result = {
+                'task_id': entry['task_id'],
+                'language': language,
+                'text_id': entry['text_id'],
+                'text': found.get('text', ''),
+                'source': entry['source'],
+                'filename': entry['filename']
+            }
+            if language == 'audio':
+                result['confidence'] = found.get('confidence', 0)
             
-            return package_data
+            results.append(result)
+            if limit and len(results) >= limit:
+                break
+        
+        return results
+    
+    def open_package(self, filepath: str) -> Package:
+        """以内存映射方式打开包，按需解码"""
+        return Package(filepath)
+    
+    def _cache_key(self, filepath: str) -> tuple:
+        """缓存键：路径、修改时间和文件大小，文件变化后自动失效"""
+        stat = os.stat(filepath)
+        return (os.path.abspath(filepath), stat.st_mtime_ns, stat.st_size)
+    
+    def _cached_package(self, filepath: str) -> Optional[Package]:
+        """仅从缓存获取已解析的包，未命中返回 None"""
+        if not self.cache.enabled:
+            return None
+        package_data = self.cache.get(self._cache_key(filepath))
+        if package_data is None:
+            return None
+        return Package.from_data(package_data, filepath)
+    
+    def _open_partial(self, filepath: str) -> Package:
+        """获取包用于局部读取（信息、校验、单个语言）：优先使用缓存，未命中时按需解码，不写入缓存"""
+        package = self._cached_package(filepath)
+        return package if package is not None else self.open_package(filepath)
+    
+    def _load_package(self, filepath: str) -> Package:
+        """获取包用于完整读取：优先使用缓存，未命中时完整解码并写入缓存"""
+        if not self.cache.enabled:
+            return self.open_package(filepath)
+        
+        key = self._cache_key(filepath)
+        package_data = self.cache.get(key)
+        if package_data is None:
+            with self.open_package(filepath) as package:
+                package_data = package.to_dict()
+            self.cache.put(key, package_data, _estimate_size(package_data))
+        
+        return Package.from_data(package_data, filepath)
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """获取包缓存统计"""
+        return self.cache.stats()
+    
+    def read_package(self, filepath: str) -> Optional[Dict[str, Any]]:
+        """读取紧凑编码包（支持 v1 和 v2），返回副本，修改不影响缓存"""
+        try:
+            with self._load_package(filepath) as package:
+                return copy.deepcopy(package.to_dict())
             
         except Exception as e:
             logger.error(f"Error reading package {filepath}: {str(e)}")
             return None
     
+    def _read_sections(self, filepath: str) -> Optional[List[Dict[str, Any]]]:
+        """读取 v2 包的段表，v1 包返回 None"""
+        with open(filepath, 'rb') as f:
+            header = f.read(package_format.V2_HEADER.size)
+            if package_format.detect_format(header) != 'v2':
+                return None
+            section_count, table_length = package_format.parse_v2_header(header)
+            return package_format.parse_v2_table(f.read(table_length), section_count)
+    
+    def read_section(self, filepath: str, offset: int, length: int) -> Optional[str]:
+        """读取 v2 包中的单段文本"""
+        try:
+            with open(filepath, 'rb') as f:
+                f.seek(offset)
+                block = f.read(length)
+            return package_format.decode_text(block)
+            
+        except Exception as e:
+            logger.error(f"Error reading section from {filepath}: {str(e)}")
+            return None
+    
     def query_package(self, filepath: str, language: str, text_id: str = None) -> Optional[Dict[str, Any]]:
         """查询包内容"""
         try:
-            package_data = self.read_package(filepath)
-            if not package_data:
-                return None
-            
-            content = package_data.get('content', {})
-            
-            # 查询指定语言
-            if language in content.get('translations', {}):
-                translation = content['translations'][language]
-                return {
+            with self._open_partial(filepath) as package:
+                text = package.text(language, text_id or 'main')
+                if text is None:
+                    return None
+                
+                result = {
                     'language': language,
-                    'text': translation['text'],
-                    'source': translation['source'],
-                    'text_id': text_id or 'main'
-                }
-            
-            # 查询原始文本
-            if language == 'original':
-                original = content.get('original', {})
-                return {
-                    'language': 'original',
-                    'text': original.get('text', ''),
-                    'source': original.get('source', 'TEXT'),
-                    'text_id': text_id or 'main'
-                }
-            
-            # 查询音频转录
-            if language == 'audio':
-                audio = content.get('audio', {})
-                return {
-                    'language': 'audio',
-                    'text': audio.get('text', ''),
-                    'source': audio.get('source', 'AUDIO'),
-                    'confidence': audio.get('confidence', 0),
+                    'text': text,
+                    'source': package.source(language, text_id or 'main')
+                              or ('AUDIO' if language == 'audio' else 'TEXT'),
                     'text_id': text_id or 'main'
                 }
-            
-            return None
+                
+                # 音频转录附带置信度
+                if language == 'audio':
+                    result['confidence'] = package.attributes('audio').get('confidence', 0)
+                
+                return result
             
         except Exception as e:
             logger.error(f"Error querying package {filepath}: {str(e)}")
             return None
     
     def get_package_info(self, filepath: str) -> Optional[Dict[str, Any]]:
-        """获取包信息"""
+        """获取包信息（v2 包未缓存时只解码元数据段）"""
         try:
-            package_data = self.read_package(filepath)
-            if not package_data:
-                return None
-            
-            metadata = package_data.get('metadata', {})
-            content = package_data.get('content', {})
-            
-            # 统计信息
-            translations = content.get('translations', {})
-            
-            info = {
-                'task_id': metadata.get('task_id'),
-                'created_at': metadata.get('created_at'),
-                'version': metadata.get('version'),
-                'format': metadata.get('format'),
-                'available_languages': list(translations.keys()),
-                'translation_count': len(translations),
-                'has_audio': 'audio' in content,
-                'has_original': 'original' in content
-            }
-            
-            return info
+            with self._open_partial(filepath) as package:
+                return package.info()
             
         except Exception as e:
             logger.error(f"Error getting package info {filepath}: {str(e)}")
@@ -198,24 +353,18 @@ class PackagingService:
     def validate_package(self, filepath: str) -> bool:
         """验证包完整性"""
         try:
-            package_data = self.read_package(filepath)
-            if not package_data:
-                return False
-            
-            # 检查必需字段
-            required_fields = ['metadata', 'content']
-            for field in required_fields:
-                if field not in package_data:
-                    logger.error(f"Missing required field: {field}")
+            with self._open_partial(filepath) as package:
+                # 检查必需字段
+                if not package.metadata():
+                    logger.error("Missing required field: metadata")
                     return False
-            
-            # 检查内容
-            content = package_data.get('content', {})
-            if not content:
-                logger.error("Empty content")
-                return False
-            
-            return True
+                
+                # 检查内容
+                if not package.languages():
+                    logger.error("Empty content")
+                    return False
+                
+                return True
             
         except Exception as e:
             logger.error(f"Error validating package {filepath}: {str(e)}")
@@ -224,28 +373,19 @@ class PackagingService:
     def extract_texts(self, filepath: str) -> Dict[str, str]:
         """提取所有文本"""
         try:
-            package_data = self.read_package(filepath)
-            if not package_data:
-                return {}
-            
-            content = package_data.get('content', {})
-            texts = {}
-            
-            # 原始文本
-            if 'original' in content:
-                texts['original'] = content['original'].get('text', '')
-            
-            # 音频转录
-            if 'audio' in content:
-                texts['audio'] = content['audio'].get('text', '')
-            
-            # 翻译
-            translations = content.get('translations', {})
-            for lang, trans in translations.items():
-                texts[lang] = trans.get('text', '')
-            
-            return texts
+            with self._load_package(filepath) as package:
+                return package.texts()
             
         except Exception as e:
             logger.error(f"Error extracting texts from {filepath}: {str(e)}")
-            return {} 
\ No newline at end of file
+            return {}
+
+def _estimate_size(value: Any) -> int:
+    """估算已解析包数据占用的内存字节数"""
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            _estimate_size(k) + _estimate_size(v) for k, v in value.items()
+        )
+    if isinstance(value, list):
+        return sys.getsizeof(value) + sum(_estimate_size(v) for v in value)
+    return sys.getsizeof(value)
\ No newline at end of file
@@ -0,0 +1,279 @@
+"""
+LLM请求限流模块
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+import redis
+from src.core.config import Config
+from src.core.logger import get_logger
+from src.utils.cancellation import DeadlineExceeded
+
+logger = get_logger("rate_limiter")
+
+# 估算提示词token数时每个token对应的字符数（中英文混合取保守值）
+CHARS_PER_TOKEN = 3
+
+def _refill(state: Dict[str, float], now: float, rpm: int, tpm: int) -> Dict[str, float]:
+    """按经过的时间补充请求数和token数，上限为每分钟限额"""
+    elapsed = max(0.0, now - state['ts'])
+    return {
+        'requests': min(rpm, state['requests'] + elapsed * rpm / 60),
+        'tokens': min(tpm, state['tokens'] + elapsed * tpm / 60),
+        'ts': now,
+        'cooldown_until': state['cooldown_until']
+    }
+
+def _take(state: Dict[str, float], now: float, rpm: int, tpm: int, tokens: int):
+    """尝试从桶中取出一个请求和 tokens 个token，返回 (新状态或 None, 需要等待的秒数)"""
+    if state['cooldown_until'] > now:
+        return None, state['cooldown_until'] - now
+    
+    state = _refill(state, now, rpm, tpm)
+    tokens = min(tokens, tpm)  # 超过每分钟限额的单个请求按整桶计
+    if state['requests'] >= 1 and state['tokens'] >= tokens:
+        state['requests'] -= 1
+        state['tokens'] -= tokens
+        return state, 0.0
+    
+    wait = max((1 - state['requests']) * 60 / rpm, (tokens - state['tokens']) * 60 / tpm)
+    return None, max(wait, 0.01)
+
+class TokenBucket:
+    """进程内令牌桶，同时限制每分钟请求数和token数（Redis不可用时使用）"""
+    
+    def __init__(self, rpm: int, tpm: int):
+        """初始化令牌桶（初始为满桶）"""
+        self.rpm = rpm
+        self.tpm = tpm
+        self._state = {'requests': float(rpm), 'tokens': float(tpm), 'ts': time.time(), 'cooldown_until': 0.0}
+        self._lock = threading.Lock()
+    
+    def try_acquire(self, tokens: int) -> float:
+        """尝试取出一个请求和 tokens 个token，成功返回 0，否则返回建议等待的秒数"""
+        with self._lock:
+            state, wait = _take(dict(self._state), time.time(), self.rpm, self.tpm, tokens)
+            if state is not None:
+                self._state = state
+            return wait
+    
+    def adjust(self, tokens: int):
+        """按实际用量修正：tokens 为正时退还多预扣的token，为负时补扣"""
+        with self._lock:
+            self._state['tokens'] = min(self.tpm, self._state['tokens'] + tokens)
+    
+    def cooldown(self, seconds: float):
+        """暂停发放，直到 seconds 秒后（收到429时所有请求一起退避）"""
+        with self._lock:
+            self._state['cooldown_until'] = max(self._state['cooldown_until'], time.time() + seconds)
+    
+    def cooling_down(self) -> bool:
+        """是否处于429后的暂停发放期"""
+        with self._lock:
+            return self._state['cooldown_until'] > time.time()
+
+class RedisTokenBucket(TokenBucket):
+    """所有Worker共享的令牌桶，状态保存在Redis哈希中，用 WATCH 事务原子更新"""
+    
+    KEY = 'llm:bucket'
+    
+    def __init__(self, redis_client, rpm: int, tpm: int):
+        """初始化令牌桶"""
+        super().__init__(rpm, tpm)
+        self.redis_client = redis_client
+    
+    def _read(self, pipe) -> Dict[str, float]:
+        """读取桶状态，不存在时为满桶"""
+        raw = pipe.hgetall(self.KEY)
+        if not raw:
+            return {'requests': float(self.rpm), 'tokens': float(self.tpm), 'ts': time.time(), 'cooldown_until': 0.0}
+        return {key.decode('utf-8'): float(value) for key, value in raw.items()}
+    
+    def try_acquire(self, tokens: int) -> float:
+        """尝试取出一个请求和 tokens 个token，成功返回 0，否则返回建议等待的秒数"""
+        def take(pipe):
+            state, wait = _take(self._read(pipe), time.time(), self.rpm, self.tpm, tokens)
+            pipe.multi()
+            if state is not None:
+                pipe.hset(self.KEY, mapping=state)
+                pipe.expire(self.KEY, 3600)
+            return wait
+        
+        return self.redis_client.transaction(take, self.KEY, value_from_callable=True)
+    
+    def adjust(self, tokens: int):
+        """按实际用量修正：tokens 为正时退还多预扣的token，为负时补扣"""
+        def update(pipe):
+            state = self._read(pipe)
+            pipe.multi()
+            pipe.hset(self.KEY, 'tokens', min(self.tpm, state['tokens'] + tokens))
+        
+        self.redis_client.transaction(update, self.KEY)
+    
+    def cooldown(self, seconds: float):
+        """暂停发放，直到 seconds 秒后（收到429时所有Worker一起退避）"""
+        def update(pipe):
+            state = self._read(pipe)
+            pipe.multi()
+            state['cooldown_until'] = max(state['cooldown_until'], time.time() + seconds)
+            pipe.hset(self.KEY, mapping=state)
+        
+        self.redis_client.transaction(update, self.KEY)
+    
+    def cooling_down(self) -> bool:
+        """是否处于429后的暂停发放期"""
+        value = self.redis_client.hget(self.KEY, 'cooldown_until')
+        return value is not None and float(value) > time.time()
+
+class AdaptiveConcurrency:
+    """AIMD并发控制
+    
+    每次成功把并发上限加 1/上限（约每轮请求加1），收到429或超时时减半；
+    一次过载引发的多个失败只在 LLM_BACKOFF_INTERVAL 秒内减半一次。
+    """
+    
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = None):
+        """初始化并发上限"""
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum or initial
+        self.limit = float(initial)
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+    
+    def acquire(self, timeout: float = None) -> bool:
+        """占用一个并发槽位，超时返回 False"""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.in_flight < int(self.limit), timeout):
+                return False
+            self.in_flight += 1
+            return True
+    
+    def release(self):
+        """释放槽位"""
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+    
+    def has_headroom(self) -> bool:
+        """并发上限未被压低到起始值以下，且还有空闲槽位"""
+        with self._condition:
+            return self.limit >= self.initial and self.in_flight < int(self.limit)
+    
+    def on_success(self):
+        """加性增加"""
+        with self._condition:
+            previous = int(self.limit)
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            if int(self.limit) > previous:
+                self._condition.notify()
+    
+    def on_overload(self):
+        """乘性减少"""
+        with self._condition:
+            now = time.monotonic()
+            if now - self._last_decrease < Config.LLM_BACKOFF_INTERVAL:
+                return
+            self._last_decrease = now
+            self.limit = max(self.minimum, self.limit / 2)
+            logger.warning(f"LLM overloaded, concurrency limit reduced to {int(self.limit)}")
+
+class LLMCall:
+    """一次受限流的LLM请求，由调用方记录实际用量或过载"""
+    
+    def __init__(self):
+        """初始化"""
+        self.total_tokens: Optional[int] = None
+        self.retry_after: Optional[float] = None
+    
+    def used(self, total_tokens: int):
+        """记录实际消耗的token数"""
+        self.total_tokens = total_tokens
+    
+    def overloaded(self, retry_after: float = None):
+        """记录请求被限流（429）或超时"""
+        self.retry_after = retry_after or Config.LLM_COOLDOWN_SECONDS
+
+class LLMRateLimiter:
+    """LLM请求限流器：共享令牌桶（RPM/TPM）+ 本进程AIMD并发控制"""
+    
+    def __init__(self, redis_client=None):
+        """初始化限流器，传入 redis_client 时令牌桶在所有Worker间共享"""
+        rpm, tpm = Config.LLM_RPM, Config.LLM_TPM
+        if rpm > 0 and tpm > 0:
+            self.bucket = RedisTokenBucket(redis_client, rpm, tpm) if redis_client is not None else TokenBucket(rpm, tpm)
+        else:
+            self.bucket = None
+        maximum = Config.TRANSLATION_MAX_CONCURRENCY
+        self.concurrency = AdaptiveConcurrency(min(Config.LLM_INITIAL_CONCURRENCY, maximum), maximum=maximum)
+    
+    @staticmethod
+    def estimate_tokens(text: str, max_tokens: int) -> int:
+        """预估一次请求消耗的token数（提示词 + 输出上限）"""
+        return len(text) // CHARS_PER_TOKEN + max_tokens
+    
+    def _remaining(self, deadline: Optional[float]) -> Optional[float]:
+        """距离时限（time.monotonic() 时间）的剩余秒数"""
+        if deadline is None:
+            return None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded()
+        return remaining
+    
+    def has_headroom(self) -> bool:
+        """没有处于冷却、并发未被压低且有空闲槽位（用于决定是否发出对冲请求）"""
+        if not self.concurrency.has_headroom():
+            return False
+        return self.bucket is None or not self.bucket.cooling_down()
+    
+    @contextmanager
+    def request(self, estimated_tokens: int, deadline: float = None):
+        """等待并发槽位和令牌桶配额后执行请求，等待超过时限时抛出 DeadlineExceeded"""
+        if not self.concurrency.acquire(self._remaining(deadline)):
+            raise DeadlineExceeded()
+        
+        call = LLMCall()
+        try:
+            while self.bucket is not None:
+                wait = self.bucket.try_acquire(estimated_tokens)
+                if wait <= 0:
+                    break
+                remaining = self._remaining(deadline)
+                if remaining is not None and wait > remaining:
+                    raise DeadlineExceeded()
+                time.sleep(wait)
+            
+            yield call
+            
+            if call.retry_after is None:
+                self.concurrency.on_success()
+                if self.bucket is not None and call.total_tokens is not None:
+                    self.bucket.adjust(estimated_tokens - call.total_tokens)
+        finally:
+            if call.retry_after is not None:
+                self.concurrency.on_overload()
+                if self.bucket is not None:
+                    self.bucket.cooldown(call.retry_after)
+            self.concurrency.release()
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+def get_rate_limiter() -> LLMRateLimiter:
+    """获取（或创建）本进程共享的限流器，Redis不可用时使用本地令牌桶"""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            redis_client = None
+            try:
+                redis_client = redis.from_url(Config.REDIS_URL)
+                redis_client.ping()
+            except Exception as e:
+                logger.warning(f"Redis unavailable for LLM rate limiting: {str(e)}. Using local limits.")
+                redis_client = None
+            _limiter = LLMRateLimiter(redis_client)
+        return _limiter
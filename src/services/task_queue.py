@@ -0,0 +1,459 @@
+"""
+任务队列模块
+
+三种实现提供相同的接口（push / pop / ack / heartbeat / lease / remove / reap / size / stats），
+由 create_task_queue 按配置选择：
+- MemoryTaskQueue: 进程内列表，Redis不可用时使用
+- RedisTaskQueue: Redis列表 + 租约（TASK_QUEUE_BACKEND=list，默认）
+- RedisStreamQueue: Redis Streams 消费者组（TASK_QUEUE_BACKEND=stream）
+"""
+
+import os
+import time
+import uuid
+import socket
+import threading
+from contextlib import contextmanager
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+from src.core.config import Config
+from src.core.logger import get_logger
+
+logger = get_logger("task_queue")
+
+# 处理流水线的阶段（按执行顺序）：语音识别 -> 验证和翻译 -> 打包。
+# 每个阶段有自己的队列，Worker 通过 WORKER_STAGES 选择负责的阶段。
+STAGES = ('stt', 'translate', 'package')
+
+@contextmanager
+def _renewing(queue, task_id: str):
+    """在后台线程中每隔租约时长的三分之一调用一次 queue.heartbeat(task_id)"""
+    stop = threading.Event()
+    interval = max(1.0, queue.lease_seconds / 3)
+    
+    def renew():
+        while not stop.wait(interval):
+            try:
+                queue.heartbeat(task_id)
+            except Exception as e:
+                logger.warning(f"Lease renewal failed for task {task_id}: {str(e)}")
+    
+    thread = threading.Thread(target=renew, name=f"lease-{task_id}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+class MemoryTaskQueue:
+    """进程内任务队列（Redis不可用时使用），没有租约"""
+    
+    def __init__(self):
+        """初始化队列"""
+        self.items = []
+        self.worker_id = 'memory'
+    
+    def push(self, task_id: str, pipe=None):
+        """任务入队"""
+        self.items.append(task_id)
+    
+    def pop(self, timeout: int = 1) -> Optional[str]:
+        """取出一个任务，队列为空时等待 timeout 秒"""
+        if not self.items:
+            if timeout > 0:
+                time.sleep(timeout)
+            return None
+        return self.items.pop(0)
+    
+    def ack(self, task_id: str):
+        """确认任务已处理完成"""
+    
+    def heartbeat(self, task_id: str = None):
+        """续约（内存队列无需续约）"""
+    
+    @contextmanager
+    def lease(self, task_id: str):
+        """处理任务期间保持租约"""
+        yield
+    
+    def remove(self, task_id: str):
+        """从队列中移除任务"""
+        if task_id in self.items:
+            self.items.remove(task_id)
+    
+    def clear_cancelled(self, task_id: str):
+        """清除任务的取消标记（内存队列取消时直接移除，没有标记）"""
+    
+    def reap(self) -> Tuple[List[str], List[str]]:
+        """回收超时任务（内存队列无超时）"""
+        return [], []
+    
+    def size(self) -> int:
+        """排队中的任务数"""
+        return len(self.items)
+    
+    def stats(self) -> Dict[str, Any]:
+        """队列统计"""
+        return {'queued': len(self.items), 'in_flight': 0, 'consumers': {}}
+
+class RedisTaskQueue:
+    """基于Redis列表的可靠队列
+    
+    Worker 用 BLMOVE 把任务原子地移入自己的处理中列表，同时登记租约（有序集合，分数为到期时间）。
+    处理期间由心跳线程续约；Worker 异常退出后租约过期，回收器把任务放回队列头部重新处理。
+    同一任务超过 TASK_MAX_ATTEMPTS 次租约过期（如反复导致Worker内存溢出）则不再重试。
+    """
+    
+    DEFAULT_NAME = 'task_queue'
+    WORKER_PREFIX = 'task_queue:worker:'
+    
+    def __init__(self, redis_client, worker_id: str = None, lease_seconds: int = None, name: str = None):
+        """初始化队列
+        
+        Args:
+            name: 队列键名，其余键以此为前缀（默认 task_queue）
+        """
+        self.redis_client = redis_client
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lease_seconds = lease_seconds or Config.TASK_TIMEOUT
+        self.queue_key = name or self.DEFAULT_NAME
+        self.processing_prefix = f"{self.queue_key}:processing:"
+        self.leases_key = f"{self.queue_key}:leases"
+        self.owners_key = f"{self.queue_key}:owners"
+        self.attempts_key = f"{self.queue_key}:attempts"
+        self.processing_key = self.processing_prefix + self.worker_id
+        self._last_alive = 0.0
+    
+    def push(self, task_id: str, pipe=None):
+        """任务入队，传入 pipe 时加入调用方的事务"""
+        (pipe or self.redis_client).lpush(self.queue_key, task_id)
+    
+    def pop(self, timeout: int = 1) -> Optional[str]:
+        """取出一个任务并登记租约，队列为空时最多阻塞 timeout 秒（timeout 为 0 时不阻塞）"""
+        self._touch_worker()
+        if timeout > 0:
+            task_id = self.redis_client.blmove(self.queue_key, self.processing_key, timeout, 'RIGHT', 'LEFT')
+        else:
+            task_id = self.redis_client.lmove(self.queue_key, self.processing_key, 'RIGHT', 'LEFT')
+        if task_id is None:
+            return None
+        
+        task_id = task_id.decode('utf-8')
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.zadd(self.leases_key, {task_id: time.time() + self.lease_seconds})
+        pipe.hset(self.owners_key, task_id, self.worker_id)
+        pipe.hincrby(self.attempts_key, task_id, 1)
+        pipe.execute()
+        return task_id
+    
+    def ack(self, task_id: str):
+        """确认任务已处理完成（无论成功或失败），释放租约"""
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.lrem(self.processing_key, 1, task_id)
+        pipe.zrem(self.leases_key, task_id)
+        pipe.hdel(self.owners_key, task_id)
+        pipe.hdel(self.attempts_key, task_id)
+        pipe.execute()
+    
+    def heartbeat(self, task_id: str = None):
+        """续约：刷新Worker存活标记，并延长任务租约（租约已被回收时不再续约）"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.set(self.WORKER_PREFIX + self.worker_id, 1, ex=self.lease_seconds)
+        if task_id:
+            pipe.zadd(self.leases_key, {task_id: time.time() + self.lease_seconds}, xx=True)
+        pipe.execute()
+        self._last_alive = time.time()
+    
+    def _touch_worker(self):
+        """空闲时按租约的三分之一间隔刷新存活标记"""
+        if time.time() - self._last_alive >= self.lease_seconds / 3:
+            self.heartbeat()
+    
+    def lease(self, task_id: str):
+        """处理任务期间在后台线程中定期续约"""
+        return _renewing(self, task_id)
+    
+    def remove(self, task_id: str):
+        """从队列中移除任务（取消时使用）"""
+        self.redis_client.lrem(self.queue_key, 0, task_id)
+    
+    def clear_cancelled(self, task_id: str):
+        """清除任务的取消标记（列表队列取消时直接移除，没有标记）"""
+    
+    def reap(self) -> Tuple[List[str], List[str]]:
+        """回收租约过期的任务
+        
+        返回 (重新入队的任务, 超过最大尝试次数而放弃的任务)。
+        多个Worker同时回收时，WATCH 保证每个任务只被回收一次；
+        回收期间恰好续约成功的任务不会被回收。
+        """
+        requeued, dead = [], []
+        now = time.time()
+        
+        for task_id in self.redis_client.zrangebyscore(self.leases_key, '-inf', now):
+            task_id = task_id.decode('utf-8')
+            outcome = self._reclaim(task_id, now)
+            if outcome == 'requeued':
+                requeued.append(task_id)
+            elif outcome == 'dead':
+                dead.append(task_id)
+        
+        # 取出任务后、登记租约前退出的Worker：处理中列表里有任务但没有租约
+        for key in self.redis_client.scan_iter(match=self.processing_prefix + '*'):
+            owner = key.decode('utf-8')[len(self.processing_prefix):]
+            if owner == self.worker_id or self.redis_client.exists(self.WORKER_PREFIX + owner):
+                continue
+            for task_id in self.redis_client.lrange(key, 0, -1):
+                task_id = task_id.decode('utf-8')
+                if self.redis_client.zscore(self.leases_key, task_id) is None:
+                    if self._reclaim(task_id, now, owner) == 'requeued':
+                        requeued.append(task_id)
+        
+        if requeued or dead:
+            logger.warning(f"Reclaimed stalled tasks: requeued={requeued}, abandoned={dead}")
+        return requeued, dead
+    
+    def _reclaim(self, task_id: str, now: float, owner: str = None) -> Optional[str]:
+        """在事务中把任务从原Worker的处理中列表移回队列"""
+        def reclaim(pipe):
+            expiry = pipe.zscore(self.leases_key, task_id)
+            if owner is None and (expiry is None or expiry > now):
+                pipe.multi()
+                return None
+            
+            worker = owner or (pipe.hget(self.owners_key, task_id) or b'').decode('utf-8')
+            attempts = int(pipe.hget(self.attempts_key, task_id) or 0)
+            
+            pipe.multi()
+            pipe.lrem(self.processing_prefix + worker, 1, task_id)
+            pipe.zrem(self.leases_key, task_id)
+            pipe.hdel(self.owners_key, task_id)
+            if attempts >= Config.TASK_MAX_ATTEMPTS:
+                pipe.hdel(self.attempts_key, task_id)
+                return 'dead'
+            # 放回队列的出队端，优先重新处理
+            pipe.rpush(self.queue_key, task_id)
+            return 'requeued'
+        
+        watches = [self.leases_key] + ([self.processing_prefix + owner] if owner else [])
+        return self.redis_client.transaction(reclaim, *watches, value_from_callable=True)
+    
+    def size(self) -> int:
+        """排队中的任务数"""
+        return self.redis_client.llen(self.queue_key)
+    
+    def stats(self) -> Dict[str, Any]:
+        """队列统计：排队数、持有租约的任务数、各Worker处理中的任务数"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.llen(self.queue_key)
+        pipe.zcard(self.leases_key)
+        pipe.hvals(self.owners_key)
+        queued, in_flight, owners = pipe.execute()
+        
+        consumers = {}
+        for owner in owners:
+            owner = owner.decode('utf-8')
+            consumers[owner] = consumers.get(owner, 0) + 1
+        return {'queued': queued, 'in_flight': in_flight, 'consumers': consumers}
+
+class RedisStreamQueue:
+    """基于Redis Streams消费者组的队列
+    
+    每个Worker是消费者组中的一个消费者，XREADGROUP 一次读取 QUEUE_STREAM_BATCH 个任务并缓存在本地，
+    已读取未确认的条目记录在该消费者的待处理列表（PEL）中。处理期间用 XCLAIM JUSTID 重置条目的空闲时间作为续约；
+    空闲超过 TASK_TIMEOUT 的条目由其他Worker用 XAUTOCLAIM 接管，投递次数超过 TASK_MAX_ATTEMPTS 则放弃。
+    确认时 XACK 并删除条目，流的长度即未完成任务数。
+    
+    取消标记是以标记时间为分数的有序集合：任务出队、确认或重新入队时删除；
+    任务没有到达的阶段中的标记超过 CHECKPOINT_TTL 后清理（处理期间的取消检查仍会拦截这类任务）。
+    """
+    
+    DEFAULT_NAME = 'task_stream'
+    GROUP = 'workers'
+    
+    def __init__(self, redis_client, worker_id: str = None, lease_seconds: int = None,
+                 batch_size: int = None, name: str = None):
+        """初始化队列
+        
+        Args:
+            name: 流的键名（默认 task_stream）
+        """
+        self.redis_client = redis_client
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lease_seconds = lease_seconds or Config.TASK_TIMEOUT
+        self.stream_key = name or self.DEFAULT_NAME
+        self.cancelled_key = f"{self.stream_key}:cancelled"
+        self.batch_size = batch_size or Config.QUEUE_STREAM_BATCH
+        self._buffer = deque()  # 已读取、尚未开始处理的 (entry_id, task_id)
+        self._entries = {}      # task_id -> entry_id（已读取、尚未确认）
+        self._group_ready = False
+    
+    def _ensure_group(self):
+        """创建消费者组（已存在时忽略）"""
+        if self._group_ready:
+            return
+        try:
+            self.redis_client.xgroup_create(self.stream_key, self.GROUP, id='0', mkstream=True)
+        except Exception as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+        self._group_ready = True
+    
+    def push(self, task_id: str, pipe=None):
+        """任务入队，传入 pipe 时加入调用方的事务"""
+        client = pipe or self.redis_client
+        # 重新提交已取消的任务时清除取消标记
+        client.zrem(self.cancelled_key, task_id)
+        client.xadd(self.stream_key, {'task_id': task_id})
+    
+    def _fill(self, timeout: int):
+        """从消费者组批量读取新条目"""
+        self._ensure_group()
+        response = self.redis_client.xreadgroup(
+            self.GROUP, self.worker_id, {self.stream_key: '>'},
+            count=self.batch_size, block=int(timeout * 1000) if timeout > 0 else None
+        )
+        for _, entries in response or []:
+            for entry_id, fields in entries:
+                self._buffer.append((entry_id, fields[b'task_id'].decode('utf-8')))
+    
+    def pop(self, timeout: int = 1) -> Optional[str]:
+        """取出一个任务，本地缓存为空时阻塞读取一批"""
+        if not self._buffer:
+            self._fill(timeout)
+        
+        while self._buffer:
+            entry_id, task_id = self._buffer.popleft()
+            # 已取消的任务直接确认丢弃
+            if self.redis_client.zrem(self.cancelled_key, task_id):
+                self._ack_entry(entry_id)
+                continue
+            self._entries[task_id] = entry_id
+            return task_id
+        return None
+    
+    def _ack_entry(self, entry_id, task_id: str = None):
+        """确认并删除条目，传入 task_id 时同时清除其取消标记（处理期间被取消的任务）"""
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.xack(self.stream_key, self.GROUP, entry_id)
+        pipe.xdel(self.stream_key, entry_id)
+        if task_id is not None:
+            pipe.zrem(self.cancelled_key, task_id)
+        pipe.execute()
+    
+    def ack(self, task_id: str):
+        """确认任务已处理完成（无论成功或失败）"""
+        entry_id = self._entries.pop(task_id, None)
+        if entry_id is not None:
+            self._ack_entry(entry_id, task_id)
+    
+    def heartbeat(self, task_id: str = None):
+        """续约：重置正在处理和本地缓存中的条目的空闲时间（已被其他Worker接管的条目不受影响）"""
+        entry_ids = [entry_id for entry_id, _ in self._buffer]
+        if task_id in self._entries:
+            entry_ids.append(self._entries[task_id])
+        if entry_ids:
+            self.redis_client.xclaim(self.stream_key, self.GROUP, self.worker_id, 0, entry_ids, justid=True)
+    
+    def lease(self, task_id: str):
+        """处理任务期间在后台线程中定期续约"""
+        return _renewing(self, task_id)
+    
+    def remove(self, task_id: str):
+        """取消任务：流中的条目无法按任务ID删除，记录取消标记，出队时跳过"""
+        now = time.time()
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.zadd(self.cancelled_key, {task_id: now})
+        pipe.zremrangebyscore(self.cancelled_key, 0, now - Config.CHECKPOINT_TTL)
+        pipe.execute()
+    
+    def clear_cancelled(self, task_id: str):
+        """清除任务的取消标记（任务已停止处理，不会再进入本阶段的流）"""
+        self.redis_client.zrem(self.cancelled_key, task_id)
+    
+    def reap(self) -> Tuple[List[str], List[str]]:
+        """用 XAUTOCLAIM 接管空闲超过租约时长的条目
+        
+        接管的任务放入本地缓存由当前Worker处理；XAUTOCLAIM 只转移仍然空闲的条目，
+        多个Worker同时回收时每个条目只会被一个Worker接管。
+        """
+        self._ensure_group()
+        requeued, dead = [], []
+        start_id = '0-0'
+        min_idle = int(self.lease_seconds * 1000)
+        
+        while True:
+            response = self.redis_client.xautoclaim(
+                self.stream_key, self.GROUP, self.worker_id, min_idle, start_id=start_id, count=100
+            )
+            start_id, entries = response[0], response[1]
+            if entries:
+                pending = self.redis_client.xpending_range(
+                    self.stream_key, self.GROUP, entries[0][0], entries[-1][0], len(entries), self.worker_id
+                )
+                delivered = {item['message_id']: item['times_delivered'] for item in pending}
+            
+            for entry_id, fields in entries:
+                if not fields or b'task_id' not in fields:
+                    # 待处理期间条目已被删除或裁剪（Redis 6.2 的 XAUTOCLAIM 返回空字段），直接确认，不再保留在待处理列表中
+                    self._ack_entry(entry_id)
+                    continue
+                task_id = fields[b'task_id'].decode('utf-8')
+                # 投递次数包含本次接管
+                if delivered.get(entry_id, 0) > Config.TASK_MAX_ATTEMPTS:
+                    self._ack_entry(entry_id, task_id)
+                    dead.append(task_id)
+                else:
+                    self._buffer.appendleft((entry_id, task_id))
+                    requeued.append(task_id)
+            
+            if start_id in (b'0-0', '0-0'):
+                break
+        
+        if requeued or dead:
+            logger.warning(f"Reclaimed stalled tasks: requeued={requeued}, abandoned={dead}")
+        return requeued, dead
+    
+    def _group_info(self) -> Optional[Dict[str, Any]]:
+        """消费者组信息（流不存在时为 None）"""
+        if not self.redis_client.exists(self.stream_key):
+            return None
+        for group in self.redis_client.xinfo_groups(self.stream_key):
+            if group['name'] in (self.GROUP, self.GROUP.encode('utf-8')):
+                return group
+        return None
+    
+    def size(self) -> int:
+        """排队中（尚未投递给任何消费者）的任务数"""
+        group = self._group_info()
+        if group is None:
+            return self.redis_client.xlen(self.stream_key)
+        # 已确认的条目会被删除，流长度减去待处理数即未投递数
+        if group.get('lag') is not None:
+            return group['lag']
+        return max(0, self.redis_client.xlen(self.stream_key) - group['pending'])
+    
+    def stats(self) -> Dict[str, Any]:
+        """队列统计：排队数（消费者组滞后）、待处理条目数、各消费者的待处理数"""
+        group = self._group_info()
+        if group is None:
+            return {'queued': self.size(), 'in_flight': 0, 'consumers': {}}
+        
+        consumers = {
+            consumer['name'].decode('utf-8'): consumer['pending']
+            for consumer in self.redis_client.xinfo_consumers(self.stream_key, self.GROUP)
+        }
+        return {'queued': self.size(), 'in_flight': group['pending'], 'consumers': consumers}
+
+def create_task_queue(redis_client=None, stage: str = None, **kwargs):
+    """按 TASK_QUEUE_BACKEND 创建任务队列；不传 redis_client 时使用内存队列
+    
+    Args:
+        stage: 流水线阶段名；为空时是任务入口队列，其他阶段的键名加上阶段后缀
+    """
+    if redis_client is None:
+        return MemoryTaskQueue()
+    queue_class = RedisStreamQueue if Config.TASK_QUEUE_BACKEND == 'stream' else RedisTaskQueue
+    name = f"{queue_class.DEFAULT_NAME}:{stage}" if stage else None
+    return queue_class(redis_client, name=name, **kwargs)
@@ -6,25 +6,40 @@ import json
 import time
 import os
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple, Callable
 import redis
 from src.core.config import Config
 from src.core.logger import get_logger, log_task_event
+from src.core.models import TaskRecord, TaskResult
+from src.services.checkpoint_store import CheckpointStore, file_digest, input_hash
+from src.utils.cancellation import CancellationToken, DeadlineExceeded, TaskCancelled
+from src.services.task_queue import STAGES, create_task_queue
 from src.services.whisper_service import WhisperService
 from src.services.translation_service import TranslationService
 from src.services.packaging_service import PackagingService
+from src.services.text_alignment import align_pages
+from src.utils.edit_distance import levenshtein_distance, text_similarity
 
 logger = get_logger("task_service")
 
 class TaskService:
     """任务服务类"""
     
+    # 任务二级索引：按创建时间排序的有序集合，以及每个状态一个有序集合（分数同为创建时间）
+    TASKS_BY_CREATED = 'tasks:by_created'
+    TASKS_BY_STATUS = 'tasks:status:'
+    # 状态计数（哈希 状态 -> 当前任务数）和状态转换计数（哈希 "旧状态->新状态" -> 累计次数），
+    # 与状态变更在同一事务中增量维护，监控读取时为 O(1)
+    STATUS_COUNTS = 'tasks:status_counts'
+    TRANSITIONS = 'tasks:transitions'
+    
     def __init__(self):
         """初始化任务服务"""
         self.redis_client = None
         self.use_memory_storage = False
         self.memory_storage = {}  # 内存存储
-        self.task_queue = []      # 任务队列
+        self.memory_status_counts = {}  # 内存模式的状态计数
+        self.memory_transitions = {}    # 内存模式的状态转换计数
         
         try:
             self.redis_client = redis.from_url(Config.REDIS_URL)
@@ -35,11 +50,23 @@ class TaskService:
             logger.warning(f"Redis connection failed: {str(e)}. Using memory storage.")
             self.use_memory_storage = True
         
+        # 任务队列和阶段检查点（阶段输出经检查点交给下一阶段）
+        self._create_queues()
+        self.checkpoints = CheckpointStore(None if self.use_memory_storage else self.redis_client)
+        
         # 延迟初始化服务
         self.whisper_service = None
         self.translation_service = None
         self.packaging_service = None
         
+    def _create_queues(self):
+        """创建各阶段的队列，第一个阶段的队列即任务入口队列 self.queue"""
+        redis_client = None if self.use_memory_storage else self.redis_client
+        self.queues = {}
+        for index, stage in enumerate(STAGES):
+            self.queues[stage] = create_task_queue(redis_client, stage=stage if index else None)
+        self.queue = self.queues[STAGES[0]]
+    
     def create_task(self, task_data: Dict[str, Any]) -> bool:
         """创建新任务"""
         try:
@@ -49,23 +76,30 @@ class TaskService:
                 task_data['task_id'] = str(uuid.uuid4())
             
             task_id = task_data['task_id']
-            task_data['created_at'] = datetime.now().isoformat()
-            task_data['updated_at'] = datetime.now().isoformat()
+            created = datetime.now()
+            task_data['created_at'] = created.isoformat()
+            task_data['updated_at'] = created.isoformat()
             task_data['progress'] = 0
             task_data['status'] = 'pending'
+            record = TaskRecord.from_dict(task_data)
             
             if self.use_memory_storage:
                 # 使用内存存储
-                self.memory_storage[f"task:{task_id}"] = task_data
-                self.task_queue.append(task_id)
+                self.memory_storage[f"task:{task_id}"] = record.pack()
+                self.queue.push(task_id)
+                self._count_memory_transition(None, 'pending')
             else:
-                # 保存到Redis
-                self.redis_client.hset(
-                    f"task:{task_id}",
-                    mapping=task_data
-                )
+                # 任务、索引和队列在同一事务中写入
+                score = created.timestamp()
+                pipe = self.redis_client.pipeline(transaction=True)
+                pipe.hset(f"task:{task_id}", mapping={'status': record.status, 'record': record.pack()})
+                pipe.zadd(self.TASKS_BY_CREATED, {task_id: score})
+                pipe.zadd(self.TASKS_BY_STATUS + 'pending', {task_id: score})
+                pipe.hincrby(self.STATUS_COUNTS, 'pending', 1)
+                pipe.hincrby(self.TRANSITIONS, 'new->pending', 1)
                 # 添加到任务队列
-                self.redis_client.lpush('task_queue', task_id)
+                self.queue.push(task_id, pipe)
+                pipe.execute()
             
             log_task_event(task_id, "created")
             return True
@@ -77,80 +111,176 @@ class TaskService:
     def get_task(self, task_id: str) -> Optional[Dict[str, Any]]:
         """获取任务信息"""
         try:
-            if self.use_memory_storage:
-                # 从内存存储获取
-                task_data = self.memory_storage.get(f"task:{task_id}")
-                return task_data
-            else:
-                # 从Redis获取
-                task_data = self.redis_client.hgetall(f"task:{task_id}")
-                if not task_data:
-                    return None
-                
-                # 转换字节为字符串
-                task = {}
-                for key, value in task_data.items():
-                    if isinstance(value, bytes):
-                        task[key.decode('utf-8')] = value.decode('utf-8')
-                    else:
-                        task[key] = value
-                
-                return task
+            record = self.get_task_record(task_id)
+            return record.to_dict() if record else None
             
         except Exception as e:
             logger.error(f"Error getting task {task_id}: {str(e)}")
             return None
     
-    def update_task_status(self, task_id: str, status: str, progress: int = None, error: str = None):
-        """更新任务状态"""
+    def get_task_record(self, task_id: str) -> Optional[TaskRecord]:
+        """读取任务记录（一次读取、一次解码）"""
+        if self.use_memory_storage:
+            blob = self.memory_storage.get(f"task:{task_id}")
+        else:
+            blob = self.redis_client.hget(f"task:{task_id}", 'record')
+            if not blob:
+                return self._migrate_legacy_task(task_id)
+        return TaskRecord.unpack(blob) if blob else None
+    
+    def _migrate_legacy_task(self, task_id: str) -> Optional[TaskRecord]:
+        """把旧版逐字段存储的任务哈希就地转换为记录格式，任务不存在时返回 None"""
+        task_key = f"task:{task_id}"
+        raw = self.redis_client.hgetall(task_key)
+        if not raw or b'record' in raw:
+            return TaskRecord.unpack(raw[b'record']) if raw else None
+        if b'task_id' not in raw:
+            logger.warning(f"Skipping task without record: {task_id}")
+            return None
+        
+        record = TaskRecord.from_legacy_hash(raw)
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.delete(task_key)
+        pipe.hset(task_key, mapping={'status': record.status, 'record': record.pack()})
+        pipe.execute()
+        logger.info(f"Migrated legacy task record: {task_id}")
+        return record
+    
+    def get_task_status(self, task_id: str) -> Optional[str]:
+        """只读取任务状态（Redis模式下不解码整个记录）"""
         try:
-            update_data = {
-                'status': status,
-                'updated_at': datetime.now().isoformat()
-            }
-            
-            if progress is not None:
-                update_data['progress'] = progress
-            
-            if error:
-                update_data['error'] = error
+            if self.use_memory_storage:
+                record = self.get_task_record(task_id)
+                return record.status if record else None
+            status = self.redis_client.hget(f"task:{task_id}", 'status')
+            return status.decode('utf-8') if status else None
+        except Exception as e:
+            logger.error(f"Error getting task status {task_id}: {str(e)}")
+            return None
+    
+    def update_task_status(self, task_id: str, status: Optional[str], progress: int = None, error: str = None,
+                           extra: Dict[str, Any] = None):
+        """更新任务状态（extra 合并到记录的扩展字段，status 为 None 时保持当前状态只更新其余字段）"""
+        try:
+            def apply(record: TaskRecord) -> bool:
+                # 已取消的任务只能通过重试回到 pending，仍在运行的处理不能覆盖取消状态
+                if record.status == 'cancelled' and status != 'pending':
+                    return False
+                if status is not None:
+                    record.status = status
+                record.updated_at = datetime.now().isoformat()
+                if progress is not None:
+                    record.progress = progress
+                if error:
+                    record.error = error
+                if extra:
+                    record.extra.update(extra)
+                return True
             
             if self.use_memory_storage:
                 # 更新内存存储
                 task_key = f"task:{task_id}"
                 if task_key in self.memory_storage:
-                    self.memory_storage[task_key].update(update_data)
+                    record = TaskRecord.unpack(self.memory_storage[task_key])
+                    old_status = record.status
+                    if apply(record):
+                        self.memory_storage[task_key] = record.pack()
+                        if old_status != record.status:
+                            self._count_memory_transition(old_status, record.status)
             else:
                 # 更新Redis
-                self.redis_client.hset(f"task:{task_id}", mapping=update_data)
+                self._redis_update_status(task_id, apply)
             
-            log_task_event(task_id, f"status_updated_to_{status}", progress=progress)
+            if status is not None:
+                log_task_event(task_id, f"status_updated_to_{status}", progress=progress)
             
         except Exception as e:
             logger.error(f"Error updating task {task_id}: {str(e)}")
     
+    def _redis_update_status(self, task_id: str, apply: Callable[[TaskRecord], bool]):
+        """在事务中更新任务记录，并把任务从旧状态索引移到新状态索引（apply 返回 False 时不更新）"""
+        task_key = f"task:{task_id}"
+        
+        def transition(pipe):
+            blob = pipe.hget(task_key, 'record')
+            if not blob:
+                pipe.multi()
+                return
+            
+            record = TaskRecord.unpack(blob)
+            old_status = record.status
+            if not apply(record):
+                pipe.multi()
+                return
+            status = record.status
+            score = self._created_score(record)
+            
+            pipe.multi()
+            pipe.hset(task_key, mapping={'status': status, 'record': record.pack()})
+            if old_status != status:
+                pipe.zrem(self.TASKS_BY_STATUS + old_status, task_id)
+                pipe.hincrby(self.STATUS_COUNTS, old_status, -1)
+                pipe.hincrby(self.STATUS_COUNTS, status, 1)
+                pipe.hincrby(self.TRANSITIONS, f"{old_status}->{status}", 1)
+            pipe.zadd(self.TASKS_BY_STATUS + status, {task_id: score})
+        
+        self.redis_client.transaction(transition, task_key)
+    
+    def _created_score(self, record: TaskRecord) -> float:
+        """任务在索引中的分数（创建时间戳）"""
+        try:
+            return datetime.fromisoformat(record.created_at).timestamp()
+        except ValueError:
+            return 0.0
+    
+    def _count_memory_transition(self, old_status: Optional[str], status: str):
+        """内存模式下维护状态计数"""
+        if old_status is not None:
+            self.memory_status_counts[old_status] = self.memory_status_counts.get(old_status, 0) - 1
+        self.memory_status_counts[status] = self.memory_status_counts.get(status, 0) + 1
+        transition = f"{old_status or 'new'}->{status}"
+        self.memory_transitions[transition] = self.memory_transitions.get(transition, 0) + 1
+    
+    def get_status_counts(self) -> Dict[str, Dict[str, int]]:
+        """各状态当前任务数和累计状态转换次数"""
+        try:
+            if self.use_memory_storage:
+                return {
+                    'status_counts': dict(self.memory_status_counts),
+                    'transitions': dict(self.memory_transitions)
+                }
+            
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.hgetall(self.STATUS_COUNTS)
+            pipe.hgetall(self.TRANSITIONS)
+            status_counts, transitions = pipe.execute()
+            return {
+                'status_counts': {key.decode('utf-8'): int(value) for key, value in status_counts.items()},
+                'transitions': {key.decode('utf-8'): int(value) for key, value in transitions.items()}
+            }
+            
+        except Exception as e:
+            logger.error(f"Error getting status counts: {str(e)}")
+            return {'status_counts': {}, 'transitions': {}}
+    
     def get_task_result(self, task_id: str) -> Optional[Dict[str, Any]]:
         """获取任务结果"""
         try:
             if self.use_memory_storage:
                 # 从内存存储获取结果
-                result_data = self.memory_storage.get(f"result:{task_id}")
-                return result_data
+                blob = self.memory_storage.get(f"result:{task_id}")
             else:
                 # 从Redis获取结果
-                result_data = self.redis_client.hgetall(f"result:{task_id}")
-                if not result_data:
-                    return None
-                
-                # 转换字节为字符串
-                result = {}
-                for key, value in result_data.items():
-                    if isinstance(value, bytes):
-                        result[key.decode('utf-8')] = value.decode('utf-8')
-                    else:
-                        result[key] = value
-                
-                return result
+                try:
+                    blob = self.redis_client.get(f"result:{task_id}")
+                except redis.ResponseError:
+                    # 旧版结果以哈希逐字段存储，转换为记录格式
+                    result = TaskResult.from_legacy_hash(self.redis_client.hgetall(f"result:{task_id}"))
+                    blob = result.pack()
+                    self.redis_client.set(f"result:{task_id}", blob)
+                    logger.info(f"Migrated legacy task result: {task_id}")
+            
+            return TaskResult.unpack(blob).to_dict() if blob else None
             
         except Exception as e:
             logger.error(f"Error getting task result {task_id}: {str(e)}")
@@ -160,10 +290,11 @@ class TaskService:
         """保存任务结果"""
         try:
             result_data['created_at'] = datetime.now().isoformat()
+            blob = TaskResult.from_dict(result_data).pack()
             if self.use_memory_storage:
-                self.memory_storage[f"result:{task_id}"] = result_data
+                self.memory_storage[f"result:{task_id}"] = blob
             else:
-                self.redis_client.hset(f"result:{task_id}", mapping=result_data)
+                self.redis_client.set(f"result:{task_id}", blob)
             
         except Exception as e:
             logger.error(f"Error saving task result {task_id}: {str(e)}")
@@ -178,12 +309,9 @@ class TaskService:
             # 更新状态为取消
             self.update_task_status(task_id, 'cancelled')
             
-            # 从队列中移除
-            if self.use_memory_storage:
-                if task_id in self.task_queue:
-                    self.task_queue.remove(task_id)
-            else:
-                self.redis_client.lrem('task_queue', 0, task_id)
+            # 从各阶段队列中移除
+            for queue in self.queues.values():
+                queue.remove(task_id)
             
             return True
             
@@ -191,49 +319,165 @@ class TaskService:
             logger.error(f"Error cancelling task {task_id}: {str(e)}")
             return False
     
-    def list_tasks(self, page: int = 1, per_page: int = 10, status: str = None) -> Dict[str, Any]:
-        """列出任务"""
+    def retry_task(self, task_id: str) -> bool:
+        """重新执行失败或已取消的任务，已完成的阶段从检查点恢复"""
+        try:
+            task = self.get_task_record(task_id)
+            if not task or task.status not in ('failed', 'cancelled'):
+                return False
+            
+            self.update_task_status(task_id, 'pending', progress=0, extra={'deadline_retries': 0})
+            self.queue.push(task_id)
+            log_task_event(task_id, "retried", checkpoints=self.checkpoints.names(task_id))
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error retrying task {task_id}: {str(e)}")
+            return False
+    
+    def list_tasks(self, page: int = 1, per_page: int = 10, status: str = None,
+                   cursor: str = None) -> Dict[str, Any]:
+        """列出任务（最新的在前）
+        
+        传入 cursor（上一页返回的 next_cursor）时从该位置之后继续，不受新任务插入影响；
+        否则按 page 分页。Redis模式下通过有序集合索引取出一页任务ID，
+        再用一次管道读取任务，耗时只与每页数量有关。
+        """
         try:
             if self.use_memory_storage:
-                # 从内存存储获取所有任务
-                task_keys = list(self.memory_storage.keys())
-                tasks = []
-                for key in task_keys:
-                    if key.startswith("task:"):
-                        task_id = key.split(':')[1]
-                        task = self.memory_storage[key]
-                        if task and (status is None or task.get('status') == status):
-                            tasks.append(task)
+                items, total, next_cursor = self._list_memory_tasks(page, per_page, status, cursor)
             else:
-                # 从Redis获取所有任务ID
-                task_keys = self.redis_client.keys('task:*')
-                tasks = []
-                for key in task_keys:
-                    task_id = key.decode('utf-8').split(':')[1]
-                    task = self.get_task(task_id)
-                    if task and (status is None or task.get('status') == status):
-                        tasks.append(task)
-            
-            # 排序（最新的在前）
-            tasks.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-            
-            # 分页
-            total = len(tasks)
-            start = (page - 1) * per_page
-            end = start + per_page
-            items = tasks[start:end]
+                items, total, next_cursor = self._list_redis_tasks(page, per_page, status, cursor)
             
             return {
                 'items': items,
                 'total': total,
                 'page': page,
                 'per_page': per_page,
-                'pages': (total + per_page - 1) // per_page
+                'pages': (total + per_page - 1) // per_page,
+                'next_cursor': next_cursor
             }
             
         except Exception as e:
             logger.error(f"Error listing tasks: {str(e)}")
-            return {'items': [], 'total': 0, 'page': page, 'per_page': per_page, 'pages': 0}
+            return {'items': [], 'total': 0, 'page': page, 'per_page': per_page, 'pages': 0, 'next_cursor': None}
+    
+    def _list_redis_tasks(self, page: int, per_page: int, status: Optional[str],
+                          cursor: Optional[str]) -> Tuple[List[Dict[str, Any]], int, Optional[str]]:
+        """从有序集合索引中分页读取任务"""
+        index_key = self.TASKS_BY_STATUS + status if status else self.TASKS_BY_CREATED
+        
+        start = (page - 1) * per_page
+        if cursor:
+            score, _, last_id = cursor.partition(':')
+            rank = self.redis_client.zrevrank(index_key, last_id)
+            if rank is not None:
+                start = rank + 1
+            else:
+                # 游标对应的任务已不在该索引中（如状态已变化），按 (创建时间, 任务ID) 定位：
+                # 排在它前面的是创建时间更晚的任务，以及创建时间相同、ID更大的任务（与 ZREVRANGE 的顺序一致）
+                ties = self.redis_client.zrangebyscore(index_key, score, score)
+                start = self.redis_client.zcount(index_key, f"({score}", '+inf') + sum(
+                    1 for task_id in ties if task_id.decode('utf-8') > last_id
+                )
+        
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.zcard(index_key)
+        pipe.zrevrange(index_key, start, start + per_page - 1, withscores=True)
+        total, entries = pipe.execute()
+        
+        pipe = self.redis_client.pipeline(transaction=False)
+        for task_id, _ in entries:
+            pipe.hget(f"task:{task_id.decode('utf-8')}", 'record')
+        
+        items = [TaskRecord.unpack(blob).to_dict() for blob in pipe.execute() if blob]
+        
+        next_cursor = None
+        if entries and start + len(entries) < total:
+            last_id, last_score = entries[-1]
+            next_cursor = f"{last_score!r}:{last_id.decode('utf-8')}"
+        return items, total, next_cursor
+    
+    def _list_memory_tasks(self, page: int, per_page: int, status: Optional[str],
+                           cursor: Optional[str]) -> Tuple[List[Dict[str, Any]], int, Optional[str]]:
+        """内存模式分页（与Redis索引相同，按 (创建时间, 任务ID) 从新到旧）"""
+        records = sorted(
+            (TaskRecord.unpack(blob) for key, blob in self.memory_storage.items() if key.startswith("task:")),
+            key=lambda record: (self._created_score(record), record.task_id),
+            reverse=True
+        )
+        records = [record for record in records if status is None or record.status == status]
+        
+        start = (page - 1) * per_page
+        if cursor:
+            score, _, last_id = cursor.partition(':')
+            position = (float(score), last_id)
+            start = next(
+                (i + 1 for i, record in enumerate(records) if record.task_id == last_id),
+                sum(1 for record in records if (self._created_score(record), record.task_id) > position)
+            )
+        
+        page_records = records[start:start + per_page]
+        next_cursor = None
+        if page_records and start + len(page_records) < len(records):
+            last = page_records[-1]
+            next_cursor = f"{self._created_score(last)!r}:{last.task_id}"
+        return [record.to_dict() for record in page_records], len(records), next_cursor
+    
+    def rebuild_task_index(self) -> int:
+        """用 SCAN 遍历已有任务重建二级索引和状态计数（不阻塞Redis），返回任务数量
+        
+        新索引先写入临时键，遍历完成后在一个事务中 RENAME 替换现有索引，
+        重建期间列表查询仍读取旧索引，不会看到空的或不完整的结果。
+        """
+        if self.use_memory_storage:
+            return len([key for key in self.memory_storage if key.startswith("task:")])
+        
+        rebuild_prefix = 'tasks:rebuild:'
+        temp_created = rebuild_prefix + self.TASKS_BY_CREATED
+        temp_counts = rebuild_prefix + self.STATUS_COUNTS
+        stale_temp = list(self.redis_client.scan_iter(match=rebuild_prefix + '*'))
+        if stale_temp:
+            self.redis_client.delete(*stale_temp)
+        
+        status_counts = {}
+        count = 0
+        for key in self.redis_client.scan_iter(match='task:*', count=1000):
+            task_id = key.decode('utf-8').split(':', 1)[1]
+            record = self.get_task_record(task_id)
+            if record is None:
+                continue
+            
+            score = self._created_score(record)
+            pipe = self.redis_client.pipeline(transaction=True)
+            pipe.zadd(temp_created, {task_id: score})
+            pipe.zadd(rebuild_prefix + self.TASKS_BY_STATUS + record.status, {task_id: score})
+            pipe.hincrby(temp_counts, record.status, 1)
+            pipe.execute()
+            status_counts[record.status] = status_counts.get(record.status, 0) + 1
+            count += 1
+        
+        # 原子替换：有任务的索引 RENAME 覆盖，已没有任务的状态索引删除
+        live_status_keys = set(self.redis_client.scan_iter(match=self.TASKS_BY_STATUS + '*'))
+        pipe = self.redis_client.pipeline(transaction=True)
+        if count:
+            pipe.rename(temp_created, self.TASKS_BY_CREATED)
+        else:
+            pipe.delete(self.TASKS_BY_CREATED)
+        for status in status_counts:
+            status_key = self.TASKS_BY_STATUS + status
+            pipe.rename(rebuild_prefix + status_key, status_key)
+            live_status_keys.discard(status_key.encode('utf-8'))
+        if live_status_keys:
+            pipe.delete(*live_status_keys)
+        
+        # 状态计数按实际任务重新计算，同样 RENAME 替换（转换计数是累计值，保留）
+        if count:
+            pipe.rename(temp_counts, self.STATUS_COUNTS)
+        else:
+            pipe.delete(self.STATUS_COUNTS)
+        pipe.execute()
+        return count
     
     def check_redis_health(self) -> bool:
         """检查Redis连接健康状态"""
@@ -248,10 +492,40 @@ class TaskService:
             logger.error(f"Redis health check failed: {str(e)}")
             return False
     
-    def process_task(self, task_id: str) -> bool:
-        """处理任务"""
+    def reclaim_stalled_tasks(self) -> Dict[str, List[str]]:
+        """回收租约过期的任务（处理它的Worker已退出或卡死）并更新任务状态"""
         try:
-            task = self.get_task(task_id)
+            requeued, dead = [], []
+            for queue in self.queues.values():
+                stage_requeued, stage_dead = queue.reap()
+                requeued.extend(stage_requeued)
+                dead.extend(stage_dead)
+            
+            for task_id in requeued:
+                record = self.get_task_record(task_id)
+                # 已取消或已结束的任务不回退状态
+                if record and record.status in ('pending', 'processing'):
+                    self.update_task_status(task_id, 'pending', progress=0)
+            for task_id in dead:
+                self.update_task_status(
+                    task_id, 'failed',
+                    error=f"Task abandoned after {Config.TASK_MAX_ATTEMPTS} expired leases"
+                )
+            
+            return {'requeued': requeued, 'failed': dead}
+            
+        except Exception as e:
+            logger.error(f"Error reclaiming stalled tasks: {str(e)}")
+            return {'requeued': [], 'failed': []}
+    
+    def process_task(self, task_id: str, stage: str = STAGES[0], stages: Tuple[str, ...] = STAGES) -> bool:
+        """处理任务
+        
+        从 stage 开始依次执行 stages 中的阶段（默认全部阶段，即在一个Worker中完成整个任务）；
+        遇到不在 stages 中的阶段时，把任务交给该阶段的队列后返回。
+        """
+        try:
+            task = self.get_task_record(task_id)
             if not task:
                 logger.error(f"Task not found: {task_id}")
                 return False
@@ -269,92 +543,302 @@ class TaskService:
                 from src.services.packaging_service import PackagingService
                 self.packaging_service = PackagingService()
             
-            # 更新状态为处理中
-            self.update_task_status(task_id, 'processing', 10)
-            
-            # 1. 语音识别
-            logger.info(f"Starting speech recognition for task {task_id}")
-            self.update_task_status(task_id, 'processing', 20)
+            # 任务被取消后，在阶段之间、音频块之间和翻译请求之间停止处理
+            cancel_token = CancellationToken(
+                lambda: self.get_task_status(task_id) == 'cancelled', Config.CANCEL_CHECK_INTERVAL
+            )
             
-            audio_file = task['audio_file']
-            # 确保使用绝对路径
-            if not os.path.isabs(audio_file):
-                audio_file = os.path.abspath(audio_file)
-            transcription = self.whisper_service.transcribe_audio(audio_file)
+            runners = {
+                'stt': self._run_stt_stage,
+                'translate': self._run_translate_stage,
+                'package': self._run_package_stage
+            }
+            # 每个阶段的时限为开始处理以来分配给已执行阶段的时间之和，前面阶段节省或超出的时间顺延
+            budget_start = time.monotonic()
+            allotted = 0.0
+            current = stage
+            for current in STAGES[STAGES.index(stage):]:
+                if current not in stages:
+                    cancel_token.raise_if_cancelled(force=True)
+                    self.queues[current].push(task_id)
+                    log_task_event(task_id, f"queued_for_{current}")
+                    return True
+                allotted += Config.STAGE_BUDGETS.get(current, 0) * Config.TASK_TIMEOUT
+                cancel_token.deadline = budget_start + allotted
+                cancel_token.raise_if_cancelled(force=True)
+                if not runners[current](task, cancel_token):
+                    return False
+                if task.extra.get('deadline_retries'):
+                    # 阶段在时限内完成，超时重试次数重新计算
+                    task.extra['deadline_retries'] = 0
+                    self.update_task_status(task_id, None, extra={'deadline_retries': 0})
             
-            if not transcription:
-                self.update_task_status(task_id, 'failed', error="Speech recognition failed")
-                return False
+            return True
             
-            # 2. 文本验证
+        except DeadlineExceeded:
+            self._handle_deadline_exceeded(task_id, current)
+            return False
+        except TaskCancelled:
+            # 已完成阶段的检查点保留，重试时复用；取消时写入各阶段的标记已无需保留
+            for queue in self.queues.values():
+                queue.clear_cancelled(task_id)
+            logger.info(f"Task {task_id} cancelled, stopped at stage {current}")
+            log_task_event(task_id, "processing_stopped")
+            return False
+        except Exception as e:
+            logger.error(f"Error processing task {task_id}: {str(e)}")
+            self.update_task_status(task_id, 'failed', error=str(e))
+            return False
+    
+    def _handle_deadline_exceeded(self, task_id: str, stage: str):
+        """阶段超时：保留已完成的检查点，重新放回该阶段的队列，超过 TASK_MAX_ATTEMPTS 次后标记失败"""
+        error = f"Deadline exceeded at stage {stage}"
+        record = self.get_task_record(task_id)
+        if not record or record.status == 'cancelled':
+            return
+        
+        retries = record.extra.get('deadline_retries', 0) + 1
+        if retries < Config.TASK_MAX_ATTEMPTS:
+            logger.warning(f"{error} for task {task_id}, requeued (attempt {retries})")
+            self.update_task_status(task_id, 'pending', error=error, extra={'deadline_retries': retries})
+            self.queues[stage].push(task_id)
+        else:
+            logger.error(f"{error} for task {task_id}, giving up after {retries} attempts")
+            self.update_task_status(task_id, 'failed', error=error)
+    
+    def _run_stt_stage(self, task: TaskRecord, cancel_token: Optional[CancellationToken] = None) -> bool:
+        """语音识别阶段（音频和模型未变化时复用检查点）"""
+        task_id = task.task_id
+        
+        # 更新状态为处理中
+        self.update_task_status(task_id, 'processing', 10)
+        
+        audio_file = task.audio_file
+        # 确保使用绝对路径
+        if not os.path.isabs(audio_file):
+            audio_file = os.path.abspath(audio_file)
+        
+        digest = input_hash('stt', file_digest(audio_file), task.whisper_model or Config.WHISPER_MODEL)
+        if self.checkpoints.load(task_id, 'stt', digest):
+            logger.info(f"Reusing speech recognition checkpoint for task {task_id}")
+            return True
+        
+        logger.info(f"Starting speech recognition for task {task_id}")
+        self.update_task_status(task_id, 'processing', 20)
+        
+        transcription = self.whisper_service.transcribe_audio(audio_file, task.whisper_model, cancel_token)
+        
+        if not transcription:
+            self.update_task_status(task_id, 'failed', error="Speech recognition failed")
+            return False
+        
+        self.checkpoints.save(task_id, 'stt', digest, transcription)
+        return True
+    
+    def _run_translate_stage(self, task: TaskRecord, cancel_token: Optional[CancellationToken] = None) -> bool:
+        """文本验证和翻译阶段（按页分段翻译，源文件不分页时翻译整段转录文本）
+        
+        验证结果和每种语言的完整译文分别保存检查点，重试时只翻译缺失的语言。
+        翻译不完整的语言记录在任务和结果的 failed_languages 中；所有目标语言都失败时任务失败。
+        """
+        task_id = task.task_id
+        stt = self.checkpoints.load(task_id, 'stt')
+        if stt is None:
+            self.update_task_status(task_id, 'failed', error="Speech recognition output missing")
+            return False
+        transcription = stt['output']
+        
+        # 文本验证
+        text_file = task.text_file
+        pages = self._load_source_segments(text_file)
+        validate_digest = input_hash('validate', stt['hash'], file_digest(text_file))
+        validation = self.checkpoints.load(task_id, 'validate', validate_digest)
+        if validation:
+            validation_result = validation['output']
+        else:
             logger.info(f"Starting text validation for task {task_id}")
             self.update_task_status(task_id, 'processing', 40)
-            
-            text_file = task['text_file']
-            validation_result = self._validate_text(transcription, text_file)
-            
-            # 3. 翻译
-            logger.info(f"Starting translation for task {task_id}")
+            validation_result = self._validate_text(transcription, text_file, pages)
+            self.checkpoints.save(task_id, 'validate', validate_digest, validation_result)
+        
+        # 翻译
+        segments = pages or {'main': transcription['text']}
+        
+        target_languages = task.target_languages
+        translations = {}
+        translation_segments = {}
+        
+        digests = {lang: input_hash('translate', segments, lang, Config.OPENAI_MODEL) for lang in target_languages}
+        for lang in target_languages:
+            checkpoint = self.checkpoints.load(task_id, f"translate:{lang}", digests[lang])
+            if checkpoint:
+                translation_segments[lang] = checkpoint['output']
+        
+        missing_languages = [lang for lang in target_languages if lang not in translation_segments]
+        failed_languages = {}
+        if missing_languages:
+            logger.info(f"Starting translation for task {task_id}: {', '.join(missing_languages)}")
             self.update_task_status(task_id, 'processing', 60)
             
-            target_languages = task['target_languages']
-            translations = {}
+            # 缺失的目标语言并发翻译
+            results = self.translation_service.translate_languages(
+                segments, missing_languages, cancel_token=cancel_token
+            )
             
-            for lang in target_languages:
-                translation = self.translation_service.translate_text(
-                    transcription['text'], 
-                    target_language=lang
-                )
-                if translation:
-                    translations[lang] = translation
-            
-            # 4. 打包
-            logger.info(f"Starting packaging for task {task_id}")
-            self.update_task_status(task_id, 'processing', 80)
-            
-            packaged_file = self.packaging_service.create_package(
-                task_id=task_id,
-                original_text=transcription['text'],
-                translations=translations,
-                audio_transcription=transcription
+            for lang in missing_languages:
+                translated = results.get(lang, {})
+                if len(translated) < len(segments):
+                    missing = [text_id for text_id in segments if text_id not in translated]
+                    logger.error(f"Translation to {lang} incomplete for task {task_id}, missing segments: {missing}")
+                    failed_languages[lang] = missing
+                    continue
+                self.checkpoints.save(task_id, f"translate:{lang}", digests[lang], translated)
+                translation_segments[lang] = translated
+        
+        if failed_languages and len(failed_languages) == len(target_languages):
+            self.update_task_status(
+                task_id, 'failed', error=f"Translation failed: {', '.join(failed_languages)}",
+                extra={'failed_languages': failed_languages}
             )
+            return False
+        if failed_languages or task.extra.get('failed_languages'):
+            self.update_task_status(task_id, 'processing', 70, extra={'failed_languages': failed_languages})
+        
+        # 按目标语言顺序输出
+        translation_segments = {
+            lang: translation_segments[lang] for lang in target_languages if lang in translation_segments
+        }
+        for lang, translated in translation_segments.items():
+            translations[lang] = self._join_segments(translated)
+        
+        self.checkpoints.save(task_id, 'translate', input_hash(validate_digest, digests), {
+            'pages': pages,
+            'text_validation': validation_result,
+            'translations': translations,
+            'translation_segments': translation_segments,
+            'failed_languages': failed_languages
+        })
+        return True
+    
+    def _run_package_stage(self, task: TaskRecord, cancel_token: Optional[CancellationToken] = None) -> bool:
+        """打包阶段，保存任务结果"""
+        task_id = task.task_id
+        stt = self.checkpoints.load(task_id, 'stt')
+        translate = self.checkpoints.load(task_id, 'translate')
+        if stt is None or translate is None:
+            self.update_task_status(task_id, 'failed', error="Translation output missing")
+            return False
+        transcription = stt['output']
+        translated = translate['output']
+        
+        logger.info(f"Starting packaging for task {task_id}")
+        self.update_task_status(task_id, 'processing', 80)
+        
+        pages = translated['pages']
+        translations = translated['translations']
+        translation_segments = translated['translation_segments']
+        
+        package_segments = None
+        if pages:
+            package_segments = {'original': pages}
+            package_segments.update(translation_segments)
+        
+        packaged_file = self.packaging_service.create_package(
+            task_id=task_id,
+            original_text=self._join_segments(pages) if pages else transcription['text'],
+            translations=translations,
+            audio_transcription=transcription,
+            segments=package_segments
+        )
+        
+        # 保存结果
+        result_data = {
+            'task_id': task_id,
+            'status': 'completed',
+            'translations': translations,
+            'translation_segments': translation_segments if pages else {},
+            'audio_transcription': transcription,
+            'text_validation': translated['text_validation'],
+            'packaged_file': packaged_file
+        }
+        if translated.get('failed_languages'):
+            result_data['failed_languages'] = translated['failed_languages']
+        
+        self.save_task_result(task_id, result_data)
+        self.update_task_status(task_id, 'completed', 100)
+        self.checkpoints.clear(task_id)
+        
+        log_task_event(task_id, "completed")
+        return True
+    
+    def _load_source_segments(self, text_file: str) -> Optional[Dict[str, str]]:
+        """读取按页编号组织的源文本（如 {"1": "...", "2": "..."}），不是分页结构时返回 None"""
+        try:
+            with open(text_file, 'r', encoding='utf-8') as f:
+                source = json.load(f)
             
-            # 5. 保存结果
-            result_data = {
-                'task_id': task_id,
-                'status': 'completed',
-                'translations': translations,
-                'audio_transcription': transcription,
-                'text_validation': validation_result,
-                'packaged_file': packaged_file
-            }
+            if not isinstance(source, dict) or not source:
+                return None
             
-            self.save_task_result(task_id, result_data)
-            self.update_task_status(task_id, 'completed', 100)
+            if not all(str(key).isdigit() and isinstance(value, str) for key, value in source.items()):
+                return None
             
-            log_task_event(task_id, "completed")
-            return True
+            # 按页码顺序排列
+            return {key: source[key] for key in sorted(source, key=int)}
             
         except Exception as e:
-            logger.error(f"Error processing task {task_id}: {str(e)}")
-            self.update_task_status(task_id, 'failed', error=str(e))
-            return False
+            logger.error(f"Error loading source segments from {text_file}: {str(e)}")
+            return None
     
-    def _validate_text(self, transcription: Dict[str, Any], text_file: str) -> Dict[str, Any]:
-        """验证文本准确性"""
+    def _join_segments(self, segments: Dict[str, str]) -> str:
+        """按页顺序拼接分段文本"""
+        return '\n'.join(text.strip() for text in segments.values())
+    
+    def _validate_text(self, transcription: Dict[str, Any], text_file: str,
+                       pages: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """验证文本准确性
+        
+        源文件按页组织时，先将带时间戳的识别分段对齐到各页，逐页报告相似度和时间范围，
+        并标记低于 VALIDATION_PAGE_THRESHOLD 的页。
+        """
         try:
+            stt_text = transcription['text']
+            
+            if pages:
+                segments = transcription.get('segments') or [{'text': stt_text, 'start': None, 'end': None}]
+                page_results = align_pages(pages, segments)
+                
+                # 整体相似度按页长度加权
+                total_length = sum(len(text) for text in pages.values()) or 1
+                similarity = sum(
+                    page_results[page_id]['similarity'] * len(text) for page_id, text in pages.items()
+                ) / total_length
+                flagged_pages = [
+                    page_id for page_id, result in page_results.items()
+                    if result['similarity'] < Config.VALIDATION_PAGE_THRESHOLD
+                ]
+                if flagged_pages:
+                    logger.warning(f"Pages below similarity threshold: {flagged_pages}")
+                
+                return {
+                    'similarity': similarity,
+                    'pages': page_results,
+                    'flagged_pages': flagged_pages,
+                    'stt_text': stt_text,
+                    'confidence': transcription.get('confidence', 0)
+                }
+            
             # 读取原始文本文件
             with open(text_file, 'r', encoding='utf-8') as f:
                 original_text = json.load(f)
-            
-            stt_text = transcription['text']
+            original = original_text.get('text') or original_text.get('content', '')
             
             # 简单的文本比较
-            similarity = self._calculate_similarity(stt_text, original_text.get('text', ''))
+            similarity = self._calculate_similarity(stt_text, original)
             
             return {
                 'similarity': similarity,
-                'original_text': original_text.get('text', ''),
+                'original_text': original,
                 'stt_text': stt_text,
                 'confidence': transcription.get('confidence', 0)
             }
@@ -367,49 +851,13 @@ class TaskService:
             }
     
     def _calculate_similarity(self, text1: str, text2: str) -> float:
-        """计算文本相似度"""
+        """计算文本相似度（忽略大小写和空格的字符级编辑距离）"""
         try:
-            # 简单的字符级相似度计算
-            if not text1 or not text2:
-                return 0.0
-            
-            # 转换为小写并移除空格
-            t1 = text1.lower().replace(' ', '')
-            t2 = text2.lower().replace(' ', '')
-            
-            if not t1 or not t2:
-                return 0.0
-            
-            # 计算编辑距离
-            distance = self._levenshtein_distance(t1, t2)
-            max_len = max(len(t1), len(t2))
-            
-            if max_len == 0:
-                return 1.0
-            
-            similarity = 1 - (distance / max_len)
-            return max(0.0, similarity)
-            
+            return text_similarity(text1, text2)
         except Exception as e:
             logger.error(f"Error calculating similarity: {str(e)}")
             return 0.0
     
     def _levenshtein_distance(self, s1: str, s2: str) -> int:
         """计算Levenshtein距离"""
-        if len(s1) < len(s2):
-            return self._levenshtein_distance(s2, s1)
-        
-        if len(s2) == 0:
-            return len(s1)
-        
-        previous_row = list(range(len(s2) + 1))
-        for i, c1 in enumerate(s1):
-            current_row = [i + 1]
-            for j, c2 in enumerate(s2):
-                insertions = previous_row[j + 1] + 1
-                deletions = current_row[j] + 1
-                substitutions = previous_row[j] + (c1 != c2)
-                current_row.append(min(insertions, deletions, substitutions))
-            previous_row = current_row
-        
-        return previous_row[-1] 
\ No newline at end of file
+        return levenshtein_distance(s1, s2)
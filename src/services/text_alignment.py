@@ -0,0 +1,87 @@
+"""
+语音识别分段与源文本分页对齐模块
+"""
+
+from bisect import bisect_left
+from typing import Dict, Any, List
+from src.utils.edit_distance import text_similarity
+
+def _normalized_length(text: str) -> int:
+    """与 text_similarity 一致的规范化长度（忽略大小写和空格）"""
+    return len(text.lower().replace(' ', ''))
+
+def _candidate_boundaries(prefix: List[int], cursor: int, page_length: int, ratio: float,
+                          window: int) -> List[int]:
+    """估计本页在转录文本中的结束分段边界，返回其附近的候选边界（按与估计位置的距离排序）"""
+    count = len(prefix) - 1
+    target = prefix[cursor] + page_length * ratio
+    guess = bisect_left(prefix, target, lo=cursor)
+    if guess > cursor and (guess > count or target - prefix[guess - 1] < prefix[guess] - target):
+        guess -= 1
+    
+    return sorted(
+        range(cursor, min(count, guess + window) + 1),
+        key=lambda boundary: abs(boundary - guess)
+    )[:2 * window + 1]
+
+def align_pages(pages: Dict[str, str], segments: List[Dict[str, Any]],
+                window: int = 3) -> Dict[str, Dict[str, Any]]:
+    """将按时间排序的Whisper分段单调地分配给各页
+    
+    按页顺序推进一个分段游标：先按字符数比例估计本页在转录文本中的结束位置，
+    只在估计位置前后 window 个分段边界中选择边界。选择时同时考虑下一页的最佳匹配，
+    这样某一页识别很差时，边界仍由下一页确定，后续各页不会错位。
+    每页只比较常数个候选，总耗时与书的长度近似线性。
+    
+    返回 {页码: {'similarity', 'start', 'end', 'segment_ids', 'stt_text'}}，
+    未分配到分段的页 start/end 为 None、相似度为 0。
+    """
+    texts = [segment.get('text', '').strip() for segment in segments]
+    prefix = [0]
+    for text in texts:
+        prefix.append(prefix[-1] + _normalized_length(text))
+    
+    page_ids = list(pages)
+    page_lengths = [_normalized_length(pages[page_id]) for page_id in page_ids]
+    ratio = prefix[-1] / (sum(page_lengths) or 1)
+    
+    scores = {}
+    def score(page_index: int, start: int, end: int) -> float:
+        key = (page_index, start, end)
+        if key not in scores:
+            scores[key] = text_similarity(pages[page_ids[page_index]], ' '.join(texts[start:end]))
+        return scores[key]
+    
+    def best_end(page_index: int, start: int) -> int:
+        """本页从 start 开始时的最佳结束边界（最后一页取全部剩余分段）"""
+        if page_index == len(page_ids) - 1:
+            return len(texts)
+        candidates = _candidate_boundaries(prefix, start, page_lengths[page_index], ratio, window)
+        return max(candidates, key=lambda end: score(page_index, start, end))
+    
+    alignment = {}
+    cursor = 0
+    for index, page_id in enumerate(page_ids):
+        if index == len(page_ids) - 1:
+            end = len(texts)
+        else:
+            # 本页得分 + 下一页在该边界之后的最佳得分；max 取第一个最大值，即最接近估计位置的边界
+            candidates = _candidate_boundaries(prefix, cursor, page_lengths[index], ratio, window)
+            end = max(candidates, key=lambda boundary: (
+                score(index, cursor, boundary)
+                + score(index + 1, boundary, best_end(index + 1, boundary))
+            ))
+        
+        assigned = segments[cursor:end]
+        alignment[page_id] = {
+            'similarity': score(index, cursor, end),
+            'start': assigned[0].get('start') if assigned else None,
+            'end': assigned[-1].get('end') if assigned else None,
+            'segment_ids': [segment.get('id', cursor + i) for i, segment in enumerate(assigned)],
+            'stt_text': ' '.join(texts[cursor:end])
+        }
+        cursor = end
+        # 只保留当前游标之后可能用到的得分
+        scores = {key: value for key, value in scores.items() if key[0] > index}
+    
+    return alignment
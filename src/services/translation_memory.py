@@ -0,0 +1,431 @@
+"""
+翻译记忆模块
+"""
+
+import os
+import re
+import time
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+from typing import Dict, Any, Optional, List, Tuple
+import redis
+from src.core.config import Config
+from src.core.logger import get_logger
+from src.utils.minhash import MinHashLSH
+
+logger = get_logger("translation_memory")
+
+class TranslationMemory:
+    """内容寻址的翻译记忆
+    
+    以 (规范化原文, 目标语言, 模型, 提示词版本) 的哈希为键缓存译文。
+    优先存储在Redis中供所有Worker共享，Redis不可用时使用本地SQLite文件。
+    另外维护一个MinHash LSH索引，用于查找相似的已翻译原文（模糊匹配），
+    索引按 (目标语言, 模型, 提示词版本) 划分作用域。
+    """
+    
+    KEY_PREFIX = 'tm:'
+    LRU_KEY = 'tm:lru'
+    STATS_KEY = 'tm:stats'
+    FUZZY_BUCKET_PREFIX = 'tm:fz:'
+    FUZZY_ENTRY_PREFIX = 'tm:fzsrc:'
+    FUZZY_LRU_KEY = 'tm:fzlru'
+    MAX_FUZZY_CANDIDATES = 50
+    
+    def __init__(self):
+        """初始化翻译记忆"""
+        self.ttl = Config.TRANSLATION_MEMORY_TTL
+        self.max_entries = Config.TRANSLATION_MEMORY_MAX_ENTRIES
+        self.db_path = Config.TRANSLATION_MEMORY_PATH
+        self.redis_client = None
+        self._local = None
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.lsh = MinHashLSH()
+        
+        # 统计计数
+        self.hits = 0
+        self.misses = 0
+        
+        try:
+            self.redis_client = redis.from_url(Config.REDIS_URL)
+            self.redis_client.ping()
+        except Exception as e:
+            logger.warning(f"Redis unavailable for translation memory: {str(e)}. Using local storage.")
+            self.redis_client = None
+    
+    @staticmethod
+    def normalize(text: str) -> str:
+        """规范化原文：统一Unicode形式并合并空白"""
+        return re.sub(r'\s+', ' ', unicodedata.normalize('NFC', text)).strip()
+    
+    @staticmethod
+    def make_key(text: str, target_language: str, model: str, prompt_version: str) -> str:
+        """计算内容寻址键"""
+        payload = '\x1f'.join([TranslationMemory.normalize(text), target_language, model, prompt_version])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def _local_store(self) -> sqlite3.Connection:
+        """获取本地SQLite存储（延迟创建）"""
+        if self._local is None:
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            self._local = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            with self._local:
+                self._local.execute("PRAGMA journal_mode=WAL")
+                self._local.execute("""
+                    CREATE TABLE IF NOT EXISTS memory (
+                        key TEXT PRIMARY KEY,
+                        translation TEXT NOT NULL,
+                        created_at REAL NOT NULL,
+                        accessed_at REAL NOT NULL
+                    )
+                """)
+                self._local.execute("CREATE INDEX IF NOT EXISTS idx_memory_accessed ON memory (accessed_at)")
+                self._local.execute("""
+                    CREATE TABLE IF NOT EXISTS fuzzy_entries (
+                        id TEXT PRIMARY KEY,
+                        source TEXT NOT NULL,
+                        translation TEXT NOT NULL,
+                        created_at REAL NOT NULL
+                    )
+                """)
+                self._local.execute("""
+                    CREATE TABLE IF NOT EXISTS fuzzy_buckets (
+                        bucket TEXT NOT NULL,
+                        id TEXT NOT NULL,
+                        PRIMARY KEY (bucket, id)
+                    )
+                """)
+        return self._local
+    
+    def lookup_many(self, keys: Dict[str, str]) -> Dict[str, str]:
+        """批量查询，keys 为 {调用方标识: 记忆键}，返回命中的 {调用方标识: 译文}"""
+        if not keys:
+            return {}
+        
+        found = {}
+        try:
+            if self.redis_client is not None:
+                found = self._redis_lookup(keys)
+            else:
+                found = self._local_lookup(keys)
+        except Exception as e:
+            logger.warning(f"Translation memory lookup failed: {str(e)}")
+        
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+    
+    def _redis_lookup(self, keys: Dict[str, str]) -> Dict[str, str]:
+        """从Redis批量查询，同一往返中刷新LRU时间并累计命中统计"""
+        names = list(keys)
+        pipe = self.redis_client.pipeline(transaction=False)
+        for name in names:
+            pipe.get(self.KEY_PREFIX + keys[name])
+        values = pipe.execute()
+        
+        found = {}
+        now = time.time()
+        pipe = self.redis_client.pipeline(transaction=False)
+        for name, value in zip(names, values):
+            if value is not None:
+                found[name] = value.decode('utf-8')
+                pipe.zadd(self.LRU_KEY, {keys[name]: now}, xx=True)
+        pipe.hincrby(self.STATS_KEY, 'hits', len(found))
+        pipe.hincrby(self.STATS_KEY, 'misses', len(keys) - len(found))
+        pipe.execute()
+        return found
+    
+    def _local_lookup(self, keys: Dict[str, str]) -> Dict[str, str]:
+        """从本地SQLite批量查询"""
+        now = time.time()
+        found = {}
+        with self._lock:
+            store = self._local_store()
+            with store:
+                for name, key in keys.items():
+                    row = store.execute(
+                        "SELECT translation FROM memory WHERE key = ? AND created_at > ?",
+                        (key, now - self.ttl)
+                    ).fetchone()
+                    if row:
+                        found[name] = row[0]
+                        store.execute("UPDATE memory SET accessed_at = ? WHERE key = ?", (now, key))
+        return found
+    
+    def store_many(self, entries: Dict[str, str]):
+        """批量写入 {记忆键: 译文}"""
+        if not entries:
+            return
+        
+        try:
+            if self.redis_client is not None:
+                self._redis_store(entries)
+            else:
+                self._local_store_entries(entries)
+        except Exception as e:
+            logger.warning(f"Translation memory store failed: {str(e)}")
+    
+    def _redis_store(self, entries: Dict[str, str]):
+        """写入Redis，超出容量时淘汰最久未使用的条目"""
+        now = time.time()
+        pipe = self.redis_client.pipeline(transaction=False)
+        for key, translation in entries.items():
+            pipe.set(self.KEY_PREFIX + key, translation, ex=self.ttl)
+            pipe.zadd(self.LRU_KEY, {key: now})
+        pipe.zcard(self.LRU_KEY)
+        size = pipe.execute()[-1]
+        
+        overflow = size - self.max_entries
+        if overflow > 0:
+            evicted = self.redis_client.zpopmin(self.LRU_KEY, overflow)
+            if evicted:
+                self.redis_client.delete(*[self.KEY_PREFIX + key.decode('utf-8') for key, _ in evicted])
+    
+    def _local_store_entries(self, entries: Dict[str, str]):
+        """写入本地SQLite，定期清理过期和超出容量的条目"""
+        now = time.time()
+        with self._lock:
+            store = self._local_store()
+            with store:
+                store.executemany(
+                    "INSERT OR REPLACE INTO memory (key, translation, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    [(key, translation, now, now) for key, translation in entries.items()]
+                )
+                
+                # 每写入一定次数清理一次，分摊淘汰开销
+                self._puts += len(entries)
+                if self._puts >= 100:
+                    self._puts = 0
+                    store.execute("DELETE FROM memory WHERE created_at <= ?", (now - self.ttl,))
+                    store.execute(
+                        """
+                        DELETE FROM memory WHERE key IN (
+                            SELECT key FROM memory ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                        )
+                        """,
+                        (self.max_entries,)
+                    )
+                    store.execute("DELETE FROM fuzzy_entries WHERE created_at <= ?", (now - self.ttl,))
+                    store.execute(
+                        """
+                        DELETE FROM fuzzy_entries WHERE id IN (
+                            SELECT id FROM fuzzy_entries ORDER BY created_at DESC LIMIT -1 OFFSET ?
+                        )
+                        """,
+                        (self.max_entries,)
+                    )
+                    store.execute("DELETE FROM fuzzy_buckets WHERE id NOT IN (SELECT id FROM fuzzy_entries)")
+    
+    @staticmethod
+    def fuzzy_scope(target_language: str, model: str, prompt_version: str) -> str:
+        """模糊索引的作用域：不同模型或提示词版本的译文互不复用"""
+        payload = '\x1f'.join([target_language, model, prompt_version])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+    
+    def _fuzzy_entry(self, source: str, scope: str) -> Tuple[str, str, List[str]]:
+        """计算模糊索引条目：(条目ID, 规范化原文, 桶键列表)"""
+        normalized = self.normalize(source)
+        entry_id = hashlib.sha256(f"{scope}\x1f{normalized}".encode('utf-8')).hexdigest()[:32]
+        signature = self.lsh.signature(self.lsh.shingles(normalized))
+        buckets = [f"{scope}:{band_key}" for band_key in self.lsh.band_keys(signature)]
+        return entry_id, normalized, buckets
+    
+    def add_fuzzy(self, entries: List[Tuple[str, str]], scope: str):
+        """将 (原文, 译文) 加入作用域 scope（见 fuzzy_scope）的模糊匹配索引"""
+        rows = []
+        for source, translation in entries:
+            if not source.strip():
+                continue
+            entry_id, normalized, buckets = self._fuzzy_entry(source, scope)
+            rows.append((entry_id, normalized, translation, buckets))
+        if not rows:
+            return
+        
+        try:
+            if self.redis_client is not None:
+                self._redis_add_fuzzy(rows)
+            else:
+                now = time.time()
+                with self._lock:
+                    store = self._local_store()
+                    with store:
+                        store.executemany(
+                            "INSERT OR REPLACE INTO fuzzy_entries (id, source, translation, created_at) VALUES (?, ?, ?, ?)",
+                            [(entry_id, normalized, translation, now) for entry_id, normalized, translation, _ in rows]
+                        )
+                        store.executemany(
+                            "INSERT OR IGNORE INTO fuzzy_buckets (bucket, id) VALUES (?, ?)",
+                            [(bucket, row[0]) for row in rows for bucket in row[3]]
+                        )
+        except Exception as e:
+            logger.warning(f"Fuzzy index update failed: {str(e)}")
+    
+    def _redis_add_fuzzy(self, rows: List[Tuple[str, str, str, List[str]]]):
+        """写入Redis模糊索引，超出容量时淘汰最早的条目并从其所在的桶中移除"""
+        now = time.time()
+        pipe = self.redis_client.pipeline(transaction=False)
+        for entry_id, normalized, translation, buckets in rows:
+            entry_key = self.FUZZY_ENTRY_PREFIX + entry_id
+            pipe.hset(entry_key, mapping={'source': normalized, 'translation': translation, 'buckets': ' '.join(buckets)})
+            pipe.expire(entry_key, self.ttl)
+            pipe.zadd(self.FUZZY_LRU_KEY, {entry_id: now})
+            for bucket in buckets:
+                pipe.sadd(self.FUZZY_BUCKET_PREFIX + bucket, entry_id)
+                pipe.expire(self.FUZZY_BUCKET_PREFIX + bucket, self.ttl)
+        # 已过期的条目哈希已被Redis删除，其桶成员在查询时惰性清理
+        pipe.zremrangebyscore(self.FUZZY_LRU_KEY, 0, now - self.ttl)
+        pipe.zcard(self.FUZZY_LRU_KEY)
+        size = pipe.execute()[-1]
+        
+        overflow = size - self.max_entries
+        if overflow <= 0:
+            return
+        evicted = [entry_id.decode('utf-8') for entry_id, _ in self.redis_client.zpopmin(self.FUZZY_LRU_KEY, overflow)]
+        pipe = self.redis_client.pipeline(transaction=False)
+        for entry_id in evicted:
+            pipe.hget(self.FUZZY_ENTRY_PREFIX + entry_id, 'buckets')
+        bucket_lists = pipe.execute()
+        
+        pipe = self.redis_client.pipeline(transaction=False)
+        for entry_id, buckets in zip(evicted, bucket_lists):
+            for bucket in (buckets or b'').decode('utf-8').split():
+                pipe.srem(self.FUZZY_BUCKET_PREFIX + bucket, entry_id)
+            pipe.delete(self.FUZZY_ENTRY_PREFIX + entry_id)
+        pipe.execute()
+    
+    def fuzzy_lookup_many(self, texts: Dict[str, str], scope: str,
+                          threshold: float) -> Dict[str, Dict[str, Any]]:
+        """批量查找最相似的已翻译原文，只比较作用域 scope 内LSH同桶的候选项
+        
+        texts 为 {调用方标识: 原文}，返回达到阈值的 {调用方标识: 匹配项}，
+        匹配项为 {'source', 'translation', 'similarity', 'exact'}。
+        """
+        entries = {}
+        for name, text in texts.items():
+            if text.strip():
+                _, normalized, buckets = self._fuzzy_entry(text, scope)
+                entries[name] = (normalized, buckets)
+        if not entries:
+            return {}
+        
+        try:
+            if self.redis_client is not None:
+                candidates = self._redis_fuzzy_candidates({name: buckets for name, (_, buckets) in entries.items()})
+            else:
+                candidates = {
+                    name: self._local_fuzzy_candidates(buckets)
+                    for name, (_, buckets) in entries.items()
+                }
+        except Exception as e:
+            logger.warning(f"Fuzzy lookup failed: {str(e)}")
+            return {}
+        
+        matches = {}
+        for name, (normalized, _) in entries.items():
+            shingles = self.lsh.shingles(normalized)
+            best = None
+            for source, translation in candidates.get(name, []):
+                similarity = 1.0 if source == normalized else self.lsh.jaccard(shingles, self.lsh.shingles(source))
+                if similarity >= threshold and (best is None or similarity > best['similarity']):
+                    best = {
+                        'source': source,
+                        'translation': translation,
+                        'similarity': similarity,
+                        'exact': source == normalized
+                    }
+            if best is not None:
+                matches[name] = best
+        return matches
+    
+    def fuzzy_lookup(self, text: str, scope: str, threshold: float) -> Optional[Dict[str, Any]]:
+        """查找单段原文的最相似匹配，没有达到阈值的匹配时返回 None"""
+        return self.fuzzy_lookup_many({'text': text}, scope, threshold).get('text')
+    
+    def _redis_fuzzy_candidates(self, buckets: Dict[str, List[str]]) -> Dict[str, List[Tuple[str, str]]]:
+        """批量读取各段同桶候选项的 (原文, 译文)
+        
+        所有段的桶在一次往返中读取，候选项按共享的桶数从多到少排列；
+        先剔除已过期的条目（并从桶中移除），再截取前 MAX_FUZZY_CANDIDATES 个。
+        """
+        names = list(buckets)
+        pipe = self.redis_client.pipeline(transaction=False)
+        for name in names:
+            for bucket in buckets[name]:
+                pipe.smembers(self.FUZZY_BUCKET_PREFIX + bucket)
+        members = iter(pipe.execute())
+        
+        pending, owners = {}, {}
+        for name in names:
+            shared = {}
+            for bucket in buckets[name]:
+                for member in next(members):
+                    entry_id = member.decode('utf-8')
+                    shared[entry_id] = shared.get(entry_id, 0) + 1
+                    owners.setdefault(entry_id, set()).add(bucket)
+            pending[name] = sorted(shared, key=lambda entry_id: -shared[entry_id])
+        
+        candidates = {name: [] for name in names}
+        stale = set()
+        while True:
+            # 每轮为每个候选项不足的段读取下一批条目，直到凑满或没有剩余的候选项
+            batch = []
+            for name in names:
+                needed = self.MAX_FUZZY_CANDIDATES - len(candidates[name])
+                if needed > 0 and pending[name]:
+                    batch.extend((name, entry_id) for entry_id in pending[name][:needed])
+                    pending[name] = pending[name][needed:]
+            if not batch:
+                break
+            
+            pipe = self.redis_client.pipeline(transaction=False)
+            for _, entry_id in batch:
+                pipe.hmget(self.FUZZY_ENTRY_PREFIX + entry_id, 'source', 'translation')
+            for (name, entry_id), (source, translation) in zip(batch, pipe.execute()):
+                if source is None or translation is None:
+                    stale.add(entry_id)
+                else:
+                    candidates[name].append((source.decode('utf-8'), translation.decode('utf-8')))
+        
+        if stale:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for entry_id in stale:
+                for bucket in owners[entry_id]:
+                    pipe.srem(self.FUZZY_BUCKET_PREFIX + bucket, entry_id)
+            pipe.zrem(self.FUZZY_LRU_KEY, *stale)
+            pipe.execute()
+        return candidates
+    
+    def _local_fuzzy_candidates(self, buckets: List[str]) -> List[Tuple[str, str]]:
+        """从本地SQLite读取同桶且未过期的候选项，按共享的桶数从多到少取前 MAX_FUZZY_CANDIDATES 个"""
+        placeholders = ','.join('?' * len(buckets))
+        with self._lock:
+            store = self._local_store()
+            rows = store.execute(
+                f"""
+                SELECT e.source, e.translation FROM fuzzy_entries e JOIN (
+                    SELECT id, COUNT(*) AS shared FROM fuzzy_buckets WHERE bucket IN ({placeholders}) GROUP BY id
+                ) b ON b.id = e.id
+                WHERE e.created_at > ?
+                ORDER BY b.shared DESC
+                LIMIT ?
+                """,
+                buckets + [time.time() - self.ttl, self.MAX_FUZZY_CANDIDATES]
+            ).fetchall()
+        return [(row[0], row[1]) for row in rows]
+    
+    def stats(self) -> Dict[str, Any]:
+        """命中率统计"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': 'redis' if self.redis_client is not None else 'local',
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
@@ -2,13 +2,107 @@
 翻译服务模块
 """
 
+import json
+import time
+import threading
+import contextvars
 import openai
-from typing import Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Any, Optional, List, Callable, Tuple
 from src.core.config import Config
 from src.core.logger import get_logger
+from src.services.translation_memory import TranslationMemory
+from src.services.rate_limiter import LLMRateLimiter, get_rate_limiter
+from src.utils.cancellation import CancellationToken, DeadlineExceeded, TaskCancelled
+from src.utils.resilience import CircuitBreaker, LatencyTracker, backoff_delay
 
 logger = get_logger("translation_service")
 
+# 提示词版本，修改翻译提示词时递增，使旧的翻译记忆失效
+PROMPT_VERSION = '2'
+
+# 进程内共享的翻译线程池，限制每个Worker同时进行的LLM请求数
+_executor = None
+_executor_lock = threading.Lock()
+_pool_thread = threading.local()
+# 对冲请求使用单独的线程池（翻译线程池的线程在等待对冲结果时不能再向本池提交）
+_hedge_executor = None
+# 当前任务阶段的处理时限（time.monotonic() 时间），由 translate_languages 设置并随调用传入线程池
+_request_deadline: contextvars.ContextVar = contextvars.ContextVar('request_deadline', default=None)
+
+# 可重试的LLM错误（超时、限流、连接失败、服务端错误），其余错误（如请求无效、认证失败）直接抛出
+RETRYABLE_ERRORS = (
+    openai.error.Timeout, openai.error.RateLimitError, openai.error.ServiceUnavailableError,
+    openai.error.APIConnectionError, openai.error.TryAgain
+)
+
+def _is_retryable(error: Exception) -> bool:
+    """是否为可重试的LLM错误"""
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    return isinstance(error, openai.error.APIError) and (error.http_status or 500) >= 500
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """从429响应的 Retry-After 头读取等待秒数"""
+    headers = getattr(error, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after') or headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+def _get_executor() -> ThreadPoolExecutor:
+    """获取（或创建）共享的翻译线程池"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=Config.TRANSLATION_MAX_CONCURRENCY,
+                thread_name_prefix="translation",
+                initializer=_mark_pool_thread
+            )
+        return _executor
+
+def _get_hedge_executor() -> ThreadPoolExecutor:
+    """获取（或创建）对冲请求线程池（每个请求最多同时有原请求和对冲请求两个）"""
+    global _hedge_executor
+    with _executor_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(
+                max_workers=Config.TRANSLATION_MAX_CONCURRENCY * 2,
+                thread_name_prefix="translation-hedge"
+            )
+        return _hedge_executor
+
+def _mark_pool_thread():
+    """标记线程池线程，避免在池内再次提交任务导致死锁"""
+    _pool_thread.active = True
+
+def run_concurrently(func: Callable, args_list: List[Tuple],
+                     cancel_token: Optional[CancellationToken] = None) -> List[Any]:
+    """在共享线程池中并发执行，结果顺序与参数顺序一致
+    
+    传入 cancel_token 时，取消后撤销尚未开始的调用并抛出 TaskCancelled（已发出的请求无法中断，其结果被丢弃）。
+    """
+    if len(args_list) <= 1 or getattr(_pool_thread, 'active', False):
+        results = []
+        for args in args_list:
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            results.append(func(*args))
+        return results
+    
+    executor = _get_executor()
+    futures = [executor.submit(contextvars.copy_context().run, func, *args) for args in args_list]
+    if cancel_token is not None:
+        pending = set(futures)
+        while pending:
+            _, pending = wait(pending, timeout=Config.CANCEL_CHECK_INTERVAL, return_when=FIRST_COMPLETED)
+            if pending and cancel_token.stopped:
+                for future in pending:
+                    future.cancel()
+                cancel_token.raise_if_cancelled()
+    return [future.result() for future in futures]
+
 class TranslationService:
     """翻译服务类"""
     
@@ -21,31 +115,237 @@ class TranslationService:
             openai.api_key = self.api_key
         else:
             logger.warning("OpenAI API key not configured")
+        
+        # 翻译记忆
+        self.memory = TranslationMemory() if Config.TRANSLATION_MEMORY_ENABLED else None
+        # 所有Worker共享的LLM限流器
+        self.rate_limiter = get_rate_limiter()
+        # 连续失败时快速失败，以及用于对冲请求的近期耗时
+        self.breaker = CircuitBreaker('openai', Config.LLM_BREAKER_THRESHOLD, Config.LLM_BREAKER_COOLDOWN)
+        self.latencies = LatencyTracker()
+    
+    def _chat_completion(self, system_prompt: str, prompt: str, max_tokens: int,
+                         temperature: float) -> str:
+        """调用OpenAI对话接口，返回回复文本
+        
+        可重试的错误按指数退避加抖动重试最多 LLM_MAX_RETRIES 次，退避会超过阶段时限时抛出 DeadlineExceeded；
+        连续失败 LLM_BREAKER_THRESHOLD 次后熔断，LLM_BREAKER_COOLDOWN 秒内直接抛出 CircuitOpenError。
+        """
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                result = self._hedged_completion(system_prompt, prompt, max_tokens, temperature)
+            except TaskCancelled:
+                self.breaker.release()
+                raise
+            except Exception as e:
+                if not _is_retryable(e):
+                    if isinstance(e, openai.error.OpenAIError):
+                        self.breaker.record_success()  # 服务端正常响应了错误（如请求无效）
+                    else:
+                        self.breaker.release()
+                    raise
+                self.breaker.record_failure()
+                # 请求因阶段时限到达而超时，按阶段超时处理（不是翻译失败）
+                deadline = _request_deadline.get()
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise DeadlineExceeded() from e
+                if attempt >= Config.LLM_MAX_RETRIES:
+                    raise
+                
+                # 429的 Retry-After 由限流器的共享冷却保证，这里只做退避
+                delay = backoff_delay(attempt, Config.LLM_RETRY_BASE_DELAY, Config.LLM_RETRY_MAX_DELAY)
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    raise DeadlineExceeded() from e
+                attempt += 1
+                logger.warning(f"LLM request failed ({type(e).__name__}: {str(e)}), "
+                               f"retry {attempt}/{Config.LLM_MAX_RETRIES} in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            
+            self.breaker.record_success()
+            return result
+    
+    def _hedged_completion(self, system_prompt: str, prompt: str, max_tokens: int,
+                           temperature: float) -> str:
+        """发出请求；开启对冲时，超过近期 LLM_HEDGE_PERCENTILE 分位耗时仍未返回则再发一个相同请求，取先成功的结果
+        
+        限流器处于冷却、并发上限低于起始值或没有空闲槽位时不对冲。
+        """
+        args = (system_prompt, prompt, max_tokens, temperature)
+        hedge_after = None
+        if Config.LLM_HEDGE_ENABLED:
+            hedge_after = self.latencies.percentile(Config.LLM_HEDGE_PERCENTILE, Config.LLM_HEDGE_MIN_SAMPLES)
+        if hedge_after is None:
+            return self._send_request(*args)
+        
+        executor = _get_hedge_executor()
+        primary = executor.submit(contextvars.copy_context().run, self._send_request, *args)
+        done, _ = wait([primary], timeout=hedge_after)
+        if done:
+            return primary.result()
+        
+        if not self.rate_limiter.has_headroom():
+            # 限流器在冷却或并发已被压低：服务已经过载，对冲只会加倍负载（较慢的请求无法中断，会一直占用槽位和配额）
+            return primary.result()
+        
+        logger.info(f"LLM request slower than {hedge_after:.1f}s, sending hedged request")
+        pending = {primary, executor.submit(contextvars.copy_context().run, self._send_request, *args)}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()  # 较慢的请求无法中断，其结果被丢弃
+                error = future.exception()
+        raise error
+    
+    def _send_request(self, system_prompt: str, prompt: str, max_tokens: int,
+                      temperature: float) -> str:
+        """发出一次请求
+        
+        请求经过共享限流器（RPM/TPM令牌桶 + 自适应并发），429、503和用满 OPENAI_TIMEOUT 的超时会让所有Worker一起退避。
+        请求超时为 OPENAI_TIMEOUT，且不超过当前阶段的剩余时限；时限已过时不再发出请求。
+        """
+        deadline = _request_deadline.get()
+        estimated = LLMRateLimiter.estimate_tokens(system_prompt + prompt, max_tokens)
+        with self.rate_limiter.request(estimated, deadline) as call:
+            timeout = Config.OPENAI_TIMEOUT
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise DeadlineExceeded()
+                timeout = min(timeout, remaining)
+            
+            started = time.monotonic()
+            try:
+                response = openai.ChatCompletion.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": prompt}
+                    ],
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    request_timeout=timeout
+                )
+            except openai.error.Timeout as e:
+                if timeout < Config.OPENAI_TIMEOUT:
+                    # 超时只是因为请求超时被截短到阶段剩余时限，不是服务过载，不触发并发减半和冷却
+                    raise DeadlineExceeded() from e
+                call.overloaded()
+                raise
+            except (openai.error.RateLimitError, openai.error.ServiceUnavailableError) as e:
+                call.overloaded(_retry_after(e))
+                raise
+            self.latencies.record(time.monotonic() - started)
+            
+            usage = response.get('usage') if hasattr(response, 'get') else None
+            if usage and 'total_tokens' in usage:
+                call.used(usage['total_tokens'])
+        return response.choices[0].message.content.strip()
+    
+    def _max_tokens_for(self, text: str) -> int:
+        """根据原文长度估算输出token上限，避免长文本被截断"""
+        return min(Config.TRANSLATION_MAX_TOKENS, max(1000, len(text) * 2))
+    
+    def _memory_key(self, text: str, target_language: str) -> str:
+        """翻译记忆键"""
+        return TranslationMemory.make_key(text, target_language, self.model, PROMPT_VERSION)
+    
+    def _fuzzy_scope(self, target_language: str) -> str:
+        """模糊翻译记忆的作用域"""
+        return TranslationMemory.fuzzy_scope(target_language, self.model, PROMPT_VERSION)
+    
+    def _lookup_memory(self, segments: Dict[str, str], target_language: str) -> Dict[str, str]:
+        """在翻译记忆中查找分段，返回命中的 {text_id: 译文}"""
+        if self.memory is None:
+            return {}
+        return self.memory.lookup_many({
+            text_id: self._memory_key(text, target_language)
+            for text_id, text in segments.items() if text.strip()
+        })
+    
+    def _store_memory(self, segments: Dict[str, str], translations: Dict[str, str], target_language: str):
+        """将新译文写入翻译记忆"""
+        if self.memory is None:
+            return
+        self.memory.store_many({
+            self._memory_key(segments[text_id], target_language): translation
+            for text_id, translation in translations.items()
+        })
+        if Config.TRANSLATION_FUZZY_ENABLED:
+            self.memory.add_fuzzy(
+                [(segments[text_id], translation) for text_id, translation in translations.items()],
+                self._fuzzy_scope(target_language)
+            )
+    
+    def _fuzzy_matches(self, segments: Dict[str, str],
+                       target_language: str) -> Tuple[Dict[str, str], Dict[str, Dict[str, Any]]]:
+        """模糊查找相似的已翻译原文
+        
+        返回 (可直接复用的 {text_id: 译文}, 作为参考的 {text_id: 匹配项})。
+        只匹配同一模型和提示词版本的译文；规范化后完全相同的原文（精确记忆已被淘汰时）直接复用。
+        """
+        reused, references = {}, {}
+        if self.memory is None or not Config.TRANSLATION_FUZZY_ENABLED:
+            return reused, references
+        
+        matches = self.memory.fuzzy_lookup_many(
+            segments, self._fuzzy_scope(target_language), Config.TRANSLATION_FUZZY_THRESHOLD
+        )
+        for text_id, match in matches.items():
+            if match['exact']:
+                reused[text_id] = match['translation']
+            else:
+                references[text_id] = match
+        
+        if reused:
+            self._store_memory({text_id: segments[text_id] for text_id in reused}, reused, target_language)
+        return reused, references
+    
+    def get_memory_stats(self) -> Dict[str, Any]:
+        """翻译记忆命中率统计"""
+        if self.memory is None:
+            return {'enabled': False}
+        return dict(self.memory.stats(), enabled=True)
     
     def translate_text(self, text: str, target_language: str, source_language: str = 'auto') -> Optional[str]:
         """翻译文本"""
         try:
-            if not self.api_key:
-                logger.error("OpenAI API key not configured")
-                return None
-            
             if not text.strip():
                 logger.warning("Empty text provided for translation")
                 return text
             
+            # 命中翻译记忆时直接返回，不调用API
+            cached = self._lookup_memory({'text': text}, target_language)
+            if cached:
+                return cached['text']
+            
+            reused, references = self._fuzzy_matches({'text': text}, target_language)
+            if reused:
+                return reused['text']
+            
+            if not self.api_key:
+                logger.error("OpenAI API key not configured")
+                return None
+            
             # 构建翻译提示
-            language_names = {
-                'zh-CN': '简体中文',
-                'zh-TW': '繁體中文',
-                'ja': '日本語',
-                'en': 'English'
-            }
+            target_lang_name = self.get_language_name(target_language)
             
-            target_lang_name = language_names.get(target_language, target_language)
+            reference = ''
+            if references:
+                match = references['text']
+                reference = f"""
+参考译文（相似原文的已有翻译，请保持术语和风格一致）：
+原文：{match['source']}
+译文：{match['translation']}
+"""
             
             prompt = f"""
 请将以下文本翻译成{target_lang_name}。请保持原文的意思和风格，确保翻译准确自然。
-
+{reference}
 原文：
 {text}
 
@@ -53,36 +353,298 @@ class TranslationService:
 """
             
             # 调用OpenAI API
-            response = openai.ChatCompletion.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "你是一个专业的翻译助手，擅长多语言翻译。"},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=1000,
+            translation = self._chat_completion(
+                "你是一个专业的翻译助手，擅长多语言翻译。",
+                prompt,
+                max_tokens=self._max_tokens_for(text),
                 temperature=0.3
             )
-            
-            translation = response.choices[0].message.content.strip()
             logger.info(f"Translation completed: {len(text)} -> {len(translation)} characters")
             
+            self._store_memory({'text': text}, {'text': translation}, target_language)
             return translation
-            
+        
+        except TaskCancelled:
+            raise
         except Exception as e:
             logger.error(f"Error translating text: {str(e)}")
             return None
     
-    def translate_batch(self, texts: list, target_language: str, source_language: str = 'auto') -> list:
-        """批量翻译文本"""
+    def translate_segments(self, segments: Dict[str, str], target_language: str,
+                           source_language: str = 'auto') -> Dict[str, str]:
+        """按文本编号（页）分批翻译，返回 {text_id: 译文}，翻译失败的段不包含在结果中"""
+        return self.translate_languages(segments, [target_language], source_language)[target_language]
+    
+    def translate_languages(self, segments: Dict[str, str], target_languages: List[str],
+                            source_language: str = 'auto',
+                            cancel_token: Optional[CancellationToken] = None) -> Dict[str, Dict[str, str]]:
+        """将分段并发翻译成多个目标语言，返回 {语言: {text_id: 译文}}
+        
+        命中翻译记忆的分段不再请求，其余 (语言, 批次) 请求一起提交到共享线程池，
+        总耗时约等于最慢的单个请求。任务取消时尚未发出的请求被撤销并抛出 TaskCancelled；
+        令牌设置了时限时，每个请求的超时不超过剩余时限。
+        开启 TRANSLATION_MULTI_LANGUAGE 时每个批次只请求一次，同时翻译成所有缺失的目标语言。
+        """
+        translations = {lang: {} for lang in target_languages}
+        for lang in target_languages:
+            translations[lang].update(self._lookup_memory(segments, lang))
+        
+        multi_language = Config.TRANSLATION_MULTI_LANGUAGE and len(target_languages) > 1
+        jobs = []
+        if multi_language:
+            pending = {
+                text_id: text for text_id, text in segments.items()
+                if any(text_id not in translations[lang] for lang in target_languages)
+            }
+            for batch in self._split_batches(pending):
+                languages = [
+                    lang for lang in target_languages
+                    if any(text_id not in translations[lang] for text_id in batch)
+                ]
+                jobs.append((batch, languages, source_language))
+        else:
+            for lang in target_languages:
+                pending = {
+                    text_id: text for text_id, text in segments.items()
+                    if text_id not in translations[lang]
+                }
+                jobs.extend((batch, lang, source_language) for batch in self._split_batches(pending))
+        
+        func = self._translate_multilingual_batch if multi_language else self._translate_segment_batch
+        deadline = _request_deadline.set(cancel_token.deadline if cancel_token is not None else None)
+        try:
+            results = run_concurrently(func, jobs, cancel_token)
+        finally:
+            _request_deadline.reset(deadline)
+        
+        for (_batch, lang, _source), translated in zip(jobs, results):
+            if multi_language:
+                for code, language_translations in translated.items():
+                    translations[code].update(language_translations)
+            else:
+                translations[lang].update(translated)
+        
+        # 按原始分段顺序输出
+        return {
+            lang: {text_id: translated[text_id] for text_id in segments if text_id in translated}
+            for lang, translated in translations.items()
+        }
+    
+    def _split_batches(self, segments: Dict[str, str]) -> List[Dict[str, str]]:
+        """按段数和字符数将分段拆分为多个批次"""
+        batches = []
+        batch = {}
+        batch_chars = 0
+        
+        for text_id, text in segments.items():
+            if batch and (len(batch) >= Config.TRANSLATION_BATCH_SIZE
+                          or batch_chars + len(text) > Config.TRANSLATION_BATCH_MAX_CHARS):
+                batches.append(batch)
+                batch = {}
+                batch_chars = 0
+            batch[text_id] = text
+            batch_chars += len(text)
+        
+        if batch:
+            batches.append(batch)
+        return batches
+    
+    def _translate_segment_batch(self, batch: Dict[str, str], target_language: str,
+                                 source_language: str = 'auto') -> Dict[str, str]:
+        """一次请求翻译一批分段，解析失败或缺失的段逐段重新翻译"""
+        if len(batch) == 1:
+            text_id, text = next(iter(batch.items()))
+            translation = self.translate_text(text, target_language, source_language)
+            return {text_id: translation} if translation is not None else {}
+        
+        translations = {}
         try:
-            translations = []
+            reused, references = self._fuzzy_matches(batch, target_language)
+            translations.update(reused)
+            pending = {text_id: text for text_id, text in batch.items() if text_id not in reused}
+            if not pending:
+                return translations
+            
+            if not self.api_key:
+                logger.error("OpenAI API key not configured")
+                return translations
+            
+            target_lang_name = self.get_language_name(target_language)
+            source_json = json.dumps(pending, ensure_ascii=False, indent=2)
             
-            for i, text in enumerate(texts):
-                logger.info(f"Translating text {i+1}/{len(texts)}")
+            reference = ''
+            if references:
+                reference_json = json.dumps({
+                    text_id: {'原文': match['source'], '译文': match['translation']}
+                    for text_id, match in references.items()
+                }, ensure_ascii=False, indent=2)
+                reference = f"""
+参考译文（相似原文的已有翻译，请保持术语和风格一致，不要输出）：
+{reference_json}
+"""
+            
+            prompt = f"""
+请将以下JSON对象中每个值翻译成{target_lang_name}。请保持原文的意思和风格，确保翻译准确自然。
+键是页码，请保持不变，只返回JSON对象，不要添加任何说明。
+{reference}
+{source_json}
+"""
+            
+            result_text = self._chat_completion(
+                "你是一个专业的翻译助手，擅长多语言翻译。",
+                prompt,
+                max_tokens=self._max_tokens_for(source_json),
+                temperature=0.3
+            )
+            batch_translations = self._parse_segment_response(result_text, pending)
+            self._store_memory(pending, batch_translations, target_language)
+            translations.update(batch_translations)
+        
+        except TaskCancelled:
+            raise
+        except Exception as e:
+            logger.error(f"Error translating segment batch: {str(e)}")
+        
+        # 缺失的段单独翻译
+        for text_id, text in batch.items():
+            if text_id not in translations:
+                logger.warning(f"Segment {text_id} missing from batch response, translating individually")
                 translation = self.translate_text(text, target_language, source_language)
-                translations.append(translation if translation else text)
+                if translation is not None:
+                    translations[text_id] = translation
+        
+        logger.info(f"Segment batch translated: {len(translations)}/{len(batch)} segments")
+        return translations
+    
+    def _translate_multilingual_batch(self, batch: Dict[str, str], target_languages: List[str],
+                                      source_language: str = 'auto') -> Dict[str, Dict[str, str]]:
+        """一次请求把一批分段翻译成多个目标语言，返回 {语言: {text_id: 译文}}
+        
+        回复须为以语言代码为键、值为 {页码: 译文} 的JSON对象。回复无法解析时所有语言退回逐语言翻译，
+        回复中缺失或格式不对的语言、以及缺失的段同样逐语言补译。
+        """
+        translations = {lang: {} for lang in target_languages}
+        try:
+            references = {}
+            for lang in target_languages:
+                reused, matches = self._fuzzy_matches(batch, lang)
+                translations[lang].update(reused)
+                if matches:
+                    references[lang] = matches
+            pending_languages = [lang for lang in target_languages if len(translations[lang]) < len(batch)]
+            if not pending_languages:
+                return translations
+            
+            if not self.api_key:
+                logger.error("OpenAI API key not configured")
+                return translations
+            
+            source_json = json.dumps(batch, ensure_ascii=False, indent=2)
+            language_names = '、'.join(f"{self.get_language_name(lang)}（{lang}）" for lang in pending_languages)
+            language_codes = ', '.join(f'"{lang}"' for lang in pending_languages)
+            
+            reference = ''
+            if references:
+                reference_json = json.dumps({
+                    lang: {
+                        text_id: {'原文': match['source'], '译文': match['translation']}
+                        for text_id, match in matches.items()
+                    }
+                    for lang, matches in references.items() if lang in pending_languages
+                }, ensure_ascii=False, indent=2)
+                reference = f"""
+参考译文（按语言给出相似原文的已有翻译，请保持术语和风格一致，不要输出）：
+{reference_json}
+"""
+            
+            prompt = f"""
+请将以下JSON对象中每个值分别翻译成{language_names}。请保持原文的意思和风格，确保翻译准确自然。
+只返回一个JSON对象，键为语言代码（{language_codes}），每个值是与原文键（页码）相同的JSON对象，不要添加任何说明。
+{reference}
+{source_json}
+"""
             
-            return translations
+            result_text = self._chat_completion(
+                "你是一个专业的翻译助手，擅长多语言翻译。",
+                prompt,
+                max_tokens=min(Config.TRANSLATION_MAX_TOKENS,
+                               self._max_tokens_for(source_json) * len(pending_languages)),
+                temperature=0.3
+            )
+            result = self._load_json_response(result_text)
+            if not isinstance(result, dict):
+                logger.warning("Unable to parse multi-language translation response")
+                result = {}
+            
+            for lang in pending_languages:
+                language_result = result.get(lang)
+                if not isinstance(language_result, dict):
+                    continue
+                pending = {text_id: text for text_id, text in batch.items() if text_id not in translations[lang]}
+                language_translations = self._filter_segments(language_result, pending)
+                self._store_memory(pending, language_translations, lang)
+                translations[lang].update(language_translations)
+            
+        except TaskCancelled:
+            raise
+        except Exception as e:
+            logger.error(f"Error translating multi-language batch: {str(e)}")
+        
+        # 缺失的语言（或其中缺失的段）单独翻译
+        for lang in target_languages:
+            missing = {text_id: text for text_id, text in batch.items() if text_id not in translations[lang]}
+            if missing:
+                logger.warning(f"{len(missing)} segments missing for {lang} in multi-language response, "
+                               f"translating separately")
+                translations[lang].update(self._translate_segment_batch(missing, lang, source_language))
+        
+        logger.info(f"Multi-language batch translated: {len(batch)} segments, {len(target_languages)} languages")
+        return translations
+    
+    def _load_json_response(self, result_text: str) -> Any:
+        """解析JSON回复（去掉可能的代码块标记），无法解析时返回 None"""
+        if result_text.startswith('```'):
+            result_text = result_text.strip('`')
+            if result_text.startswith('json'):
+                result_text = result_text[len('json'):]
+        
+        try:
+            return json.loads(result_text)
+        except json.JSONDecodeError:
+            return None
+    
+    def _parse_segment_response(self, result_text: str, batch: Dict[str, str]) -> Dict[str, str]:
+        """解析分段翻译的JSON回复，只保留请求中存在的字符串值"""
+        result = self._load_json_response(result_text)
+        if result is None:
+            logger.warning("Unable to parse segment translation response")
+            return {}
+        
+        if not isinstance(result, dict):
+            return {}
+        return self._filter_segments(result, batch)
+    
+    def _filter_segments(self, result: Dict[str, Any], batch: Dict[str, str]) -> Dict[str, str]:
+        """只保留请求中存在的分段的非空字符串译文"""
+        return {
+            str(text_id): value.strip()
+            for text_id, value in result.items()
+            if str(text_id) in batch and isinstance(value, str) and value.strip()
+        }
+    
+    def translate_batch(self, texts: list, target_language: str, source_language: str = 'auto') -> list:
+        """批量翻译文本"""
+        try:
+            logger.info(f"Translating {len(texts)} texts to {target_language}")
+            results = run_concurrently(
+                self.translate_text,
+                [(text, target_language, source_language) for text in texts]
+            )
+            
+            return [
+                translation if translation else text
+                for text, translation in zip(texts, results)
+            ]
             
         except Exception as e:
             logger.error(f"Error in batch translation: {str(e)}")
@@ -109,22 +671,15 @@ class TranslationService:
 }}
 """
             
-            response = openai.ChatCompletion.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "你是一个翻译质量评估专家。"},
-                    {"role": "user", "content": prompt}
-                ],
+            result_text = self._chat_completion(
+                "你是一个翻译质量评估专家。",
+                prompt,
                 max_tokens=500,
                 temperature=0.1
             )
             
-            # 解析响应
-            result_text = response.choices[0].message.content.strip()
-            
             # 简单的JSON解析
             try:
-                import json
                 result = json.loads(result_text)
                 return result
             except:
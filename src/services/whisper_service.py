@@ -3,13 +3,150 @@ Whisper语音识别服务
 """
 
 import os
+import time
+import signal
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 import whisper
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, Tuple
 from src.core.config import Config
 from src.core.logger import get_logger
+from src.services.audio_chunking import SAMPLE_RATE, plan_chunks, stitch_results
+from src.utils.cancellation import CancellationToken, TaskCancelled
 
 logger = get_logger("whisper_service")
 
+# 进程级模型注册表 {(模型名, 设备): 模型}，所有 WhisperService 实例共享。
+# 在fork子进程之前加载的模型以写时复制方式被子进程共享。
+_models: Dict[Tuple[str, str], Any] = {}
+_models_lock = threading.Lock()
+_load_locks: Dict[Tuple[str, str], threading.Lock] = {}
+
+def get_model(model_name: str, device: str = None):
+    """获取已加载的模型，未加载时加载并常驻（同一模型只加载一次）"""
+    key = (model_name, device or Config.WHISPER_DEVICE)
+    model = _models.get(key)
+    if model is not None:
+        return model
+    
+    with _models_lock:
+        load_lock = _load_locks.setdefault(key, threading.Lock())
+    
+    with load_lock:
+        model = _models.get(key)
+        if model is None:
+            logger.info(f"Loading Whisper model: {model_name} ({key[1]})")
+            start_time = time.time()
+            model = whisper.load_model(model_name, device=key[1])
+            _models[key] = model
+            logger.info(f"Whisper model loaded: {model_name} in {time.time() - start_time:.1f}s")
+    return model
+
+def preload_models(model_names: List[str] = None) -> List[str]:
+    """预加载模型（默认 WHISPER_MODELS），返回加载成功的模型名"""
+    loaded = []
+    for model_name in model_names or Config.WHISPER_MODELS:
+        try:
+            get_model(model_name)
+            loaded.append(model_name)
+        except Exception as e:
+            logger.error(f"Error preloading Whisper model {model_name}: {str(e)}")
+    return loaded
+
+def loaded_models() -> List[str]:
+    """当前进程已加载的模型名"""
+    return [model_name for model_name, _ in _models]
+
+# 转录进程池（延迟创建，子进程中的模型常驻以供后续任务复用）
+_pool = None
+_pool_pids = None  # 进程池子进程启动时上报PID的队列，终止进程池时使用
+_pool_lock = threading.Lock()
+
+def _init_pool_process(threads: int, pid_queue):
+    """子进程初始化：上报PID，并限制每个进程的计算线程数，避免进程间争抢CPU"""
+    pid_queue.put(os.getpid())
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except Exception:
+        pass
+
+def _thread_budget() -> int:
+    """当前进程可用的计算线程数（预fork子进程中已按子进程数分配）"""
+    try:
+        import torch
+        return torch.get_num_threads()
+    except Exception:
+        return os.cpu_count() or 1
+
+def _get_pool() -> ProcessPoolExecutor:
+    """获取转录进程池"""
+    global _pool, _pool_pids
+    with _pool_lock:
+        if _pool is None:
+            workers = max(1, Config.WHISPER_MAX_WORKERS)
+            # 按当前进程的线程配额分配，预fork子进程中的转录进程不会各自占满所有CPU核
+            threads = max(1, _thread_budget() // workers)
+            context = multiprocessing.get_context()
+            _pool_pids = context.SimpleQueue()
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=context,
+                initializer=_init_pool_process,
+                initargs=(threads, _pool_pids)
+            )
+            logger.info(f"Transcription pool started: {workers} processes x {threads} threads")
+        return _pool
+
+def shutdown_pool():
+    """关闭转录进程池"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+            _pool = None
+
+def abort_pool():
+    """立即终止转录进程池（任务取消时停止正在转录的子进程），下次使用时重建"""
+    global _pool, _pool_pids
+    with _pool_lock:
+        if _pool is not None:
+            # ProcessPoolExecutor 没有公开的终止接口，按子进程上报的PID结束进程
+            while not _pool_pids.empty():
+                try:
+                    os.kill(_pool_pids.get(), signal.SIGTERM)
+                except OSError:
+                    pass
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+            _pool_pids = None
+
+def _transcribe_chunk(model_name: str, device: str, audio, language: Optional[str]) -> Dict[str, Any]:
+    """在子进程中转录一个音频块（或整个音频文件）"""
+    model = get_model(model_name, device)
+    options = {'language': language} if language else {}
+    result = model.transcribe(audio, **options)
+    return {
+        'text': result.get('text', ''),
+        'language': result.get('language', 'unknown'),
+        'segments': result.get('segments', [])
+    }
+
+def _wait_pool_results(futures: list, cancel_token: Optional[CancellationToken]) -> List[Dict[str, Any]]:
+    """等待进程池中的转录完成；任务被取消或超过阶段时限时终止进程池，抛出 TaskCancelled / DeadlineExceeded"""
+    pending = set(futures)
+    while pending:
+        timeout = Config.CANCEL_CHECK_INTERVAL
+        remaining = cancel_token.remaining() if cancel_token is not None else None
+        if remaining is not None:
+            timeout = max(0.0, min(timeout, remaining))
+        _, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        if pending and cancel_token is not None and cancel_token.stopped:
+            abort_pool()
+            cancel_token.raise_if_cancelled()
+    return [future.result() for future in futures]
+
 class WhisperService:
     """Whisper语音识别服务"""
     
@@ -28,31 +165,44 @@ class WhisperService:
         else:
             logger.warning(f"FFmpeg not found at: {ffmpeg_path}")
         
-    def _load_model(self):
-        """加载Whisper模型"""
-        if self.model is None:
-            try:
-                logger.info(f"Loading Whisper model: {self.model_name}")
-                self.model = whisper.load_model(self.model_name, device=self.device)
-                logger.info("Whisper model loaded successfully")
-            except Exception as e:
-                logger.error(f"Error loading Whisper model: {str(e)}")
-                raise
+    def _load_model(self, model_name: str = None):
+        """从进程级注册表获取Whisper模型，返回模型"""
+        model_name = model_name or self.model_name
+        try:
+            model = get_model(model_name, self.device)
+        except Exception as e:
+            logger.error(f"Error loading Whisper model: {str(e)}")
+            raise
+        
+        if model_name == self.model_name:
+            self.model = model
+        return model
     
-    def transcribe_audio(self, audio_file: str) -> Optional[Dict[str, Any]]:
-        """转录音频文件"""
+    def transcribe_audio(self, audio_file: str, model_name: str = None,
+                         cancel_token: Optional[CancellationToken] = None) -> Optional[Dict[str, Any]]:
+        """转录音频文件，model_name 为空时使用默认模型
+        
+        CPU上长音频在 WHISPER_MAX_WORKERS > 1 时分块并行转录，否则传入 cancel_token 时在进程池子进程中整段转录。
+        取消或超过 cancel_token 的时限时终止转录进程，抛出 TaskCancelled / DeadlineExceeded。
+        """
         try:
             # 检查文件是否存在
             if not os.path.exists(audio_file):
                 logger.error(f"Audio file not found: {audio_file}")
                 return None
             
-            # 加载模型
-            self._load_model()
+            # 加载模型（在创建进程池之前加载，fork出的子进程可直接共享）
+            model = self._load_model(model_name)
             
             # 执行转录
-            logger.info(f"Transcribing audio file: {audio_file}")
-            result = self.model.transcribe(audio_file)
+            logger.info(f"Transcribing audio file: {audio_file} (model: {model_name or self.model_name})")
+            result = None
+            if self.device == 'cpu' and Config.WHISPER_MAX_WORKERS > 1:
+                result = self._transcribe_chunked(audio_file, model, model_name or self.model_name, cancel_token)
+            if result is None and self.device == 'cpu' and cancel_token is not None:
+                result = self._transcribe_in_pool(audio_file, model_name or self.model_name, cancel_token)
+            if result is None:
+                result = model.transcribe(audio_file)
             
             # 处理结果
             transcription = {
@@ -65,10 +215,82 @@ class WhisperService:
             logger.info(f"Transcription completed: {len(transcription['text'])} characters")
             return transcription
             
+        except TaskCancelled:
+            raise
         except Exception as e:
             logger.error(f"Error transcribing audio {audio_file}: {str(e)}")
             return None
     
+    def _transcribe_chunked(self, audio_file: str, model, model_name: str,
+                            cancel_token: Optional[CancellationToken] = None) -> Optional[Dict[str, Any]]:
+        """长音频按静音切分为重叠块转录后拼接
+        
+        各块在进程池中并行转录，取消时终止进程池并抛出 TaskCancelled；音频较短或转录失败时返回 None，由调用方整段转录。
+        """
+        try:
+            audio = whisper.load_audio(audio_file)
+            if len(audio) < Config.WHISPER_CHUNK_MIN_SECONDS * SAMPLE_RATE:
+                return None
+            
+            chunks = plan_chunks(audio, Config.WHISPER_CHUNK_SECONDS, Config.WHISPER_CHUNK_OVERLAP)
+            if len(chunks) < 2:
+                return None
+            
+            start_time = time.time()
+            
+            # 先用开头30秒统一检测语言，避免各块各自检测出不同语言
+            language = self._detect_audio_language(model, audio)
+            
+            pool = _get_pool()
+            futures = [
+                pool.submit(_transcribe_chunk, model_name, self.device, audio[chunk['start']:chunk['end']], language)
+                for chunk in chunks
+            ]
+            results = _wait_pool_results(futures, cancel_token)
+            
+            logger.info(
+                f"Chunked transcription completed: {len(chunks)} chunks of "
+                f"{len(audio) / SAMPLE_RATE:.0f}s audio in {time.time() - start_time:.1f}s"
+            )
+            return stitch_results(chunks, results)
+            
+        except TaskCancelled:
+            logger.info(f"Transcription cancelled: {audio_file}")
+            raise
+        except Exception as e:
+            logger.error(f"Chunked transcription failed, falling back to single pass: {str(e)}")
+            return None
+    
+    def _transcribe_in_pool(self, audio_file: str, model_name: str,
+                            cancel_token: CancellationToken) -> Optional[Dict[str, Any]]:
+        """在进程池子进程中整段转录，使阶段时限和取消能够终止正在进行的转录
+        
+        当前进程中的 model.transcribe 无法被打断，租约心跳会一直续期，阶段时限形同虚设。
+        取消或超时时终止进程池并抛出 TaskCancelled / DeadlineExceeded；进程池不可用时返回 None，由调用方在当前进程中转录。
+        """
+        try:
+            future = _get_pool().submit(_transcribe_chunk, model_name, self.device, audio_file, None)
+            return _wait_pool_results([future], cancel_token)[0]
+        except TaskCancelled:
+            logger.info(f"Transcription cancelled: {audio_file}")
+            raise
+        except Exception as e:
+            logger.error(f"Transcription pool failed, falling back to in-process transcription: {str(e)}")
+            abort_pool()
+            return None
+    
+    def _detect_audio_language(self, model, audio) -> Optional[str]:
+        """检测已解码音频开头部分的语言，失败时返回 None（由各块自行检测）"""
+        try:
+            mel = whisper.log_mel_spectrogram(
+                whisper.pad_or_trim(audio), n_mels=model.dims.n_mels
+            ).to(model.device)
+            _, probs = model.detect_language(mel)
+            return max(probs, key=probs.get)
+        except Exception as e:
+            logger.warning(f"Language detection failed: {str(e)}")
+            return None
+    
     def _calculate_confidence(self, result: Dict[str, Any]) -> float:
         """计算转录置信度"""
         try:
@@ -103,10 +325,10 @@ class WhisperService:
                 logger.error(f"Audio file not found: {audio_file}")
                 return None
             
-            self._load_model()
+            model = self._load_model()
             
             logger.info(f"Detecting language for: {audio_file}")
-            result = self.model.transcribe(audio_file, task="language_detection")
+            result = model.transcribe(audio_file, task="language_detection")
             
             language = result.get('language', 'unknown')
             logger.info(f"Detected language: {language}")
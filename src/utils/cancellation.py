@@ -0,0 +1,105 @@
+"""
+协作式取消模块
+"""
+
+import time
+import threading
+from typing import Callable, Optional
+from src.core.logger import get_logger
+
+logger = get_logger("cancellation")
+
+class TaskCancelled(Exception):
+    """任务已被取消"""
+
+class DeadlineExceeded(TaskCancelled):
+    """超过处理时限（按取消同样的路径中止处理）"""
+
+class CancellationToken:
+    """协作式取消令牌
+    
+    长时间运行的处理在阶段之间、音频块之间和翻译请求之间检查令牌，发现取消后抛出 TaskCancelled。
+    check 回调（如读取任务状态）最多每 interval 秒调用一次，取消一旦确认就不会恢复。
+    设置 deadline（time.monotonic() 时间）后，超过时限时抛出 DeadlineExceeded。
+    """
+    
+    def __init__(self, check: Optional[Callable[[], bool]] = None, interval: float = 1.0):
+        """初始化令牌
+        
+        Args:
+            check: 返回 True 表示已取消的回调
+            interval: 两次调用 check 的最小间隔（秒）
+        """
+        self._event = threading.Event()
+        self._check = check
+        self._interval = interval
+        self._last_check = float('-inf')
+        self._lock = threading.Lock()
+        self.deadline: Optional[float] = None
+    
+    def cancel(self):
+        """取消"""
+        self._event.set()
+    
+    def remaining(self) -> Optional[float]:
+        """距离时限的剩余秒数，未设置时限时为 None"""
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+    
+    @property
+    def expired(self) -> bool:
+        """是否已超过时限"""
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+    
+    @property
+    def stopped(self) -> bool:
+        """已取消或已超过时限"""
+        return self.expired or self.cancelled
+    
+    @property
+    def cancelled(self) -> bool:
+        """是否已取消"""
+        return self._poll(force=False)
+    
+    def _poll(self, force: bool) -> bool:
+        """按间隔调用 check 回调，force 时忽略间隔"""
+        if self._event.is_set():
+            return True
+        if self._check is None:
+            return False
+        
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_check < self._interval:
+                return False
+            self._last_check = now
+        
+        try:
+            if self._check():
+                self._event.set()
+        except Exception as e:
+            logger.warning(f"Cancellation check failed: {str(e)}")
+        return self._event.is_set()
+    
+    def raise_if_cancelled(self, force: bool = False):
+        """已取消时抛出 TaskCancelled，超过时限时抛出 DeadlineExceeded
+        
+        force 时立即调用 check 回调（用于阶段之间等低频检查点）。
+        """
+        if self._poll(force):
+            raise TaskCancelled()
+        if self.expired:
+            raise DeadlineExceeded()
+    
+    def wait(self, timeout: float) -> bool:
+        """等待 timeout 秒（用于重试间隔等），期间被取消或超过时限时提前返回 True"""
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.stopped:
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self._event.wait(min(remaining, self._interval))
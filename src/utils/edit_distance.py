@@ -0,0 +1,140 @@
+"""
+编辑距离与文本相似度模块
+"""
+
+from typing import Optional
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 位并行算法的匹配表约占 字符种类数 × 文本长度 / 8 字节，超过该值时改用NumPy逐行计算
+BITVECTOR_MAX_BYTES = 64 * 1024 * 1024
+
+def _myers_distance(pattern: str, text: str, max_distance: Optional[int] = None) -> int:
+    """Myers/Hyyrö 位并行编辑距离
+    
+    以Python大整数作为位向量，每读入 text 的一个字符只做常数次按位运算，
+    复杂度 O(n·⌈m/64⌉)。给定 max_distance 时，若剩余字符已不可能把距离
+    降到阈值以内则提前返回 max_distance + 1。
+    """
+    m = len(pattern)
+    n = len(text)
+    
+    peq = {}
+    for i, char in enumerate(pattern):
+        peq[char] = peq.get(char, 0) | (1 << i)
+    
+    mask = (1 << m) - 1
+    last = 1 << (m - 1)
+    pv = mask
+    mv = 0
+    score = m
+    
+    for j, char in enumerate(text):
+        eq = peq.get(char, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = (mv | ~(xh | pv)) & mask
+        mh = pv & xh
+        
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        
+        # 每多读一列距离最多减1
+        if max_distance is not None and score - (n - j - 1) > max_distance:
+            return max_distance + 1
+        
+        ph = (ph << 1) | 1
+        mh <<= 1
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv
+    
+    return score
+
+def _numpy_distance(s1: str, s2: str, max_distance: Optional[int] = None) -> int:
+    """按行向量化的动态规划编辑距离
+    
+    行内的插入依赖通过 minimum.accumulate 一次求出：
+    row[j] = min_k(tmp[k] + j - k) = accumulate(tmp - j) + j。
+    """
+    codes1 = np.fromiter(map(ord, s1), dtype=np.int64, count=len(s1))
+    codes2 = np.fromiter(map(ord, s2), dtype=np.int64, count=len(s2))
+    offsets = np.arange(len(s2) + 1, dtype=np.int64)
+    previous = offsets.copy()
+    current = np.empty_like(previous)
+    
+    for i, code in enumerate(codes1):
+        current[0] = i + 1
+        np.minimum(previous[1:] + 1, previous[:-1] + (codes2 != code), out=current[1:])
+        np.minimum.accumulate(current - offsets, out=current)
+        current += offsets
+        
+        # 行最小值是最终距离的下界
+        if max_distance is not None and current.min() > max_distance:
+            return max_distance + 1
+        previous, current = current, previous
+    
+    distance = int(previous[-1])
+    if max_distance is not None and distance > max_distance:
+        return max_distance + 1
+    return distance
+
+def levenshtein_distance(s1: str, s2: str, max_distance: Optional[int] = None) -> int:
+    """计算Levenshtein距离
+    
+    给定 max_distance 时，距离超过阈值立即返回 max_distance + 1（不再计算精确值）。
+    默认使用位并行算法；匹配表过大时退回 NumPy 向量化实现（内存只占一行）。
+    """
+    if len(s1) < len(s2):
+        s1, s2 = s2, s1
+    
+    if max_distance is not None and len(s1) - len(s2) > max_distance:
+        return max_distance + 1
+    
+    if s1 == s2:
+        return 0
+    
+    # 去掉公共前后缀，不影响距离
+    start = 0
+    limit = len(s2)
+    while start < limit and s1[start] == s2[start]:
+        start += 1
+    end = 0
+    while end < limit - start and s1[-1 - end] == s2[-1 - end]:
+        end += 1
+    s1 = s1[start:len(s1) - end]
+    s2 = s2[start:len(s2) - end]
+    
+    if not s2:
+        return len(s1) if max_distance is None else min(len(s1), max_distance + 1)
+    
+    if np is not None and len(set(s2)) * len(s2) // 8 > BITVECTOR_MAX_BYTES:
+        return _numpy_distance(s1, s2, max_distance)
+    return _myers_distance(s2, s1, max_distance)
+
+def text_similarity(text1: str, text2: str, min_similarity: Optional[float] = None) -> float:
+    """字符级相似度：忽略大小写和空格，1 - 编辑距离 / 较长文本长度
+    
+    给定 min_similarity 时，一旦确定相似度达不到阈值即提前结束，
+    此时返回值只保证小于阈值。
+    """
+    if not text1 or not text2:
+        return 0.0
+    
+    t1 = text1.lower().replace(' ', '')
+    t2 = text2.lower().replace(' ', '')
+    
+    if not t1 or not t2:
+        return 0.0
+    
+    max_len = max(len(t1), len(t2))
+    max_distance = None
+    if min_similarity is not None:
+        max_distance = max(0, int((1 - min_similarity) * max_len))
+    
+    distance = levenshtein_distance(t1, t2, max_distance)
+    return max(0.0, 1 - (distance / max_len))
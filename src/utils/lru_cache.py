@@ -0,0 +1,88 @@
+"""
+LRU缓存模块
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+class LRUCache:
+    """线程安全的LRU缓存，同时按条目数和字节数限制容量"""
+    
+    def __init__(self, max_entries: int, max_bytes: int):
+        """初始化缓存"""
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()  # key -> (value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        
+        # 统计计数
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @property
+    def enabled(self) -> bool:
+        """容量为0时缓存关闭"""
+        return self.max_entries > 0 and self.max_bytes > 0
+    
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """获取缓存值，命中时移到最近使用的位置"""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+    
+    def put(self, key: Hashable, value: Any, size: int):
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        if not self.enabled or size > self.max_bytes:
+            return
+        
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            
+            self._items[key] = (value, size)
+            self._bytes += size
+            
+            while len(self._items) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+    
+    def pop(self, key: Hashable) -> Optional[Any]:
+        """移除缓存条目"""
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None:
+                return None
+            self._bytes -= item[1]
+            return item[0]
+    
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+    
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._items),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,67 @@
+"""
+MinHash局部敏感哈希模块
+"""
+
+import random
+import hashlib
+from typing import List, Set
+
+# 2^61 - 1，梅森素数
+_PRIME = (1 << 61) - 1
+
+class MinHashLSH:
+    """基于字符n-gram的MinHash签名与LSH分桶
+    
+    相似文本的签名在至少一个band上完全相同的概率很高，因此只需查询
+    相同band桶中的候选项，查询耗时与已存储的总量无关。
+    """
+    
+    def __init__(self, num_bands: int = 16, rows_per_band: int = 4, ngram: int = 3, seed: int = 1):
+        """初始化哈希参数（固定种子，保证不同进程的签名一致）"""
+        self.num_bands = num_bands
+        self.rows_per_band = rows_per_band
+        self.ngram = ngram
+        
+        rng = random.Random(seed)
+        num_perm = num_bands * rows_per_band
+        self._params = [
+            (rng.randrange(1, _PRIME), rng.randrange(0, _PRIME))
+            for _ in range(num_perm)
+        ]
+    
+    def shingles(self, text: str) -> Set[str]:
+        """生成字符n-gram集合"""
+        text = ' '.join(text.lower().split())
+        if len(text) <= self.ngram:
+            return {text} if text else set()
+        return {text[i:i + self.ngram] for i in range(len(text) - self.ngram + 1)}
+    
+    @staticmethod
+    def _hash(value: str) -> int:
+        """稳定的64位哈希（不受 PYTHONHASHSEED 影响）"""
+        return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'little')
+    
+    def signature(self, shingles: Set[str]) -> List[int]:
+        """计算MinHash签名"""
+        hashes = [self._hash(shingle) for shingle in shingles]
+        if not hashes:
+            return [0] * len(self._params)
+        return [min((a * h + b) % _PRIME for h in hashes) for a, b in self._params]
+    
+    def band_keys(self, signature: List[int]) -> List[str]:
+        """将签名切分为band，返回每个band的桶键"""
+        keys = []
+        for band in range(self.num_bands):
+            rows = signature[band * self.rows_per_band:(band + 1) * self.rows_per_band]
+            digest = hashlib.blake2b(
+                ','.join(str(value) for value in rows).encode('ascii'), digest_size=8
+            ).hexdigest()
+            keys.append(f"{band}:{digest}")
+        return keys
+    
+    @staticmethod
+    def jaccard(a: Set[str], b: Set[str]) -> float:
+        """n-gram集合的Jaccard相似度"""
+        if not a and not b:
+            return 1.0
+        return len(a & b) / len(a | b)
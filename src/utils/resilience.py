@@ -0,0 +1,102 @@
+"""
+外部调用容错模块（退避、延迟统计、熔断）
+"""
+
+import time
+import random
+import threading
+from collections import deque
+from typing import Optional
+from src.core.logger import get_logger
+
+logger = get_logger("resilience")
+
+class CircuitOpenError(Exception):
+    """熔断器打开，请求被直接拒绝"""
+
+def backoff_delay(attempt: int, base: float, maximum: float) -> float:
+    """第 attempt 次重试（从0开始）前的等待秒数：指数退避 + 全抖动"""
+    return random.uniform(0, min(maximum, base * (2 ** attempt)))
+
+class LatencyTracker:
+    """最近若干次调用耗时的滑动窗口，用于计算分位数（如对冲请求的发出时机）"""
+    
+    def __init__(self, window: int = 200):
+        """初始化窗口"""
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+    
+    def record(self, seconds: float):
+        """记录一次成功调用的耗时"""
+        with self._lock:
+            self._samples.append(seconds)
+    
+    def percentile(self, q: float, min_samples: int = 1) -> Optional[float]:
+        """耗时的 q 分位数（0-1），样本不足 min_samples 时为 None"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples or len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+class CircuitBreaker:
+    """熔断器
+    
+    连续失败 threshold 次后打开，cooldown 秒内的请求直接抛出 CircuitOpenError；
+    冷却后进入半开状态，只放行一个探测请求，成功则关闭，失败则重新打开。
+    """
+    
+    def __init__(self, name: str, threshold: int, cooldown: float):
+        """初始化熔断器"""
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+    
+    @property
+    def state(self) -> str:
+        """closed / open / half_open"""
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            if time.monotonic() - self.opened_at < self.cooldown:
+                return 'open'
+            return 'half_open'
+    
+    def before_call(self):
+        """请求前检查，熔断时抛出 CircuitOpenError"""
+        if self.threshold <= 0:
+            return
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at >= self.cooldown and not self._probing:
+                self._probing = True
+                return
+        raise CircuitOpenError(f"Circuit {self.name} is open")
+    
+    def record_success(self):
+        """请求成功（或服务端正常给出的错误），关闭熔断器"""
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info(f"Circuit {self.name} closed")
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+    
+    def record_failure(self):
+        """请求失败（超时、限流、服务不可用等）"""
+        with self._lock:
+            self.failures += 1
+            if self._probing or (self.opened_at is None and 0 < self.threshold <= self.failures):
+                logger.warning(f"Circuit {self.name} opened after {self.failures} consecutive failures")
+                self.opened_at = time.monotonic()
+            self._probing = False
+    
+    def release(self):
+        """请求未完成（如被取消），释放半开状态的探测名额"""
+        with self._lock:
+            self._probing = False
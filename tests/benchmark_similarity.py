@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+文本相似度性能基准
+
+对比原来的纯Python逐行动态规划与新的编辑距离引擎（位并行 / NumPy逐行），
+输入为故事长度（约5000字符）的原文与带识别错误的转录文本。
+
+用法: python tests/benchmark_similarity.py [字符数]
+"""
+
+import os
+import sys
+import time
+import random
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.utils import edit_distance
+
+WORDS = (
+    "once upon a time there was a little fox who lived in the forest near the river "
+    "every morning he walked to the water and talked with his friend the old turtle"
+).split()
+
+def legacy_levenshtein(s1: str, s2: str) -> int:
+    """原 TaskService._levenshtein_distance 的实现"""
+    if len(s1) < len(s2):
+        return legacy_levenshtein(s2, s1)
+    
+    if len(s2) == 0:
+        return len(s1)
+    
+    previous_row = list(range(len(s2) + 1))
+    for i, c1 in enumerate(s1):
+        current_row = [i + 1]
+        for j, c2 in enumerate(s2):
+            insertions = previous_row[j + 1] + 1
+            deletions = current_row[j] + 1
+            substitutions = previous_row[j] + (c1 != c2)
+            current_row.append(min(insertions, deletions, substitutions))
+        previous_row = current_row
+    
+    return previous_row[-1]
+
+def make_story(length: int, seed: int = 42):
+    """生成原文和约5%字符出错的转录文本"""
+    rng = random.Random(seed)
+    original = ' '.join(rng.choice(WORDS) for _ in range(length // 4))[:length]
+    
+    transcript = []
+    for char in original:
+        roll = rng.random()
+        if roll < 0.02:
+            continue  # 漏字
+        if roll < 0.04:
+            transcript.append(rng.choice('abcdefghijklmnopqrstuvwxyz'))  # 错字
+        elif roll < 0.05:
+            transcript.extend([char, rng.choice('aeiou')])  # 多字
+        else:
+            transcript.append(char)
+    return original.replace(' ', ''), ''.join(transcript).replace(' ', '')
+
+def timed(func, *args, repeat: int = 1):
+    """返回 (结果, 单次平均耗时秒)"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func(*args)
+    return result, (time.perf_counter() - start) / repeat
+
+def main():
+    length = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    original, transcript = make_story(length)
+    print(f"Input: {len(original)} vs {len(transcript)} characters")
+    
+    expected, legacy_time = timed(legacy_levenshtein, original, transcript)
+    print(f"legacy (pure Python DP): {legacy_time * 1000:10.1f} ms  distance={expected}")
+    
+    candidates = [
+        ('bit-parallel (Myers)', edit_distance.levenshtein_distance, (original, transcript)),
+        ('bit-parallel, threshold 0.8', edit_distance.levenshtein_distance,
+         (original, transcript, int(0.2 * max(len(original), len(transcript))))),
+        ('NumPy rows', edit_distance._numpy_distance, (original, transcript)),
+    ]
+    for name, func, args in candidates:
+        distance, elapsed = timed(func, *args, repeat=5)
+        assert distance == expected, f"{name} returned {distance}, expected {expected}"
+        print(f"{name:27s}: {elapsed * 1000:10.1f} ms  speedup x{legacy_time / elapsed:,.0f}")
+    
+    # 阈值提前结束：完全不同的文本
+    unrelated = ''.join(reversed(transcript))
+    _, full_time = timed(edit_distance.levenshtein_distance, original, unrelated, repeat=5)
+    _, early_time = timed(edit_distance.text_similarity, original, unrelated, 0.8, repeat=5)
+    print(f"unrelated text, exact     : {full_time * 1000:10.1f} ms")
+    print(f"unrelated text, early exit: {early_time * 1000:10.1f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,15 @@
+"""
+测试公共配置
+"""
+
+import os
+import shutil
+import atexit
+import tempfile
+
+# 运行时数据库（打包索引、翻译记忆）写到临时目录，不写入仓库的 data/ 目录。
+# src.api.routes 在导入时即创建服务，因此须在导入 Config 之前通过环境变量设置。
+_runtime_dir = tempfile.mkdtemp(prefix='giggle-tests-')
+atexit.register(shutil.rmtree, _runtime_dir, ignore_errors=True)
+os.environ['PACKAGE_INDEX_PATH'] = os.path.join(_runtime_dir, 'package_index.db')
+os.environ['TRANSLATION_MEMORY_PATH'] = os.path.join(_runtime_dir, 'translation_memory.db')
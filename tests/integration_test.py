@@ -12,6 +12,8 @@ from src.services.task_service import TaskService
 from src.services.whisper_service import WhisperService
 from src.services.translation_service import TranslationService
 from src.services.packaging_service import PackagingService
+from src.core.config import Config
+from src.utils.lru_cache import LRUCache
 
 class TestIntegration:
     """集成测试类"""
@@ -21,6 +23,16 @@ class TestIntegration:
         """创建任务服务实例"""
         return TaskService()
     
+    @pytest.fixture
+    def redis_task_service(self):
+        """使用 fakeredis 的任务服务实例（Redis模式）"""
+        fakeredis = pytest.importorskip('fakeredis')
+        server = fakeredis.FakeServer()
+        with patch('redis.from_url', lambda *args, **kwargs: fakeredis.FakeRedis(server=server)):
+            service = TaskService()
+        assert not service.use_memory_storage
+        return service
+    
     @pytest.fixture
     def sample_task_data(self):
         """示例任务数据"""
@@ -44,6 +56,638 @@ class TestIntegration:
         assert task['task_id'] == sample_task_data['task_id']
         assert task['status'] == 'pending'
     
+    def test_list_tasks_indexes(self, redis_task_service):
+        """测试任务列表通过有序集合索引分页，不扫描全部键"""
+        service = redis_task_service
+        for i in range(12):
+            service.create_task({'task_id': f"task-{i:02d}", 'audio_file': 'a.mp3', 'text_file': 'a.json'})
+        for i in range(0, 12, 3):
+            service.update_task_status(f"task-{i:02d}", 'completed', 100)
+        
+        with patch.object(service.redis_client, 'keys', side_effect=AssertionError("KEYS must not be used")):
+            first = service.list_tasks(page=1, per_page=5)
+            assert first['total'] == 12
+            assert [task['task_id'] for task in first['items']] == [f"task-{i:02d}" for i in range(11, 6, -1)]
+            
+            # 翻页期间创建的新任务不影响游标分页
+            service.create_task({'task_id': 'task-new', 'audio_file': 'a.mp3', 'text_file': 'a.json'})
+            second = service.list_tasks(per_page=5, cursor=first['next_cursor'])
+            assert [task['task_id'] for task in second['items']] == [f"task-{i:02d}" for i in range(6, 1, -1)]
+            
+            completed = service.list_tasks(per_page=10, status='completed')
+            assert [task['task_id'] for task in completed['items']] == ['task-09', 'task-06', 'task-03', 'task-00']
+            assert completed['next_cursor'] is None
+            assert service.list_tasks(status='pending')['total'] == 9
+        
+        # 重建写入临时键后原子替换，多余的状态索引被删除
+        service.redis_client.zadd(TaskService.TASKS_BY_STATUS + 'bogus', {'task-00': 0})
+        assert service.rebuild_task_index() == 13
+        assert service.list_tasks(status='completed')['total'] == 4
+        assert not service.redis_client.exists(TaskService.TASKS_BY_STATUS + 'bogus')
+        assert not list(service.redis_client.scan_iter(match='tasks:rebuild:*'))
+        
+        # 游标任务离开索引后按 (创建时间, 任务ID) 定位，创建时间相同的任务不被跳过
+        for task_id in ('task-01', 'task-02', 'task-04'):
+            service.redis_client.zadd(TaskService.TASKS_BY_STATUS + 'pending', {task_id: 1.0})
+        page = service.list_tasks(per_page=1, status='pending', cursor='1.0:task-04')
+        assert [task['task_id'] for task in page['items']] == ['task-02']
+        service.update_task_status('task-02', 'completed', 100)
+        page = service.list_tasks(per_page=1, status='pending', cursor='1.0:task-02')
+        assert [task['task_id'] for task in page['items']] == ['task-01']
+    
+    def test_task_records_roundtrip(self, redis_task_service, task_service):
+        """测试任务和结果以类型化记录存储，列表和嵌套字段在两种存储模式下保持原样"""
+        import numpy as np
+        result_data = {
+            'task_id': 'record-task',
+            'status': 'completed',
+            'translations': {'ja': 'こんにちは'},
+            'translation_segments': {'ja': {'1': 'こんにちは'}},
+            'audio_transcription': {'text': 'Hello', 'confidence': np.float32(0.5), 'segments': [{'id': 0}]},
+            'text_validation': {'similarity': 0.9, 'flagged_pages': []},
+            'packaged_file': 'out.gcp'
+        }
+        
+        task_service.use_memory_storage = True
+        for service in (redis_task_service, task_service):
+            service.create_task({
+                'task_id': 'record-task', 'audio_file': 'a.mp3', 'text_file': 'a.json',
+                'target_languages': ['zh-CN', 'ja']
+            })
+            service.update_task_status('record-task', 'processing', 40)
+            service.save_task_result('record-task', dict(result_data))
+            
+            task = service.get_task('record-task')
+            assert task['target_languages'] == ['zh-CN', 'ja']
+            assert task['status'] == 'processing' and task['progress'] == 40
+            
+            result = service.get_task_result('record-task')
+            assert result['translation_segments'] == {'ja': {'1': 'こんにちは'}}
+            assert result['audio_transcription']['confidence'] == 0.5
+            assert service.get_task_record('record-task').target_languages == ['zh-CN', 'ja']
+        
+        # Redis中每个任务是一个小哈希（状态 + 记录），结果是单个值
+        client = redis_task_service.redis_client
+        assert set(client.hkeys('task:record-task')) == {b'status', b'record'}
+        assert client.type('result:record-task') == b'string'
+        
+        # 旧版逐字段存储的任务和结果在读取或重建索引时转换为记录格式
+        client.hset('task:legacy-task', mapping={
+            'task_id': 'legacy-task', 'audio_file': 'a.mp3', 'text_file': 'a.json',
+            'target_languages': '["ja"]', 'status': 'completed', 'progress': '100',
+            'created_at': '2024-01-01T00:00:00', 'updated_at': '2024-01-01T00:00:00'
+        })
+        client.hset('result:legacy-task', mapping={'task_id': 'legacy-task', 'status': 'completed',
+                                                   'packaged_file': 'out.gcp', 'translations': '{"ja": "こんにちは"}'})
+        assert redis_task_service.rebuild_task_index() == 2
+        assert redis_task_service.list_tasks(status='completed')['items'][0]['task_id'] == 'legacy-task'
+        task = redis_task_service.get_task('legacy-task')
+        assert task['target_languages'] == ['ja'] and task['progress'] == 100
+        assert set(client.hkeys('task:legacy-task')) == {b'status', b'record'}
+        assert redis_task_service.get_task_result('legacy-task')['translations'] == {'ja': 'こんにちは'}
+        assert client.type('result:legacy-task') == b'string'
+    
+    def test_task_queue_leases(self, redis_task_service):
+        """测试Worker崩溃后租约过期的任务被其他Worker回收，续约中的任务不被回收"""
+        from src.services.task_queue import RedisTaskQueue
+        service = redis_task_service
+        client = service.redis_client
+        for task_id in ('lease-a', 'lease-b'):
+            service.create_task({'task_id': task_id, 'audio_file': 'a.mp3', 'text_file': 'a.json'})
+        
+        crashed = RedisTaskQueue(client, worker_id='crashed', lease_seconds=30)
+        alive = RedisTaskQueue(client, worker_id='alive', lease_seconds=30)
+        assert crashed.pop(timeout=1) == 'lease-a'
+        service.update_task_status('lease-a', 'processing', 20)
+        assert alive.pop(timeout=1) == 'lease-b'
+        assert client.lrange('task_queue:processing:crashed', 0, -1) == [b'lease-a']
+        
+        # 两个租约都已到期，但 alive 在回收前续约
+        client.zadd('task_queue:leases', {'lease-a': 1, 'lease-b': 1})
+        alive.heartbeat('lease-b')
+        result = service.reclaim_stalled_tasks()
+        assert result == {'requeued': ['lease-a'], 'failed': []}
+        assert client.llen('task_queue:processing:crashed') == 0
+        assert service.get_task('lease-a')['status'] == 'pending'
+        assert client.zscore('task_queue:leases', 'lease-b') > 1
+        
+        # 确认后释放租约；重复崩溃超过最大尝试次数的任务被标记为失败
+        alive.ack('lease-b')
+        assert client.zscore('task_queue:leases', 'lease-b') is None
+        with patch.object(Config, 'TASK_MAX_ATTEMPTS', 2):
+            assert crashed.pop(timeout=1) == 'lease-a'
+            client.zadd('task_queue:leases', {'lease-a': 1})
+            result = service.reclaim_stalled_tasks()
+        assert result == {'requeued': [], 'failed': ['lease-a']}
+        assert service.get_task('lease-a')['status'] == 'failed'
+        assert service.queue.size() == 0
+    
+    def test_stream_task_queue(self, redis_task_service):
+        """测试 Streams 后端：批量读取、取消跳过、XAUTOCLAIM 接管崩溃Worker的任务"""
+        from src.services.task_queue import RedisStreamQueue
+        service = redis_task_service
+        client = service.redis_client
+        with patch.object(Config, 'TASK_QUEUE_BACKEND', 'stream'):
+            service._create_queues()
+        assert isinstance(service.queue, RedisStreamQueue)
+        assert service.queues['translate'].stream_key == 'task_stream:translate'
+        for task_id in ('stream-a', 'stream-b', 'stream-c'):
+            service.create_task({'task_id': task_id, 'audio_file': 'a.mp3', 'text_file': 'a.json'})
+        service.cancel_task('stream-b')
+        
+        crashed = RedisStreamQueue(client, worker_id='crashed', lease_seconds=0.05, batch_size=3)
+        assert crashed.pop(timeout=1) == 'stream-a'
+        assert crashed.pop(timeout=1) == 'stream-c'  # 同一批读取，已取消的任务被跳过并确认
+        assert service.queue.stats()['consumers'] == {'crashed': 2}
+        
+        crashed.ack('stream-c')
+        time.sleep(0.1)
+        survivor = RedisStreamQueue(client, worker_id='survivor', lease_seconds=0.05)
+        assert survivor.reap() == (['stream-a'], [])
+        assert survivor.pop(timeout=1) == 'stream-a'
+        survivor.ack('stream-a')
+        
+        stats = service.queue.stats()
+        assert stats['queued'] == 0 and stats['in_flight'] == 0
+        assert client.xlen('task_stream') == 0
+        
+        # 处理期间被取消的任务确认时清除标记，未到达阶段中的过期标记在下次取消时清理
+        service.create_task({'task_id': 'stream-d', 'audio_file': 'a.mp3', 'text_file': 'a.json'})
+        assert survivor.pop(timeout=1) == 'stream-d'
+        client.zadd('task_stream:translate:cancelled', {'stream-old': time.time() - Config.CHECKPOINT_TTL - 1})
+        service.cancel_task('stream-d')
+        survivor.ack('stream-d')
+        assert client.zcard('task_stream:cancelled') == 0
+        assert set(client.zrange('task_stream:translate:cancelled', 0, -1)) == {b'stream-b', b'stream-d'}
+        
+        # 处理中发现任务已取消时，清除取消时写入各阶段流的标记
+        service.whisper_service = service.translation_service = service.packaging_service = MagicMock()
+        assert not service.process_task('stream-d')
+        for key in ('task_stream:cancelled', 'task_stream:translate:cancelled', 'task_stream:package:cancelled'):
+            assert client.zscore(key, 'stream-d') is None
+        
+        # 已删除的条目（Redis 6.2 的 XAUTOCLAIM 返回空字段）被跳过并确认
+        reaped = RedisStreamQueue(client, worker_id='reaper', lease_seconds=0.05, name='reap_stream')
+        reaped.push('stream-e')
+        reaped.push('stream-f')
+        assert reaped.pop(timeout=1) == 'stream-e'
+        assert reaped.pop(timeout=1) == 'stream-f'
+        entry_id = reaped._entries['stream-e']
+        xautoclaim = client.xautoclaim
+        def legacy_xautoclaim(*args, **kwargs):
+            response = xautoclaim(*args, **kwargs)
+            return [response[0], [(eid, None if eid == entry_id else fields) for eid, fields in response[1]]]
+        time.sleep(0.1)
+        with patch.object(client, 'xautoclaim', side_effect=legacy_xautoclaim):
+            assert reaped.reap() == (['stream-f'], [])
+        assert [item['message_id'] for item in client.xpending_range('reap_stream', reaped.GROUP, '-', '+', 10)] == [reaped._entries['stream-f']]
+    
+    @pytest.mark.skipif(not hasattr(os, 'fork'), reason="prefork requires os.fork")
+    def test_worker_supervisor(self, monkeypatch):
+        """测试预fork监督进程：重启崩溃的子进程，停止时等待子进程处理完当前任务后退出"""
+        import gc
+        import signal
+        import threading
+        import worker
+        monkeypatch.setattr(worker, 'preload_models', lambda: [])
+        monkeypatch.setattr(Config, 'WORKER_REPORT_INTERVAL', 3600)
+        
+        def run_child(self, slot):
+            self.counts[slot * 2] += 1
+            if slot == 0:
+                raise RuntimeError("worker crashed")
+            # 继承的信号处理器在收到SIGTERM后把 running 置为 False
+            while self.running:
+                time.sleep(0.05)
+            self.counts[slot * 2 + 1] += 1
+        
+        monkeypatch.setattr(worker.WorkerSupervisor, '_run_child', run_child)
+        handlers = (signal.getsignal(signal.SIGINT), signal.getsignal(signal.SIGTERM))
+        supervisor = worker.WorkerSupervisor(processes=2)
+        threading.Timer(2.5, lambda: setattr(supervisor, 'running', False)).start()
+        try:
+            supervisor.run()
+        finally:
+            signal.signal(signal.SIGINT, handlers[0])
+            signal.signal(signal.SIGTERM, handlers[1])
+            gc.unfreeze()
+        
+        stats = supervisor.stats()
+        assert supervisor.restarts >= 1 and stats[0]['processed'] >= 2
+        assert stats[1] == {'slot': 1, 'processed': 1, 'failed': 1}  # 没有被重启，收到SIGTERM后正常退出
+        assert supervisor.children == {}
+    
+    def test_pipeline_stage_handoff(self, redis_task_service):
+        """测试各阶段由不同Worker处理，阶段输出经Redis交接"""
+        service = redis_task_service
+        service.whisper_service = MagicMock()
+        service.whisper_service.transcribe_audio.return_value = {
+            'text': 'Hello world', 'language': 'en', 'segments': [], 'confidence': 0.9
+        }
+        service.translation_service = MagicMock()
+        service.translation_service.translate_languages.return_value = {'ja': {'main': 'こんにちは世界'}}
+        service.packaging_service = MagicMock()
+        service.packaging_service.create_package.return_value = 'out.gcp'
+        service.create_task({
+            'task_id': 'stage-task', 'audio_file': 'a.mp3', 'text_file': 'missing.json',
+            'target_languages': ['ja']
+        })
+        
+        # 每个阶段的Worker只处理自己的阶段，然后交给下一阶段的队列
+        for stage, next_stage in (('stt', 'translate'), ('translate', 'package')):
+            assert service.queues[stage].pop(timeout=0) == 'stage-task'
+            assert service.process_task('stage-task', stage, (stage,))
+            service.queues[stage].ack('stage-task')
+            assert service.queues[next_stage].size() == 1
+            assert service.get_task('stage-task')['status'] == 'processing'
+        
+        assert service.queues['package'].pop(timeout=0) == 'stage-task'
+        assert service.process_task('stage-task', 'package', ('package',))
+        service.whisper_service.transcribe_audio.assert_called_once()
+        
+        result = service.get_task_result('stage-task')
+        assert result['translations'] == {'ja': 'こんにちは世界'}
+        assert result['audio_transcription']['confidence'] == pytest.approx(0.9)
+        assert service.get_task('stage-task')['status'] == 'completed'
+        assert service.redis_client.keys('checkpoint:*') == []
+    
+    def test_stage_checkpoints_resume(self, task_service, tmp_path):
+        """测试重试时复用语音识别和已完成语言的检查点，只重新翻译失败的语言"""
+        audio_file = tmp_path / 'audio.mp3'
+        audio_file.write_bytes(b'audio')
+        task_service.use_memory_storage = True
+        task_service.whisper_service = MagicMock()
+        task_service.whisper_service.transcribe_audio.return_value = {
+            'text': 'Hello world', 'language': 'en', 'segments': [], 'confidence': 0.9
+        }
+        task_service.translation_service = MagicMock()
+        task_service.translation_service.translate_languages.side_effect = [
+            {'ja': {'main': 'こんにちは世界'}},          # zh-CN 翻译超时
+            {'zh-CN': {'main': '你好世界'}}
+        ]
+        task_service.packaging_service = MagicMock()
+        task_service.packaging_service.create_package.side_effect = [RuntimeError("disk full"), 'out.gcp']
+        task_service.create_task({
+            'task_id': 'resume-task', 'audio_file': str(audio_file), 'text_file': 'missing.json',
+            'target_languages': ['zh-CN', 'ja']
+        })
+        
+        assert not task_service.process_task('resume-task')
+        assert task_service.get_task('resume-task')['status'] == 'failed'
+        assert not task_service.retry_task('missing-task')
+        assert task_service.retry_task('resume-task')
+        assert task_service.queue.pop(timeout=0) == 'resume-task'
+        
+        assert task_service.process_task('resume-task')
+        task_service.whisper_service.transcribe_audio.assert_called_once()
+        retried = task_service.translation_service.translate_languages.call_args_list[1]
+        assert retried.args[1] == ['zh-CN']
+        result = task_service.get_task_result('resume-task')
+        assert list(result['translations']) == ['zh-CN', 'ja']
+        assert task_service.checkpoints.names('resume-task') == []
+        
+        # 音频内容变化后语音识别检查点失效
+        task_service.checkpoints.save('resume-task', 'stt', 'stale', {'text': 'old'})
+        audio_file.write_bytes(b'new audio')
+        task_service._run_stt_stage(task_service.get_task_record('resume-task'))
+        assert task_service.whisper_service.transcribe_audio.call_count == 2
+    
+    def test_task_cancellation(self, task_service, monkeypatch, tmp_path):
+        """测试取消后处理在阶段之间和翻译请求之间停止、转录进程被终止，且不覆盖取消状态"""
+        import threading
+        import numpy as np
+        from src.services import whisper_service
+        from src.services.audio_chunking import SAMPLE_RATE
+        from src.services.translation_service import run_concurrently
+        from src.utils.cancellation import CancellationToken, TaskCancelled, DeadlineExceeded
+        
+        # 语音识别期间被取消：不再翻译和打包，最终状态仍为 cancelled
+        task_service.use_memory_storage = True
+        def transcribe(*args):
+            task_service.cancel_task('cancel-task')
+            return {'text': 'Hello', 'language': 'en', 'segments': [], 'confidence': 0.9}
+        task_service.whisper_service = MagicMock()
+        task_service.whisper_service.transcribe_audio.side_effect = transcribe
+        task_service.translation_service = MagicMock()
+        task_service.packaging_service = MagicMock()
+        task_service.create_task({'task_id': 'cancel-task', 'audio_file': 'a.mp3', 'text_file': 'a.json'})
+        
+        assert not task_service.process_task('cancel-task')
+        task_service.translation_service.translate_languages.assert_not_called()
+        task_service.update_task_status('cancel-task', 'completed', 100)
+        assert task_service.get_task('cancel-task')['status'] == 'cancelled'
+        assert task_service.checkpoints.names('cancel-task') == ['stt']
+        
+        # 取消后尚未开始的翻译请求被撤销
+        token = CancellationToken()
+        calls = []
+        lock = threading.Lock()
+        def request(index):
+            with lock:
+                calls.append(index)
+            token.cancel()
+            time.sleep(0.05)
+        with pytest.raises(TaskCancelled):
+            run_concurrently(request, [(i,) for i in range(50)], token)
+        assert len(calls) < 50
+        
+        # 转录在进程池子进程中进行
+        class FakeModel:
+            def transcribe(self, audio, language=None):
+                text = 'file' if isinstance(audio, str) else 'chunk'
+                return {'text': text, 'language': 'en', 'segments': []}
+        token = CancellationToken()
+        monkeypatch.setattr(whisper_service, '_models', {('base', 'cpu'): FakeModel()})
+        monkeypatch.setattr(whisper_service.whisper, 'load_audio', lambda path: np.zeros(20 * SAMPLE_RATE, np.float32))
+        monkeypatch.setattr(WhisperService, '_detect_audio_language', lambda self, model, data: 'en')
+        monkeypatch.setattr(Config, 'WHISPER_MAX_WORKERS', 1)
+        monkeypatch.setattr(Config, 'WHISPER_CHUNK_SECONDS', 5)
+        monkeypatch.setattr(Config, 'WHISPER_CHUNK_MIN_SECONDS', 10)
+        audio_file = tmp_path / 'book.mp3'
+        audio_file.write_bytes(b'audio')
+        service = WhisperService()
+        service.model_name, service.device = 'base', 'cpu'
+        
+        # 默认整段转录（传入取消令牌时在进程池子进程中转录，不分块）
+        assert service.transcribe_audio(str(audio_file), cancel_token=token)['text'] == 'file'
+        
+        # 终止进程池时按子进程上报的PID结束正在转录的进程
+        monkeypatch.setattr(Config, 'WHISPER_MAX_WORKERS', 2)
+        pool = whisper_service._get_pool()
+        pool.submit(os.getpid).result()  # 等待子进程启动
+        future = pool.submit(time.sleep, 30)
+        time.sleep(0.2)
+        whisper_service.abort_pool()
+        assert whisper_service._pool is None
+        from concurrent.futures.process import BrokenProcessPool
+        with pytest.raises(BrokenProcessPool):
+            future.result(timeout=5)  # 子进程被结束，不会等满30秒
+        
+        # 整段转录无法在当前进程中打断：超过阶段时限或被取消时终止子进程，不等转录结束
+        class SlowModel:
+            def transcribe(self, audio, **options):
+                time.sleep(30)
+                return {'text': 'late'}
+        monkeypatch.setattr(Config, 'WHISPER_MAX_WORKERS', 1)
+        monkeypatch.setattr(whisper_service, '_models', {('base', 'cpu'): SlowModel()})
+        token = CancellationToken()
+        token.deadline = time.monotonic() + 0.5
+        start = time.time()
+        with pytest.raises(DeadlineExceeded):
+            service.transcribe_audio(str(audio_file), cancel_token=token)
+        token = CancellationToken()
+        threading.Timer(0.5, token.cancel).start()
+        with pytest.raises(TaskCancelled):
+            service.transcribe_audio(str(audio_file), cancel_token=token)
+        assert time.time() - start < 10
+        assert whisper_service._pool is None
+    
+    def test_stage_deadlines(self, task_service, monkeypatch):
+        """测试阶段超时后保留检查点重新入队，LLM请求超时不超过剩余时限"""
+        import openai
+        from src.utils.cancellation import CancellationToken, DeadlineExceeded
+        monkeypatch.setattr(Config, 'TASK_TIMEOUT', 1)
+        monkeypatch.setattr(Config, 'STAGE_BUDGETS', {'stt': 0.2, 'translate': 0.2, 'package': 0.6})
+        
+        def slow_transcribe(*args):
+            time.sleep(0.5)
+            return {'text': 'Hello', 'language': 'en', 'segments': [], 'confidence': 0.9}
+        task_service.use_memory_storage = True
+        task_service.whisper_service = MagicMock()
+        task_service.whisper_service.transcribe_audio.side_effect = slow_transcribe
+        task_service.translation_service = MagicMock()
+        task_service.translation_service.translate_languages.return_value = {'ja': {'main': 'こんにちは'}}
+        task_service.packaging_service = MagicMock()
+        task_service.packaging_service.create_package.return_value = 'out.gcp'
+        task_service.create_task({
+            'task_id': 'deadline-task', 'audio_file': 'a.mp3', 'text_file': 'a.json', 'target_languages': ['ja']
+        })
+        
+        # 语音识别用掉了前两个阶段的全部时限：重新放入翻译阶段的队列，识别结果保留
+        assert not task_service.process_task('deadline-task')
+        task = task_service.get_task('deadline-task')
+        assert task['status'] == 'pending' and task['error'] == 'Deadline exceeded at stage translate'
+        assert task_service.queues['translate'].pop(timeout=0) == 'deadline-task'
+        assert task_service.get_task('deadline-task')['deadline_retries'] == 1
+        assert task_service.process_task('deadline-task', 'translate')
+        task_service.whisper_service.transcribe_audio.assert_called_once()
+        task = task_service.get_task('deadline-task')
+        assert task['status'] == 'completed' and task['deadline_retries'] == 0
+        
+        # 超过最大尝试次数后标记失败
+        monkeypatch.setattr(Config, 'TASK_MAX_ATTEMPTS', 1)
+        task_service.create_task({'task_id': 'deadline-fail', 'audio_file': 'a.mp3', 'text_file': 'a.json'})
+        assert not task_service.process_task('deadline-fail')
+        assert task_service.get_task('deadline-fail')['status'] == 'failed'
+        task_service.update_task_status('deadline-fail', 'failed', extra={'deadline_retries': 1})
+        assert task_service.retry_task('deadline-fail')
+        assert task_service.get_task('deadline-fail')['deadline_retries'] == 0
+        
+        # 每个LLM请求的超时不超过阶段剩余时限，时限已过时不再发出请求
+        translation_service = TranslationService()
+        translation_service.api_key = 'test-key'
+        translation_service.memory = None
+        create = MagicMock()
+        create.return_value.choices = [MagicMock(message=MagicMock(content='こんにちは'))]
+        monkeypatch.setattr(openai.ChatCompletion, 'create', create)
+        token = CancellationToken()
+        token.deadline = time.monotonic() + 5
+        assert translation_service.translate_languages({'1': 'Hello'}, ['ja'], cancel_token=token) == {
+            'ja': {'1': 'こんにちは'}
+        }
+        assert 0 < create.call_args.kwargs['request_timeout'] <= 5
+        token.deadline = time.monotonic() - 1
+        create.reset_mock()
+        with pytest.raises(DeadlineExceeded):
+            translation_service.translate_languages({'1': 'Hello', '2': 'Bye'}, ['ja'], cancel_token=token)
+        create.assert_not_called()
+        
+        # 时限在请求进行中到达：请求超时按阶段超时抛出，不当作翻译失败
+        def timed_out(**kwargs):
+            time.sleep(kwargs['request_timeout'])
+            raise openai.error.Timeout("Request timed out")
+        create.side_effect = timed_out
+        limiter = translation_service.rate_limiter
+        limit = limiter.concurrency.limit
+        for retries in (0, 2):
+            monkeypatch.setattr(Config, 'LLM_MAX_RETRIES', retries)
+            token.deadline = time.monotonic() + 0.2
+            with pytest.raises(DeadlineExceeded):
+                translation_service.translate_languages({'1': 'Hello'}, ['ja'], cancel_token=token)
+            with pytest.raises(DeadlineExceeded):
+                translation_service.translate_languages({'1': 'Hello', '2': 'Bye'}, ['ja'], cancel_token=token)
+        # 被时限截短的超时不是过载：并发上限不减半，也不暂停令牌发放
+        assert limiter.concurrency.limit == limit
+        assert limiter.bucket is None or limiter.bucket.try_acquire(1) == 0
+    
+    def test_llm_rate_limiter(self, monkeypatch):
+        """测试共享令牌桶的RPM/TPM配额、按实际用量修正，以及429时并发减半、成功时恢复"""
+        import openai
+        fakeredis = pytest.importorskip('fakeredis')
+        from src.services.rate_limiter import LLMRateLimiter, RedisTokenBucket, AdaptiveConcurrency
+        from src.utils.cancellation import DeadlineExceeded
+        
+        # 两个Worker共享同一个桶：每分钟6个请求、600个token
+        client = fakeredis.FakeRedis()
+        first, second = RedisTokenBucket(client, 6, 600), RedisTokenBucket(client, 6, 600)
+        assert first.try_acquire(500) == 0
+        assert second.try_acquire(200) > 0  # token不足，需等待约10秒
+        first.adjust(500 - 50)  # 实际只用了50个token
+        assert second.try_acquire(200) == 0
+        for _ in range(4):
+            assert first.try_acquire(1) == 0
+        assert second.try_acquire(1) > 0  # 请求数用完
+        
+        # 429让所有Worker暂停发放，等待超过时限时按超时处理
+        monkeypatch.setattr(Config, 'LLM_RPM', 600)
+        monkeypatch.setattr(Config, 'LLM_TPM', 100000)
+        monkeypatch.setattr(Config, 'TRANSLATION_MAX_CONCURRENCY', 8)
+        monkeypatch.setattr(Config, 'LLM_INITIAL_CONCURRENCY', 8)
+        monkeypatch.setattr(Config, 'LLM_MAX_RETRIES', 0)
+        limiter = LLMRateLimiter(fakeredis.FakeRedis())
+        translation_service = TranslationService()
+        translation_service.api_key = 'test-key'
+        translation_service.memory = None
+        translation_service.rate_limiter = limiter
+        create = MagicMock(side_effect=openai.error.RateLimitError('slow down', headers={'retry-after': '30'}))
+        monkeypatch.setattr(openai.ChatCompletion, 'create', create)
+        with pytest.raises(openai.error.RateLimitError):
+            translation_service._chat_completion('system', 'Hello', 100, 0.3)
+        assert int(limiter.concurrency.limit) == 4
+        with pytest.raises(DeadlineExceeded):
+            with limiter.request(10, deadline=time.monotonic() + 1):
+                pass
+        create.assert_called_once()
+        
+        # 从起始值开始，成功时加性增加并超过起始值，直到上限
+        monkeypatch.setattr(Config, 'LLM_INITIAL_CONCURRENCY', 4)
+        assert LLMRateLimiter().concurrency.limit == 4
+        concurrency = AdaptiveConcurrency(4, maximum=8)
+        concurrency.on_overload()
+        assert concurrency.limit == 2
+        for _ in range(100):
+            concurrency.on_success()
+        assert concurrency.limit == 8
+        assert concurrency.acquire(0) and concurrency.in_flight == 1
+    
+    def test_llm_retry_hedge_and_breaker(self, task_service, monkeypatch):
+        """测试LLM请求重试、对冲和熔断，以及翻译失败的语言记录在任务结果中"""
+        import threading
+        import openai
+        from src.services.rate_limiter import LLMRateLimiter
+        from src.utils.resilience import CircuitOpenError
+        monkeypatch.setattr(Config, 'LLM_RETRY_BASE_DELAY', 0.01)
+        monkeypatch.setattr(Config, 'LLM_BREAKER_THRESHOLD', 2)
+        monkeypatch.setattr(Config, 'LLM_COOLDOWN_SECONDS', 0.01)
+        translation_service = TranslationService()
+        translation_service.rate_limiter = LLMRateLimiter()
+        
+        def reply(content):
+            response = MagicMock()
+            response.choices = [MagicMock(message=MagicMock(content=content))]
+            return response
+        
+        # 超时后退避重试
+        create = MagicMock(side_effect=[openai.error.Timeout('timed out'), reply('你好')])
+        monkeypatch.setattr(openai.ChatCompletion, 'create', create)
+        assert translation_service._chat_completion('system', 'Hello', 100, 0.3) == '你好'
+        assert create.call_count == 2
+        
+        # 超时让并发减半后不对冲，慢请求的结果直接使用
+        monkeypatch.setattr(Config, 'LLM_HEDGE_ENABLED', True)
+        monkeypatch.setattr(Config, 'LLM_HEDGE_MIN_SAMPLES', 1)
+        assert not translation_service.rate_limiter.has_headroom()
+        create = MagicMock(side_effect=lambda **kwargs: time.sleep(0.2) or reply('slow'))
+        monkeypatch.setattr(openai.ChatCompletion, 'create', create)
+        assert translation_service._chat_completion('system', 'Hello', 100, 0.3) == 'slow'
+        assert create.call_count == 1
+        
+        # 请求慢于近期p95时发出对冲请求，先返回的结果生效
+        translation_service.rate_limiter = LLMRateLimiter()
+        release = threading.Event()
+        def slow_then_fast(**kwargs):
+            if create.call_count == 1:
+                release.wait(5)
+                return reply('slow')
+            return reply('fast')
+        create = MagicMock(side_effect=slow_then_fast)
+        monkeypatch.setattr(openai.ChatCompletion, 'create', create)
+        assert translation_service._chat_completion('system', 'Hello', 100, 0.3) == 'fast'
+        assert create.call_count == 2
+        release.set()
+        
+        # 连续失败后熔断，不再发出请求
+        monkeypatch.setattr(Config, 'LLM_HEDGE_ENABLED', False)
+        monkeypatch.setattr(Config, 'LLM_MAX_RETRIES', 1)
+        create = MagicMock(side_effect=openai.error.ServiceUnavailableError('down'))
+        monkeypatch.setattr(openai.ChatCompletion, 'create', create)
+        with pytest.raises(openai.error.ServiceUnavailableError):
+            translation_service._chat_completion('system', 'Hello', 100, 0.3)
+        with pytest.raises(CircuitOpenError):
+            translation_service._chat_completion('system', 'Hello', 100, 0.3)
+        assert create.call_count == 2 and translation_service.breaker.state == 'open'
+        
+        # 部分语言失败时任务完成并记录失败的语言，全部失败时任务失败
+        task_service.use_memory_storage = True
+        task_service.whisper_service = MagicMock()
+        task_service.whisper_service.transcribe_audio.return_value = {
+            'text': 'Hello', 'language': 'en', 'segments': [], 'confidence': 0.9
+        }
+        task_service.translation_service = MagicMock()
+        task_service.translation_service.translate_languages.return_value = {'zh-CN': {'main': '你好'}, 'ja': {}}
+        task_service.packaging_service = MagicMock()
+        task_service.packaging_service.create_package.return_value = 'out.gcp'
+        for task_id in ('partial-task', 'failed-task'):
+            task_service.create_task({
+                'task_id': task_id, 'audio_file': 'a.mp3', 'text_file': 'a.json', 'target_languages': ['zh-CN', 'ja']
+            })
+        assert task_service.process_task('partial-task')
+        assert task_service.get_task('partial-task')['failed_languages'] == {'ja': ['main']}
+        result = task_service.get_task_result('partial-task')
+        assert result['translations'] == {'zh-CN': '你好'} and result['failed_languages'] == {'ja': ['main']}
+        
+        task_service.translation_service.translate_languages.return_value = {'zh-CN': {}, 'ja': {}}
+        assert not task_service.process_task('failed-task')
+        task = task_service.get_task('failed-task')
+        assert task['status'] == 'failed' and task['error'] == 'Translation failed: zh-CN, ja'
+    
+    def test_task_status_counters(self, redis_task_service):
+        """测试状态计数随状态变更增量维护，监控直接读取计数"""
+        import monitor
+        service = redis_task_service
+        for i in range(3):
+            service.create_task({'task_id': f"count-{i}", 'audio_file': 'a.mp3', 'text_file': 'a.json'})
+        service.update_task_status('count-0', 'processing', 10)
+        service.update_task_status('count-0', 'processing', 50)
+        service.update_task_status('count-0', 'completed', 100)
+        service.update_task_status('count-1', 'processing', 10)
+        service.update_task_status('count-1', 'failed', error='boom')
+        service.update_task_status('count-1', None, extra={'deadline_retries': 0})  # 只更新扩展字段，状态不变
+        assert service.get_task('count-1')['status'] == 'failed'
+        
+        counts = service.get_status_counts()
+        assert counts['status_counts'] == {'pending': 1, 'processing': 0, 'completed': 1, 'failed': 1}
+        assert counts['transitions'] == {
+            'new->pending': 3, 'pending->processing': 2, 'processing->completed': 1, 'processing->failed': 1
+        }
+        
+        monitor_service = monitor.MonitorService.__new__(monitor.MonitorService)
+        monitor_service.redis_client = service.redis_client
+        with patch.object(service.redis_client, 'keys', side_effect=AssertionError("KEYS must not be used")):
+            monitor_service.collect_task_metrics()
+        assert monitor.TASK_STATUS.labels(status='pending')._value.get() == 1
+        from prometheus_client import REGISTRY
+        assert REGISTRY.get_sample_value(
+            'giggle_task_transitions_total', {'from_status': 'pending', 'to_status': 'processing'}
+        ) == 2
+        
+        # 计数漂移后重建：状态计数按实际任务替换，转换计数保留
+        service.redis_client.hset(TaskService.STATUS_COUNTS, mapping={'pending': 7, 'processing': 3})
+        service.rebuild_task_index()
+        counts = service.get_status_counts()
+        assert counts['status_counts'] == {'pending': 1, 'completed': 1, 'failed': 1}
+        assert counts['transitions']['pending->processing'] == 2
+    
     @patch('src.services.whisper_service.whisper.load_model')
     def test_whisper_service(self, mock_load_model):
         """测试Whisper服务"""
@@ -63,6 +707,82 @@ class TestIntegration:
         # 由于文件不存在，应该返回False
         assert is_valid == False
     
+    @patch('src.services.whisper_service.whisper.load_model')
+    def test_whisper_model_registry(self, mock_load_model, monkeypatch, tmp_path):
+        """测试模型在进程内只加载一次，并可按任务选择不同模型"""
+        from src.services import whisper_service
+        monkeypatch.setattr(whisper_service, '_models', {})
+        mock_load_model.side_effect = lambda name, device=None: MagicMock(name=name)
+        
+        assert whisper_service.preload_models(['base']) == ['base']
+        assert mock_load_model.call_count == 1
+        
+        audio_file = tmp_path / 'sample.mp3'
+        audio_file.write_bytes(b'audio')
+        
+        # 新实例复用已预加载的模型
+        service = WhisperService()
+        service.transcribe_audio(str(audio_file), 'base')
+        service.transcribe_audio(str(audio_file), 'small')
+        WhisperService().transcribe_audio(str(audio_file), 'small')
+        
+        assert mock_load_model.call_count == 2
+        assert sorted(whisper_service.loaded_models()) == ['base', 'small']
+    
+    def test_chunked_transcription(self, monkeypatch, tmp_path):
+        """测试长音频在静音处分块、并行转录并按正确时间戳拼接"""
+        import numpy as np
+        from src.services import whisper_service
+        from src.services.audio_chunking import SAMPLE_RATE, plan_chunks
+        
+        # 10秒音频：第k秒的 [k+0.1, k+0.9) 为振幅 (k+1)/20 的声音，其余为静音
+        audio = np.zeros(10 * SAMPLE_RATE, dtype=np.float32)
+        for k in range(10):
+            audio[int((k + 0.1) * SAMPLE_RATE):int((k + 0.9) * SAMPLE_RATE)] = (k + 1) / 20
+        
+        chunks = plan_chunks(audio, chunk_seconds=3, overlap_seconds=0.5, search_seconds=0.5)
+        assert len(chunks) == 4
+        for chunk in chunks[1:]:
+            # 切分点落在静音区
+            assert audio[chunk['core_start']] == 0
+        
+        class FakeModel:
+            """按声音片段输出分段，文本为片段编号"""
+            def transcribe(self, chunk_audio, language=None):
+                voiced = np.flatnonzero(np.diff(np.concatenate(([0], (chunk_audio > 0).astype(int), [0]))))
+                segments = [
+                    {'start': start / SAMPLE_RATE, 'end': end / SAMPLE_RATE, 'avg_logprob': -0.2,
+                     'text': f" b{int(round(chunk_audio[start] * 20)) - 1}"}
+                    for start, end in zip(voiced[::2], voiced[1::2])
+                ]
+                return {'text': '', 'language': language, 'segments': segments}
+        
+        monkeypatch.setattr(whisper_service, '_models', {('base', 'cpu'): FakeModel()})
+        monkeypatch.setattr(whisper_service.whisper, 'load_audio', lambda path: audio)
+        monkeypatch.setattr(WhisperService, '_detect_audio_language', lambda self, model, data: 'en')
+        monkeypatch.setattr(Config, 'WHISPER_MAX_WORKERS', 2)
+        monkeypatch.setattr(Config, 'WHISPER_CHUNK_SECONDS', 3)
+        monkeypatch.setattr(Config, 'WHISPER_CHUNK_OVERLAP', 0.5)
+        monkeypatch.setattr(Config, 'WHISPER_CHUNK_MIN_SECONDS', 5)
+        
+        audio_file = tmp_path / 'book.mp3'
+        audio_file.write_bytes(b'audio')
+        service = WhisperService()
+        service.model_name, service.device = 'base', 'cpu'
+        
+        try:
+            result = service.transcribe_audio(str(audio_file))
+        finally:
+            whisper_service.shutdown_pool()
+        
+        assert result['text'] == ' '.join(f"b{k}" for k in range(10))
+        assert result['language'] == 'en'
+        assert [segment['id'] for segment in result['segments']] == list(range(10))
+        for k, segment in enumerate(result['segments']):
+            assert abs(segment['start'] - (k + 0.1)) < 0.01
+            assert abs(segment['end'] - (k + 0.9)) < 0.01
+        assert result['confidence'] == pytest.approx(0.4)
+    
     @patch('openai.ChatCompletion.create')
     def test_translation_service(self, mock_openai):
         """测试翻译服务"""
@@ -118,6 +838,351 @@ class TestIntegration:
         if os.path.exists(package_path):
             os.remove(package_path)
     
+    def test_package_format_compatibility(self):
+        """测试v2格式读写及v1格式兼容"""
+        packaging_service = PackagingService()
+        translations = {"zh-CN": "你好世界", "ja": "こんにちは世界"}
+        audio_transcription = {"text": "Hello world", "confidence": 0.95, "language": "en"}
+        
+        paths = []
+        try:
+            with patch.object(Config, 'PACKAGE_FORMAT', 'v1'):
+                paths.append(packaging_service.create_package(
+                    "test-format-v1", "Hello world", translations, audio_transcription
+                ))
+            paths.append(packaging_service.create_package(
+                "test-format-v2", "Hello world", translations, audio_transcription
+            ))
+            
+            v1_data, v2_data = [packaging_service.read_package(p) for p in paths]
+            assert v1_data['metadata']['format'] == 'giggle-compact-v1'
+            assert v2_data['metadata']['format'] == 'giggle-compact-v2'
+            assert v1_data['content'] == v2_data['content']
+            
+            for path in paths:
+                assert packaging_service.query_package(path, "ja")['text'] == "こんにちは世界"
+                assert packaging_service.query_package(path, "audio")['confidence'] == 0.95
+        finally:
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+    
+    def test_package_lazy_reader(self):
+        """测试内存映射的延迟读取"""
+        packaging_service = PackagingService()
+        package_path = packaging_service.create_package(
+            "test-lazy-reader", "Hello world", {"zh-CN": "你好世界"},
+            {"text": "Hello world", "confidence": 0.9, "language": "en"}
+        )
+        
+        try:
+            with packaging_service.open_package(package_path) as package:
+                assert package.format == 'v2'
+                assert package.languages() == ['original', 'audio', 'zh-CN']
+                assert package.text("zh-CN") == "你好世界"
+                assert package.text("fr") is None
+                assert package.info()['available_languages'] == ["zh-CN"]
+                assert package.attributes("audio")['confidence'] == 0.9
+            
+            assert packaging_service.validate_package(package_path)
+            assert packaging_service.extract_texts(package_path)['zh-CN'] == "你好世界"
+        finally:
+            if os.path.exists(package_path):
+                os.remove(package_path)
+    
+    def test_package_reader_closes_on_invalid_table(self, monkeypatch, tmp_path):
+        """测试段表损坏时关闭映射和文件句柄"""
+        import mmap
+        from src.services import package_format, package_reader
+        opened = []
+        class TrackedMmap(mmap.mmap):
+            def __init__(self, *args, **kwargs):
+                opened.append(self)
+        real_open = open
+        def tracked_open(*args, **kwargs):
+            handle = real_open(*args, **kwargs)
+            opened.append(handle)
+            return handle
+        monkeypatch.setattr(package_reader.mmap, 'mmap', TrackedMmap)
+        monkeypatch.setattr(package_reader, 'open', tracked_open, raising=False)
+        
+        # 段表声明了3个段，但没有段表数据
+        path = tmp_path / 'broken.gcp'
+        path.write_bytes(package_format.V2_HEADER.pack(
+            package_format.V2_MAGIC, package_format.V2_VERSION, 0, 3, 0
+        ))
+        with pytest.raises(Exception):
+            package_reader.Package(str(path))
+        assert len(opened) == 2 and all(handle.closed for handle in opened)
+    
+    def test_package_cache(self):
+        """测试包缓存命中与失效"""
+        packaging_service = PackagingService()
+        translations = {"zh-CN": "你好世界"}
+        audio_transcription = {"text": "Hello world", "confidence": 0.9, "language": "en"}
+        package_path = packaging_service.create_package(
+            "test-cache", "Hello world", translations, audio_transcription
+        )
+        
+        try:
+            # 只读元数据不完整解码，也不写入缓存；完整读取后写入缓存
+            assert packaging_service.get_package_info(package_path)['task_id'] == "test-cache"
+            assert packaging_service.get_cache_stats()['entries'] == 0
+            assert packaging_service.extract_texts(package_path)['zh-CN'] == "你好世界"
+            assert packaging_service.get_package_info(package_path)['task_id'] == "test-cache"
+            stats = packaging_service.get_cache_stats()
+            assert stats['misses'] == 2
+            assert stats['hits'] == 1
+            
+            # 返回的是副本，修改不影响缓存
+            packaging_service.read_package(package_path)['content']['translations'].clear()
+            assert packaging_service.extract_texts(package_path)['zh-CN'] == "你好世界"
+            
+            # 文件内容变化后缓存失效
+            translations["zh-CN"] = "大家好，世界"
+            packaging_service.create_package("test-cache", "Hello world", translations, audio_transcription)
+            assert packaging_service.query_package(package_path, "zh-CN")['text'] == "大家好，世界"
+            assert packaging_service.get_cache_stats()['misses'] == 3
+        finally:
+            if os.path.exists(package_path):
+                os.remove(package_path)
+    
+    def test_lru_cache_eviction(self):
+        """测试LRU缓存按条目数和字节数淘汰"""
+        cache = LRUCache(max_entries=2, max_bytes=100)
+        cache.put('a', 1, 10)
+        cache.put('b', 2, 10)
+        cache.get('a')
+        cache.put('c', 3, 10)
+        assert cache.get('b') is None
+        assert cache.get('a') == 1
+        
+        cache.put('d', 4, 95)
+        assert cache.stats()['entries'] == 1
+        assert cache.stats()['evictions'] == 3
+    
+    def test_package_index(self, monkeypatch, tmp_path):
+        """测试打包文件索引查询"""
+        monkeypatch.setattr(Config, 'PACKAGE_INDEX_PATH', str(tmp_path / 'package_index.db'))
+        packaging_service = PackagingService()
+        
+        task_id = "test-index-task"
+        package_path = packaging_service.create_package(
+            task_id, "Hello world", {"ja": "こんにちは世界"},
+            {"text": "Hello world", "confidence": 0.9, "language": "en"}
+        )
+        
+        try:
+            results = packaging_service.query_index("ja", source="TEXT")
+            assert results[0]['task_id'] == task_id
+            assert results[0]['text'] == "こんにちは世界"
+            
+            audio = packaging_service.query_index("audio", limit=1)
+            assert audio[0]['confidence'] == 0.9
+            
+            # 重建索引后仍可查询
+            assert packaging_service.rebuild_index() >= 1
+            assert packaging_service.query_index("ja", limit=1)[0]['task_id'] == task_id
+            
+            # 索引文件丢失时，第一次查询前根据现有 .gcp 文件自动重建
+            monkeypatch.setattr(Config, 'PACKAGE_INDEX_PATH', str(tmp_path / 'lost_index.db'))
+            fresh_service = PackagingService()
+            assert fresh_service.index.package_count() == 0
+            assert fresh_service.ensure_index() >= 1
+            assert fresh_service.query_index("ja", limit=1)[0]['task_id'] == task_id
+        finally:
+            if os.path.exists(package_path):
+                os.remove(package_path)
+        
+        # 文件删除后索引条目自动失效
+        assert all(r['task_id'] != task_id for r in packaging_service.query_index("ja"))
+    
+    def test_segment_translation_pipeline(self, task_service):
+        """测试按页分段翻译并以页码写入包"""
+        def fake_completion(system_prompt, prompt, max_tokens, temperature):
+            batch = json.loads(prompt[prompt.index('{'):prompt.rindex('}') + 1])
+            return json.dumps({text_id: f"[ja] {text}" for text_id, text in batch.items()})
+        
+        translation_service = TranslationService()
+        translation_service.api_key = 'test-key'
+        translation_service.memory = None
+        translation_service._chat_completion = MagicMock(side_effect=fake_completion)
+        
+        task_service.use_memory_storage = True
+        task_service.whisper_service = MagicMock()
+        task_service.whisper_service.transcribe_audio.return_value = {
+            'text': 'Tilly, a little fox, loved her bright red balloon.',
+            'language': 'en',
+            'segments': [],
+            'confidence': 0.9
+        }
+        task_service.translation_service = translation_service
+        task_service.packaging_service = PackagingService()
+        
+        task_id = 'test-segment-task'
+        task_service.create_task({
+            'task_id': task_id,
+            'audio_file': 'tests/test_data/sample_audio.mp3',
+            'text_file': 'data/text/text.json',
+            'target_languages': ['ja']
+        })
+        
+        with open('data/text/text.json', 'r', encoding='utf-8') as f:
+            pages = json.load(f)
+        
+        try:
+            assert task_service.process_task(task_id)
+            # 7页分为两批请求
+            assert translation_service._chat_completion.call_count == 2
+            
+            result = task_service.get_task_result(task_id)
+            assert list(result['translation_segments']['ja']) == sorted(pages, key=int)
+            
+            package_path = result['packaged_file']
+            page = task_service.packaging_service.query_package(package_path, 'ja', '3')
+            assert page['text'] == f"[ja] {pages['3']}"
+            original = task_service.packaging_service.query_index('original', text_id='3', limit=1)
+            assert original[0]['text'] == pages['3']
+        finally:
+            result = task_service.get_task_result(task_id) or {}
+            if result.get('packaged_file') and os.path.exists(result['packaged_file']):
+                os.remove(result['packaged_file'])
+    
+    def test_concurrent_language_translation(self):
+        """测试多目标语言并发翻译且结果与完成顺序无关"""
+        delays = {'zh-CN': 0.3, 'zh-TW': 0.1, 'ja': 0.2}
+        
+        def slow_completion(system_prompt, prompt, max_tokens, temperature):
+            lang = next(code for code in delays if translation_service.get_language_name(code) in prompt)
+            time.sleep(delays[lang])
+            return f"{lang}:{prompt.split('原文：')[1].split('翻译：')[0].strip()}"
+        
+        translation_service = TranslationService()
+        translation_service.api_key = 'test-key'
+        translation_service.memory = None
+        translation_service._chat_completion = MagicMock(side_effect=slow_completion)
+        
+        start = time.time()
+        results = translation_service.translate_languages({'main': 'Hello'}, list(delays))
+        elapsed = time.time() - start
+        
+        assert list(results) == ['zh-CN', 'zh-TW', 'ja']
+        assert results['ja'] == {'main': 'ja:Hello'}
+        assert elapsed < sum(delays.values())
+        
+        batch = translation_service.translate_batch(['a', 'b', 'c'], 'zh-TW')
+        assert batch == ['zh-TW:a', 'zh-TW:b', 'zh-TW:c']
+    
+    def test_multi_language_translation(self, monkeypatch):
+        """测试一次请求翻译成多个目标语言，回复不完整或无法解析时逐语言补译"""
+        monkeypatch.setattr(Config, 'TRANSLATION_MULTI_LANGUAGE', True)
+        translation_service = TranslationService()
+        translation_service.api_key = 'test-key'
+        translation_service.memory = None
+        replies = {}
+        
+        def completion(system_prompt, prompt, max_tokens, temperature):
+            if '键为语言代码' in prompt:
+                return replies['multi']
+            lang = 'ja' if '日本語' in prompt else 'zh-CN'
+            if '翻译：' in prompt:
+                return f"{lang}:{prompt.split('原文：')[1].split('翻译：')[0].strip()}"
+            source = json.loads(prompt[prompt.index('{'):])
+            return json.dumps({text_id: f"{lang}:{text}" for text_id, text in source.items()})
+        translation_service._chat_completion = MagicMock(side_effect=completion)
+        segments = {'1': 'Hello', '2': 'Bye'}
+        
+        # 回复中 ja 缺少第2页：只补译这一段
+        replies['multi'] = '```json\n' + json.dumps({
+            'zh-CN': {'1': '你好', '2': '再见'}, 'ja': {'1': 'こんにちは'}
+        }, ensure_ascii=False) + '\n```'
+        results = translation_service.translate_languages(segments, ['zh-CN', 'ja'])
+        assert results == {'zh-CN': {'1': '你好', '2': '再见'}, 'ja': {'1': 'こんにちは', '2': 'ja:Bye'}}
+        assert translation_service._chat_completion.call_count == 2
+        
+        # 回复无法解析：每种语言各自按批次翻译
+        translation_service._chat_completion.reset_mock()
+        replies['multi'] = '{"zh-CN": {"1": "你好"'
+        results = translation_service.translate_languages(segments, ['zh-CN', 'ja'])
+        assert results['ja'] == {'1': 'ja:Hello', '2': 'ja:Bye'}
+        assert translation_service._chat_completion.call_count == 3
+    
+    @patch('redis.from_url', side_effect=Exception("Redis unavailable"))
+    def test_translation_memory(self, mock_redis, monkeypatch, tmp_path):
+        """测试翻译记忆命中时跳过API调用"""
+        monkeypatch.setattr(Config, 'TRANSLATION_MEMORY_PATH', str(tmp_path / 'tm.db'))
+        translation_service = TranslationService()
+        translation_service.api_key = 'test-key'
+        translation_service._chat_completion = MagicMock(return_value="谢谢你们，朋友们！")
+        
+        assert translation_service.translate_text("Thank you, friends!", "zh-CN") == "谢谢你们，朋友们！"
+        # 空白不同的相同句子命中记忆
+        assert translation_service.translate_text("Thank you,  friends! ", "zh-CN") == "谢谢你们，朋友们！"
+        assert translation_service._chat_completion.call_count == 1
+        
+        # 分段翻译同样使用记忆
+        results = translation_service.translate_languages({'1': "Thank you, friends!"}, ['zh-CN'])
+        assert results['zh-CN'] == {'1': "谢谢你们，朋友们！"}
+        assert translation_service._chat_completion.call_count == 1
+        
+        stats = translation_service.get_memory_stats()
+        assert stats['backend'] == 'local'
+        assert stats['hits'] == 2
+        assert stats['misses'] == 1
+    
+    @patch('redis.from_url', side_effect=Exception("Connection refused"))
+    def test_translation_memory_fuzzy(self, mock_redis, monkeypatch, tmp_path):
+        """测试模糊翻译记忆：相似原文作为参考，不跨模型复用，Redis桶随条目淘汰清理"""
+        monkeypatch.setattr(Config, 'TRANSLATION_MEMORY_PATH', str(tmp_path / 'tm.db'))
+        translation_service = TranslationService()
+        translation_service.api_key = 'test-key'
+        translation_service._chat_completion = MagicMock(return_value="爱丽丝打开了门，走进了花园。")
+        
+        translation_service.translate_text("Alice opened the door and walked into the garden.", "zh-CN")
+        
+        # 只换了人名的句子：上一次的译文出现在提示词中
+        translation_service._chat_completion.return_value = "鲍勃打开了门，走进了花园。"
+        translation = translation_service.translate_text("Bob opened the door and walked into the garden.", "zh-CN")
+        assert translation == "鲍勃打开了门，走进了花园。"
+        prompt = translation_service._chat_completion.call_args[0][1]
+        assert "参考译文" in prompt
+        assert "爱丽丝打开了门，走进了花园。" in prompt
+        
+        # 不相关的句子不带参考译文
+        translation_service.translate_text("The weather is nice today.", "zh-CN")
+        assert "参考译文" not in translation_service._chat_completion.call_args[0][1]
+        
+        # 换模型后既不复用也不参考旧模型的译文
+        translation_service.model = 'another-model'
+        translation_service._chat_completion.return_value = "卡罗尔打开了门，走进了花园。"
+        call_count = translation_service._chat_completion.call_count
+        translation_service.translate_text("Carol opened the door and walked into the garden.", "zh-CN")
+        assert translation_service._chat_completion.call_count == call_count + 1
+        assert "参考译文" not in translation_service._chat_completion.call_args[0][1]
+        
+        # Redis后端：超出容量淘汰的条目从桶中移除，过期条目在查询时先剔除再截取候选项
+        fakeredis = pytest.importorskip('fakeredis')
+        from src.services.translation_memory import TranslationMemory
+        client = fakeredis.FakeRedis()
+        monkeypatch.setattr(Config, 'TRANSLATION_MEMORY_MAX_ENTRIES', 2)
+        with patch('redis.from_url', return_value=client):
+            memory = TranslationMemory()
+        memory.MAX_FUZZY_CANDIDATES = 1
+        scope = TranslationMemory.fuzzy_scope('zh-CN', 'gpt', '2')
+        memory.add_fuzzy([("Alice opened the door and walked into the garden.", "爱丽丝打开了门，走进了花园。")], scope)
+        memory.add_fuzzy([("Alice opened the door and walked into the garden!", "爱丽丝打开了门，走进了花园！")], scope)
+        memory.add_fuzzy([("Alice opened the old door and walked into the garden?", "爱丽丝打开了旧门，走进了花园？")], scope)
+        assert client.zcard(TranslationMemory.FUZZY_LRU_KEY) == 2
+        first_id = memory._fuzzy_entry("Alice opened the door and walked into the garden.", scope)[0].encode()
+        assert not any(first_id in client.smembers(key) for key in client.keys(TranslationMemory.FUZZY_BUCKET_PREFIX + '*'))
+        
+        second_id = memory._fuzzy_entry("Alice opened the door and walked into the garden!", scope)[0]
+        client.delete(TranslationMemory.FUZZY_ENTRY_PREFIX + second_id)  # 模拟条目过期（它与查询原文共享全部桶，排在最前）
+        matches = memory.fuzzy_lookup_many({'1': "Alice opened the door and walked into the garden!"}, scope, 0.7)
+        assert matches['1']['translation'] == "爱丽丝打开了旧门，走进了花园？"
+        assert not any(second_id.encode() in client.smembers(key) for key in client.keys(TranslationMemory.FUZZY_BUCKET_PREFIX + '*'))
+        assert memory.fuzzy_lookup_many({'1': "Alice opened the door."}, TranslationMemory.fuzzy_scope('zh-CN', 'other', '2'), 0.5) == {}
+    
     def test_text_similarity_calculation(self, task_service):
         """测试文本相似度计算"""
         text1 = "Hello world"
@@ -144,6 +1209,86 @@ class TestIntegration:
         distance = task_service._levenshtein_distance("", "hello")
         assert distance == 5
     
+    def test_page_alignment_validation(self, task_service):
+        """测试识别分段逐页对齐，只标记识别错误的页"""
+        import random
+        rng = random.Random(3)
+        words = "the little fox ran to the river and met an old turtle who told him a story".split()
+        
+        pages = {}
+        segments = []
+        clock = 0.0
+        for page in range(1, 201):
+            text = ' '.join(rng.choice(words) for _ in range(rng.randint(8, 20))) + '.'
+            pages[str(page)] = text
+            
+            # 每页被切成1到3个分段，第50页识别完全错误
+            spoken = "completely different words were heard here instead" if page == 50 else text
+            tokens = spoken.split()
+            cuts = sorted(rng.sample(range(1, len(tokens)), rng.randint(0, 2)))
+            for start, end in zip([0] + cuts, cuts + [len(tokens)]):
+                duration = 0.3 * (end - start)
+                segments.append({
+                    'id': len(segments), 'start': clock, 'end': clock + duration,
+                    'text': ' ' + ' '.join(tokens[start:end])
+                })
+                clock += duration
+        
+        transcription = {
+            'text': ''.join(segment['text'] for segment in segments),
+            'segments': segments,
+            'confidence': 0.9
+        }
+        
+        start_time = time.time()
+        result = task_service._validate_text(transcription, None, pages)
+        assert time.time() - start_time < 5
+        
+        assert result['flagged_pages'] == ['50']
+        assert result['similarity'] > 0.95
+        page_results = result['pages']
+        assert all(page_results[page]['similarity'] == 1.0 for page in pages if page != '50')
+        
+        # 各页时间范围首尾相接且覆盖全部分段
+        assert page_results['1']['start'] == 0.0
+        assert page_results['200']['end'] == pytest.approx(clock)
+        for page in range(1, 200):
+            assert page_results[str(page)]['end'] == pytest.approx(page_results[str(page + 1)]['start'])
+    
+    def test_edit_distance_engine(self, monkeypatch):
+        """测试位并行与NumPy编辑距离与原动态规划实现结果一致"""
+        import random
+        from src.utils import edit_distance
+        from tests.benchmark_similarity import legacy_levenshtein, make_story
+        
+        rng = random.Random(7)
+        pairs = [
+            (''.join(rng.choice('abcd') for _ in range(rng.randint(0, 40))),
+             ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 40))))
+            for _ in range(300)
+        ]
+        pairs.append(make_story(600))
+        pairs.append(("你好世界，今天天气很好", "你好世界今天天汽很好"))
+        
+        for s1, s2 in pairs:
+            expected = legacy_levenshtein(s1, s2)
+            assert edit_distance.levenshtein_distance(s1, s2) == expected
+            if s1 and s2:
+                assert edit_distance._numpy_distance(s1, s2) == expected
+            # 超过阈值时返回 阈值+1
+            limit = expected - 1
+            if limit >= 0:
+                assert edit_distance.levenshtein_distance(s1, s2, limit) == limit + 1
+            assert edit_distance.levenshtein_distance(s1, s2, expected) == expected
+        
+        # 匹配表超限时使用NumPy实现
+        monkeypatch.setattr(edit_distance, 'BITVECTOR_MAX_BYTES', 0)
+        s1, s2 = make_story(300)
+        assert edit_distance.levenshtein_distance(s1, s2) == legacy_levenshtein(s1, s2)
+        
+        assert edit_distance.text_similarity("Hello World", "hello world") == 1.0
+        assert edit_distance.text_similarity("Hello world", "Goodbye world", min_similarity=0.9) < 0.9
+    
     @patch('redis.from_url')
     def test_redis_health_check(self, mock_redis):
         """测试Redis健康检查"""
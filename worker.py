@@ -3,13 +3,18 @@
 后台任务处理Worker
 """
 
+import os
+import gc
 import time
 import signal
 import sys
+import multiprocessing
 from dotenv import load_dotenv
 from src.core.config import Config
 from src.core.logger import setup_logger, get_logger
 from src.services.task_service import TaskService
+from src.services.task_queue import STAGES
+from src.services.whisper_service import preload_models
 
 # 加载环境变量
 load_dotenv()
@@ -21,11 +26,18 @@ logger = get_logger("worker")
 class TranslationWorker:
     """翻译任务处理Worker"""
     
-    def __init__(self):
-        """初始化Worker"""
+    def __init__(self, on_task_done=None):
+        """初始化Worker
+        
+        Args:
+            on_task_done: 每个任务处理结束后的回调 on_task_done(success)
+        """
         self.task_service = TaskService()
         self.running = True
         self.processed_tasks = 0
+        self.on_task_done = on_task_done
+        # 本Worker负责的阶段，按流水线顺序
+        self.stages = tuple(stage for stage in STAGES if stage in Config.WORKER_STAGES) or STAGES
         
         # 注册信号处理器
         signal.signal(signal.SIGINT, self._signal_handler)
@@ -40,42 +52,39 @@ class TranslationWorker:
         """启动Worker"""
         logger.info("Starting translation worker...")
         
+        # 预热：启动时加载模型，第一个任务不再等待模型加载
+        if Config.WHISPER_PRELOAD and 'stt' in self.stages:
+            loaded = preload_models()
+            logger.info(f"Preloaded Whisper models: {', '.join(loaded) or 'none'}")
+        
+        logger.info(f"Serving stages: {', '.join(self.stages)}")
+        last_reap = 0.0
+        
         while self.running:
             try:
-                # 从队列获取任务
-                if self.task_service.use_memory_storage:
-                    # 使用内存存储模式
-                    if self.task_service.task_queue:
-                        task_id = self.task_service.task_queue.pop(0)  # 从队列头部获取任务
-                        logger.info(f"Processing task from memory queue: {task_id}")
-                        
-                        # 处理任务
-                        success = self.task_service.process_task(task_id)
-                        
-                        if success:
-                            self.processed_tasks += 1
-                            logger.info(f"Task {task_id} completed successfully")
-                        else:
-                            logger.error(f"Task {task_id} failed")
-                    else:
-                        # 队列为空，等待一段时间
-                        time.sleep(1)
-                else:
-                    # 使用Redis模式
-                    task_id = self.task_service.redis_client.brpop('task_queue', timeout=1)
+                # 定期回收租约过期的任务（其他Worker崩溃或卡死）
+                if time.time() - last_reap >= Config.QUEUE_REAP_INTERVAL:
+                    self.task_service.reclaim_stalled_tasks()
+                    last_reap = time.time()
+                
+                stage, task_id = self._next_task()
+                
+                if task_id:
+                    queue = self.task_service.queues[stage]
+                    logger.info(f"Processing task {task_id} at stage {stage} (worker {queue.worker_id})")
                     
-                    if task_id:
-                        task_id = task_id[1].decode('utf-8')
-                        logger.info(f"Processing task from Redis: {task_id}")
-                        
-                        # 处理任务
-                        success = self.task_service.process_task(task_id)
-                        
-                        if success:
-                            self.processed_tasks += 1
-                            logger.info(f"Task {task_id} completed successfully")
-                        else:
-                            logger.error(f"Task {task_id} failed")
+                    # 处理期间持续续约；处理结束后（无论成败）确认出队
+                    with queue.lease(task_id):
+                        success = self.task_service.process_task(task_id, stage, self.stages)
+                    queue.ack(task_id)
+                    
+                    if success:
+                        self.processed_tasks += 1
+                        logger.info(f"Task {task_id} finished stage {stage}")
+                    else:
+                        logger.error(f"Task {task_id} failed")
+                    if self.on_task_done:
+                        self.on_task_done(success)
                 
                 # 检查内存使用情况
                 self._check_memory_usage()
@@ -89,6 +98,19 @@ class TranslationWorker:
         
         logger.info(f"Worker stopped. Processed {self.processed_tasks} tasks")
     
+    def _next_task(self):
+        """从负责的阶段队列中取一个任务，返回 (阶段, 任务ID)
+        
+        下游阶段优先，先完成已在途的任务；只在最后一个队列上阻塞等待1秒。
+        """
+        stages = list(reversed(self.stages))
+        for index, stage in enumerate(stages):
+            timeout = 1 if index == len(stages) - 1 else 0
+            task_id = self.task_service.queues[stage].pop(timeout=timeout)
+            if task_id:
+                return stage, task_id
+        return None, None
+    
     def _check_memory_usage(self):
         """检查内存使用情况"""
         try:
@@ -105,9 +127,171 @@ class TranslationWorker:
         except Exception as e:
             logger.error(f"Error checking memory usage: {str(e)}")
 
+class WorkerSupervisor:
+    """预fork Worker监督进程
+    
+    先在父进程中加载Whisper模型，再fork出 MAX_WORKERS 个 TranslationWorker 子进程，
+    模型权重以写时复制方式共享，节点内存不随进程数成倍增长。
+    子进程异常退出时自动重启；收到SIGTERM时通知子进程处理完当前任务后退出。
+    """
+    
+    def __init__(self, processes: int = None):
+        """初始化监督进程"""
+        self.processes = processes or Config.MAX_WORKERS
+        # 每个子进程槽位的 [成功数, 失败数]，共享内存在fork前创建
+        self.counts = multiprocessing.Array('q', self.processes * 2, lock=False)
+        self.children = {}  # pid -> 槽位
+        self.restarts = 0
+        self.running = True
+        self._last_counts = [0] * self.processes
+    
+    def _signal_handler(self, signum, frame):
+        """信号处理器"""
+        logger.info(f"Supervisor received signal {signum}, draining workers...")
+        self.running = False
+    
+    def _spawn(self, slot: int):
+        """fork一个子进程运行Worker"""
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._run_child(slot)
+            except BaseException as e:
+                logger.error(f"Worker {slot} crashed: {str(e)}")
+                code = 1
+            finally:
+                os._exit(code)
+        
+        self.children[pid] = slot
+        logger.info(f"Started worker {slot} (pid {pid})")
+    
+    def _run_child(self, slot: int):
+        """子进程入口"""
+        # 每个子进程平分CPU线程；并行来自多个进程，子进程内不再分块并行转录
+        try:
+            import torch
+            torch.set_num_threads(max(1, (os.cpu_count() or 1) // self.processes))
+        except Exception:
+            pass
+        Config.WHISPER_MAX_WORKERS = 1
+        
+        def on_task_done(success: bool):
+            self.counts[slot * 2 + (0 if success else 1)] += 1
+        
+        TranslationWorker(on_task_done=on_task_done).start()
+    
+    def stats(self):
+        """各子进程槽位累计处理的任务数 [{'slot', 'processed', 'failed'}]"""
+        return [
+            {'slot': slot, 'processed': self.counts[slot * 2], 'failed': self.counts[slot * 2 + 1]}
+            for slot in range(self.processes)
+        ]
+    
+    def _report(self, interval: float):
+        """汇报各子进程的吞吐量"""
+        pids = {slot: pid for pid, slot in self.children.items()}
+        for item in self.stats():
+            slot = item['slot']
+            done = item['processed'] + item['failed']
+            rate = (done - self._last_counts[slot]) * 60 / interval if interval else 0.0
+            self._last_counts[slot] = done
+            logger.info(
+                f"Worker {slot} (pid {pids.get(slot)}): {item['processed']} completed, "
+                f"{item['failed']} failed, {rate:.1f} tasks/min"
+            )
+    
+    def _reap_children(self, block: bool = False) -> bool:
+        """回收已退出的子进程，运行中时重启；返回是否回收到子进程"""
+        try:
+            pid, status = os.waitpid(-1, 0 if block else os.WNOHANG)
+        except ChildProcessError:
+            return False
+        if pid == 0:
+            return False
+        
+        slot = self.children.pop(pid, None)
+        if slot is None:
+            return True
+        if self.running:
+            logger.warning(f"Worker {slot} (pid {pid}) exited with status {status}, restarting")
+            self.restarts += 1
+            time.sleep(1)  # 避免启动即崩溃时频繁重启
+            self._spawn(slot)
+        return True
+    
+    def _drain(self):
+        """通知子进程处理完当前任务后退出，超过 TASK_TIMEOUT 仍未退出则强制结束"""
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        
+        deadline = time.time() + Config.TASK_TIMEOUT
+        while self.children and time.time() < deadline:
+            if not self._reap_children():
+                time.sleep(0.2)
+        
+        for pid, slot in list(self.children.items()):
+            # 被强制结束的任务由其他Worker在租约过期后回收
+            logger.warning(f"Worker {slot} (pid {pid}) did not exit in time, killing")
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+            self.children.pop(pid, None)
+    
+    def run(self):
+        """运行监督进程"""
+        logger.info(f"Starting worker supervisor with {self.processes} processes...")
+        signal.signal(signal.SIGINT, self._signal_handler)
+        signal.signal(signal.SIGTERM, self._signal_handler)
+        
+        # 在fork前加载模型；冻结GC使已有对象不被回收器遍历，减少写时复制产生的页面复制
+        if 'stt' in Config.WORKER_STAGES:
+            loaded = preload_models()
+            logger.info(f"Preloaded Whisper models: {', '.join(loaded) or 'none'}")
+        gc.freeze()
+        
+        for slot in range(self.processes):
+            self._spawn(slot)
+        
+        last_report = time.time()
+        while self.running:
+            if not self._reap_children():
+                time.sleep(0.5)
+            
+            elapsed = time.time() - last_report
+            if elapsed >= Config.WORKER_REPORT_INTERVAL:
+                self._report(elapsed)
+                last_report = time.time()
+        
+        self._drain()
+        self._report(time.time() - last_report)
+        logger.info(f"Worker supervisor stopped. Restarts: {self.restarts}")
+
+def _redis_available() -> bool:
+    """检查Redis是否可用（预fork模式的子进程通过Redis共享队列）"""
+    try:
+        import redis
+        client = redis.from_url(Config.REDIS_URL)
+        client.ping()
+        client.close()
+        return True
+    except Exception:
+        return False
+
 def main():
     """主函数"""
     try:
+        if Config.WORKER_PREFORK and Config.MAX_WORKERS > 1:
+            if _redis_available():
+                WorkerSupervisor().run()
+                return
+            logger.warning("Prefork mode requires Redis, falling back to a single worker")
+        
         worker = TranslationWorker()
         worker.start()
     except Exception as e: